@@ -14,29 +14,25 @@ import webinspect
 import glob
 
 def BLS_average(abf):
-    T1,T2=epochTimes(abf)
+    table=abf.epochTable()
+    T1,T2=table["T1"][2],table["T2"][2]
     Tdiff=max([T2-T1,.1])
-    X1,X2=T1-Tdiff,T2+Tdiff
-    I1,I2=X1*abf.pointsPerSec,X2*abf.pointsPerSec
+    stack=swhlab.analysis.stack.stack_epoch(abf,2,Tdiff,T2-T1+Tdiff)
+    Xs=stack.Xs+T1
+    X1,X2=Xs[0],Xs[-1]
 
     plt.figure(figsize=(10,10))
-    chunks=np.empty((abf.sweeps,I2-I1))
-    Xs=np.array(abf.sweepX2[I1:I2])
-    for sweep in abf.setsweeps():
-        chunks[sweep]=abf.sweepY[I1:I2]
-        plt.subplot(211)
-        plt.plot(Xs,chunks[sweep],alpha=.2,color='.5',lw=2)
-        plt.subplot(212)
-        plt.plot(Xs,chunks[sweep]+100*sweep,alpha=.5,color='b',lw=2)
-
     plt.subplot(211)
-    plt.plot(Xs,np.average(chunks,axis=0),alpha=.5,lw=2)
+    plt.plot(Xs,stack.chunks.T,alpha=.2,color='.5',lw=2)
+    plt.plot(Xs,stack.average,alpha=.5,lw=2)
     plt.title("%s.abf - BLS - average of %d sweeps"%(abf.ID,abf.sweeps))
     plt.ylabel(abf.units2)
     plt.axvspan(T1,T2,alpha=.1,color='y',lw=0)
     plt.axis([X1,X2,None,None])
 
     plt.subplot(212)
+    offsets=100*np.arange(len(stack))[:,None]
+    plt.plot(Xs,(stack.chunks+offsets).T,alpha=.5,color='b',lw=2)
     plt.xlabel("time (sec)")
     plt.ylabel("stacked sweeps")
     plt.axvspan(T1,T2,alpha=.1,color='y',lw=0)
@@ -46,6 +46,15 @@ loglevel=loglevel_QUIET # change this at will
 
 from swhlab.version import __version__
 from swhlab.core import ABF
+import swhlab.fitting
 from swhlab.plotting.core import ABFplot as PLOT
 from swhlab.analysis.ap import AP
+import swhlab.analysis.spikes
+import swhlab.analysis.apstream
+import swhlab.analysis.events
+import swhlab.analysis.spectral
+import swhlab.analysis.memtest
+import swhlab.analysis.stack
+import swhlab.analysis.evoked
+import swhlab.analysis.pipeline
 from swhlab.indexing import imaging
\ No newline at end of file
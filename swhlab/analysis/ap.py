@@ -219,58 +219,31 @@ class AP:
             * "average" - average instanteous frequency per sweep.
             * "median" - median instanteous frequency per sweep.
         """
+        from swhlab.analysis.spikes import SpikeTrain # avoid circular import
         self.ensureDetection()
-        bySweepTimes=[[]]*self.abf.sweeps
-
-        # determine AP spike times by sweep
-        for sweep in range(self.abf.sweeps):
-            sweepTimes=[]
-            for ap in self.APs:
-                if ap["sweep"]==sweep:
-                    sweepTimes.append(ap["Tsweep"])
-            bySweepTimes[sweep]=sweepTimes
-
-        # determine instantaneous frequencies by sweep
-        bySweepFreqs=[[]]*self.abf.sweeps
-        for i,times in enumerate(bySweepTimes):
-            if len(times)<2:
-                continue
-            diffs=np.array(times[1:])-np.array(times[:-1])
-            bySweepFreqs[i]=np.array(1/diffs).tolist()
+        train=SpikeTrain(self)
 
         # give the user what they want
         if feature == "freqs":
-            return bySweepFreqs
+            sweep,isi=train.isi()
+            splits=np.cumsum(np.bincount(sweep,minlength=self.abf.sweeps))[:-1]
+            return [x.tolist() for x in np.split(1/isi,splits)]
 
         elif feature == "firsts":
-            result=np.zeros(self.abf.sweeps) # initialize to this
-            for i,freqs in enumerate(bySweepFreqs):
-                if len(freqs):
-                    result[i]=freqs[0]
-            return result
+            return np.nan_to_num(train.freq_first())
 
         elif feature == "times":
-            return bySweepTimes
+            splits=np.cumsum(train.counts)[:-1]
+            return [x.tolist() for x in np.split(train.times,splits)]
 
         elif feature == "count":
-            result=np.zeros(self.abf.sweeps) # initialize to this
-            for i,times in enumerate(bySweepTimes):
-                result[i]=len(bySweepTimes[i])
-            return result
+            return train.count()
 
         elif feature == "average":
-            result=np.zeros(self.abf.sweeps) # initialize to this
-            for i,freqs in enumerate(bySweepFreqs):
-                if len(freqs):
-                    result[i]=np.nanmean(freqs)
-            return result
+            return np.nan_to_num(train.freq_mean())
 
         elif feature == "median":
-            result=np.zeros(self.abf.sweeps) # initialize to this
-            for i,freqs in enumerate(bySweepFreqs):
-                if len(freqs):
-                    result[i]=np.nanmedian(freqs)
-            return result
+            return np.nan_to_num(train.freq_median())
 
         else:
             self.log.error("get_bySweep() can't handle [%s]",feature)
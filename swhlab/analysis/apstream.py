@@ -0,0 +1,258 @@
+"""
+streaming (online) action potential detection.
+
+swhlab.analysis.ap expects an entire sweep to be in memory, and APs within a
+few ms of a sweep edge may be lost. The APstream class here uses the same
+derivative threshold detection, but consumes data in chunks of any size and
+carries its state (the tail of the trace, pending threshold crossings, and
+the last AP) across chunk boundaries. Only a few ms of data are kept between
+calls, so multi-hour continuous recordings can be analyzed with bounded memory,
+and files still being written can be followed as they grow.
+
+Typical use:
+    stream=APstream(abf.pointsPerSec)
+    for chunk in fileChunks(fname,offset,follow=True):
+        for ap in stream.feed(chunk):
+            print(ap["T"],stream.rate())
+    stream.flush()
+"""
+
+import time
+import logging
+import collections
+import numpy as np
+
+import swhlab
+
+ms=.001 # easy access to a millisecond
+
+class APstream:
+    def __init__(self,rate,detect_over=50):
+        """
+        Prepare a streaming AP detector.
+
+        Arguments:
+            rate - sample rate (Hz) of the data to be fed in
+            detect_over - dV/dt threshold (mV/ms) which starts an AP
+        """
+        self.log = logging.getLogger("swhlab APstream")
+        self.log.setLevel(swhlab.loglevel)
+
+        self.pointsPerSec=int(rate)
+        self.pointsPerMs=int(self.pointsPerSec/1000.0)
+        self.detect_over=detect_over # must be at least this (mV/ms)
+
+        # how much data must exist around a crossing to analyze it
+        self.lookBack=1*self.pointsPerMs # walk back up to 1ms to +10 V/S
+        self.lookAhead=15*self.pointsPerMs # 5ms to go down, 10ms to recover
+        self.minInterval=2*self.pointsPerMs # >500 Hz can't be real
+
+        self.recentSec=10 # keep AP times this long for rate()
+        self.reset()
+
+    def reset(self):
+        """forget all state (call between discontinuous recordings)."""
+        self.buffer=np.array([]) # tail of the trace not yet fully analyzed
+        self.bufferStart=0 # absolute sample index of buffer[0]
+        self.scanFrom=0 # absolute index where crossing detection resumes
+        self.lastI=-np.inf # absolute index of the last accepted AP
+        self.count=0 # number of APs detected
+        self.recent=collections.deque() # times of recent APs (for rate)
+
+    ### DETECTION
+
+    def feed(self,chunk):
+        """
+        Add the next chunk of data (mV) and return a list of new AP dicts.
+        APs near the end of the chunk are reported once enough data follows.
+        """
+        chunk=np.asarray(chunk,dtype=float)
+        if not len(chunk):
+            return []
+        self.buffer=np.concatenate((self.buffer,chunk))
+        return self.analyze(final=False)
+
+    def flush(self):
+        """analyze whatever is left in the buffer (call after the last chunk)."""
+        APs=self.analyze(final=True)
+        self.bufferStart+=len(self.buffer)
+        self.scanFrom=self.bufferStart
+        self.buffer=np.array([])
+        return APs
+
+    def analyze(self,final=False):
+        """detect and measure APs in the buffer, then trim it."""
+        Y=self.buffer
+        if len(Y)<2:
+            return []
+
+        # only scan where there is enough data after a crossing to analyze it
+        scanStart=max(1,self.scanFrom-self.bufferStart)
+        if not final and len(Y)<=scanStart+self.lookAhead:
+            return [] # wait for more data (keep the whole buffer)
+        scanEnd=len(Y) if final else len(Y)-self.lookAhead
+        scanEnd=max(scanEnd,scanStart)
+        D=np.diff(Y)*self.pointsPerMs # derivative (V/s, same as ABF.sweepD)
+        D=np.insert(D,0,D[0])
+        above=D>self.detect_over
+        Is=np.where(above[scanStart:scanEnd]&~above[scanStart-1:scanEnd-1])[0]
+        Is+=scanStart
+
+        APs=[]
+        for I in Is:
+            ap=self.measure(Y,D,I)
+            if ap is None:
+                continue
+            self.lastI=ap["I"]
+            self.count+=1
+            self.recent.append(ap["T"])
+            APs.append(ap)
+        while len(self.recent) and self.recent[0]<self.time()-self.recentSec:
+            self.recent.popleft()
+
+        # keep only what future crossings may need to look back into
+        self.scanFrom=self.bufferStart+max(scanEnd,scanStart)
+        keepFrom=max(0,scanEnd-self.lookBack-1)
+        self.buffer=self.buffer[keepFrom:]
+        self.bufferStart+=keepFrom
+        return APs
+
+    def measure(self,Y,D,I):
+        """
+        given a crossing at buffer index I, return an AP dict or None.
+        The criteria match AP.detectSweep() in swhlab.analysis.ap.
+        """
+        pointsPerMs=self.pointsPerMs
+
+        # dV/dT must cross below -10 V/S within 2 ms
+        if np.min(D[I:I+2*pointsPerMs])>-10:
+            return None
+
+        # walk 1ms backwards and find point of +10 V/S threshold crossing
+        stepBack=0
+        while I-stepBack>0 and D[I-stepBack]>10 and stepBack<pointsPerMs:
+            stepBack+=1
+        I-=stepBack
+        absI=self.bufferStart+I
+        if absI-self.lastI<self.minInterval:
+            return None
+
+        # fast component: first dip below -10 V/S and recovery above it
+        chunk=D[I:I+5*pointsPerMs]
+        if not np.any(chunk<-10):
+            return None
+        I_toNegTen=np.where(chunk<-10)[0][0]
+        chunk=D[I+I_toNegTen:I+I_toNegTen+10*pointsPerMs]
+        if not np.any(chunk>-10):
+            return None # probably a pre-AP "bump" to be ignored
+        I_recover=np.where(chunk>-10)[0][0]+I_toNegTen+I
+
+        ap={}
+        ap["I"]=absI # absolute sample index of AP start
+        ap["T"]=absI/self.pointsPerSec # time since the first sample fed (sec)
+        ap["Vthreshold"]=Y[I]
+        ap["dVfastMS"]=(I_recover-I)/pointsPerMs
+        ap["dVmax"]=np.max(D[I:I_recover])
+        ap["dVmin"]=np.min(D[I:I_recover])
+
+        # slow AP shape from a 10ms chunk
+        chunk=Y[I:I+10*pointsPerMs]
+        ap["Vmax"]=np.max(chunk)
+        ap["VmaxI"]=np.argmax(chunk)+absI
+        ap["msRiseTime"]=(ap["VmaxI"]-absI)/pointsPerMs
+        ap["Vhalf"]=np.average([ap["Vmax"],ap["Vthreshold"]])
+        ap["msHalfwidth"]=np.nan
+        over=np.where(chunk>=ap["Vhalf"])[0]
+        under=np.where(chunk[over[0]:]<ap["Vhalf"])[0] if len(over) else []
+        if len(under):
+            ap["msHalfwidth"]=under[0]/pointsPerMs
+        return ap
+
+    ### LIVE STATISTICS
+
+    def time(self):
+        """return the time (sec) of the newest sample fed."""
+        return (self.bufferStart+len(self.buffer))/self.pointsPerSec
+
+    def rate(self,window=1.0):
+        """return the AP frequency (Hz) over the last window seconds."""
+        window=min(window,self.recentSec,max(self.time(),1.0/self.pointsPerSec))
+        tNow=self.time()
+        n=sum(1 for t in self.recent if t>=tNow-window)
+        return n/window
+
+### CHUNK SOURCES
+
+def abfChunks(abf,chunkSec=1.0):
+    """
+    yield chunks (mV) of every sweep of an ABF in order.
+    Each sweep is split into pieces no longer than chunkSec.
+    """
+    chunkSize=int(chunkSec*abf.pointsPerSec)
+    for sweep in abf.setsweeps():
+        for i in range(0,len(abf.sweepY),chunkSize):
+            yield abf.sweepY[i:i+chunkSize]
+
+def fileChunks(fname,offset=0,dtype=np.int16,scale=1.0,channels=1,channel=0,
+               chunkSize=2**16,follow=False,timeout=10,pollSec=.5):
+    """
+    yield chunks of a raw binary data file, optionally while it grows.
+
+    Arguments:
+        offset - byte position where sample data starts
+        dtype, scale - samples are read as dtype and multiplied by scale
+        channels, channel - de-interleave multichannel data
+        chunkSize - maximum number of samples (per channel) per chunk
+        follow - if True, keep waiting for new data (like "tail -f")
+        timeout - stop following if the file doesn't grow for this long
+    """
+    dtype=np.dtype(dtype)
+    frameBytes=dtype.itemsize*channels
+    with open(fname,'rb') as f:
+        f.seek(offset)
+        lastGrowth=time.time()
+        while True:
+            raw=f.read(frameBytes*chunkSize)
+            nFrames=len(raw)//frameBytes
+            if len(raw)%frameBytes:
+                f.seek(f.tell()-len(raw)%frameBytes) # partial frame, wait
+            if nFrames:
+                lastGrowth=time.time()
+                data=np.frombuffer(raw[:nFrames*frameBytes],dtype=dtype)
+                yield data.reshape(nFrames,channels)[:,channel]*scale
+                continue
+            if not follow or time.time()-lastGrowth>timeout:
+                return
+            time.sleep(pollSec)
+
+def detectABF(abf,chunkSec=1.0,detect_over=50):
+    """
+    run streaming detection across every sweep of an ABF and return a list of
+    AP dicts with "sweep" and "Tsweep" added. If sweeps are contiguous (no gap
+    between them) detection state carries across sweep boundaries, so APs
+    right at the edge of a sweep are no longer lost.
+    """
+    stream=APstream(abf.pointsPerSec,detect_over)
+    contiguous=abs(abf.sweepInterval-abf.sweepLength)<abf.period
+    chunkSize=int(chunkSec*abf.pointsPerSec)
+    APs=[]
+    for sweep in range(abf.sweeps):
+        abf.setsweep(sweep)
+        if not contiguous:
+            stream.reset()
+        for i in range(0,abf.sweepSize,chunkSize):
+            APs.extend(stream.feed(abf.sweepY[i:i+chunkSize]))
+        if not contiguous or sweep==abf.sweeps-1:
+            APs.extend(stream.flush())
+        for ap in [x for x in APs if not "sweep" in x]:
+            if not contiguous:
+                ap["T"]+=sweep*abf.sweepInterval # stream restarted this sweep
+            ap["sweep"]=int(ap["T"]/abf.sweepInterval)
+            ap["Tsweep"]=ap["T"]-ap["sweep"]*abf.sweepInterval
+    return APs
+
+if __name__=="__main__":
+    abfFile=r"C:\Users\scott\Documents\important\abfs\16o14018.abf"
+    abf=swhlab.ABF(abfFile)
+    print("%d APs"%len(detectABF(abf)))
+    print("DONE")
@@ -0,0 +1,357 @@
+"""
+methods related to detection/reporting of synaptic events (EPSCs and IPSCs).
+
+Detection uses the sliding scaled-template method (Clements and Bekkers, 1997).
+At every point a PSC-shaped template is scaled and offset to best fit the data
+that follows, and the detection criterion is the fitted scale divided by the
+standard error of the fit. Rather than fitting every point in a loop, the sums
+the least-squares solution needs are computed for every sweep at once:
+    * sum(template*data) for every position by FFT cross-correlation
+    * sum(data) and sum(data**2) for every position by running (cumulative) sums
+so detection is O(N log N) per sweep and vectorized across sweeps.
+
+A second detection engine deconvolves every sweep with the same bi-exponential
+PSC kernel (Pernia-Andrade et al., 2012). Each event becomes a sharp peak in the
+deconvolved trace, which is thresholded at a multiple of its robust standard
+deviation. Kernel spectra are cached (swhlab.common.kernel_psc_spectrum) and
+applied to the whole sweep matrix with a single rfft along axis 1, which makes
+this the fastest option for high-frequency spontaneous events.
+
+Event data is stored in a numpy structured array (one row per event) so it
+can be saved directly as ./swhlab/ID_data_events.npy.
+"""
+
+import logging
+import numpy as np
+
+import swhlab
+from swhlab.core import ABF
+import swhlab.common as cm
+
+ms=.001 # easy access to a millisecond
+
+EVENT_DTYPE=[("sweep",int), # sweep containing the event
+             ("I",int), # index of event onset in the sweep
+             ("Tsweep",float), # time of event onset in the sweep (sec)
+             ("T",float), # time of event onset in the experiment (sec)
+             ("criterion",float), # detection criterion at the onset
+             ("baseline",float), # average value just before onset
+             ("amplitude",float), # peak minus baseline (signed)
+             ("msRise",float), # 10-90% rise time
+             ("msDecay",float), # time from peak to 37% of amplitude
+             ]
+
+def template_criterion(data,template):
+    """
+    Given a 2d array (sweep,point) and a 1d template, return the scaled
+    template fit at every position as (scale,criterion). Both are 2d arrays
+    with len(template)-1 fewer points per sweep than data.
+    """
+    data=np.atleast_2d(data)
+    N=len(template)
+    nPos=data.shape[1]-N+1
+    if nPos<1:
+        empty=np.empty((len(data),0))
+        return empty,empty
+
+    # sum(template*data) at every position via FFT cross-correlation
+    size=cm.fftSize(data.shape[1]+N-1)
+    spectrum=np.fft.rfft(data,size,axis=1)
+    spectrum*=np.conj(np.fft.rfft(template,size))
+    sumTD=np.fft.irfft(spectrum,size,axis=1)[:,:nPos]
+
+    # sum(data) and sum(data**2) at every position via running sums
+    zeros=np.zeros((len(data),1))
+    cumD=np.hstack((zeros,np.cumsum(data,axis=1)))
+    cumD2=np.hstack((zeros,np.cumsum(data**2,axis=1)))
+    sumD=cumD[:,N:]-cumD[:,:nPos]
+    sumD2=cumD2[:,N:]-cumD2[:,:nPos]
+
+    # least squares scale and offset of the template at every position
+    sumT,sumT2=np.sum(template),np.sum(template**2)
+    scale=(sumTD-sumT*sumD/N)/(sumT2-sumT**2/N)
+    offset=(sumD-scale*sumT)/N
+    sse=(sumD2+scale**2*sumT2+N*offset**2
+         -2*(scale*sumTD+offset*sumD-scale*offset*sumT))
+    stdErr=np.sqrt(np.maximum(sse,0)/(N-1))
+    stdErr[stdErr==0]=np.inf
+    return scale,scale/stdErr
+
+def deconvolve(data,spectrum,fftLength,filterPoints=None):
+    """
+    Given a 2d array (sweep,point) and the rfft of a kernel, return the
+    deconvolved data (same shape). Each sweep's median is subtracted first.
+    If filterPoints is given, the result is gaussian low-pass filtered (in the
+    frequency domain) to remove the noise deconvolution amplifies.
+    """
+    data=np.atleast_2d(data)
+    size=data.shape[1]
+    centered=data-np.median(data,axis=1)[:,None]
+    deconv=np.fft.rfft(centered,fftLength,axis=1)
+    power=np.abs(spectrum)**2
+    deconv*=np.conj(spectrum)/(power+np.max(power)*1e-6) # regularized division
+    if filterPoints:
+        freqs=np.fft.rfftfreq(fftLength) # cycles per point
+        deconv*=np.exp(-2*(np.pi*freqs*filterPoints)**2)
+    return np.fft.irfft(deconv,fftLength,axis=1)[:,:size]
+
+def robust_sd(data):
+    """return the standard deviation of every row estimated from its MAD."""
+    deviation=np.abs(data-np.median(data,axis=1)[:,None])
+    return 1.4826*np.median(deviation,axis=1)
+
+def find_peaks(criterion,threshold,minSpacing):
+    """
+    Given a 2d criterion array, return (row,col) of the maximum of every run
+    of points above threshold. Peaks closer than minSpacing to a previous
+    peak in the same row are discarded.
+    """
+    nRows,nCols=criterion.shape
+    above=np.zeros((nRows,nCols+2),dtype=bool)
+    above[:,1:-1]=criterion>threshold
+    edges=np.diff(above.astype(np.int8),axis=1).ravel()
+    width=nCols+1
+    starts=np.where(edges==1)[0]
+    ends=np.where(edges==-1)[0]
+    rows=starts//width
+    starts,ends=starts%width,ends%width
+    if not len(starts):
+        return np.array([],dtype=int),np.array([],dtype=int)
+
+    # index of the maximum of each run
+    flat=criterion.ravel()
+    flatStarts=rows*nCols+starts
+    runMax=np.maximum.reduceat(flat,flatStarts)
+    # reduceat runs until the next start, so mask values beyond each run end
+    lengths=ends-starts
+    offsets=np.repeat(flatStarts,lengths)+ranges(lengths)
+    isMax=flat[offsets]==np.repeat(runMax,lengths)
+    runID=np.repeat(np.arange(len(starts)),lengths)
+    firstMax=np.unique(runID[isMax],return_index=True)[1]
+    peaks=offsets[isMax][firstMax]
+    rows,cols=peaks//nCols,peaks%nCols
+
+    # enforce spacing between peaks within a row
+    keep=np.ones(len(peaks),dtype=bool)
+    last=-np.inf
+    for i in range(len(peaks)):
+        if i and rows[i]!=rows[i-1]:
+            last=-np.inf
+        if cols[i]-last<minSpacing:
+            keep[i]=False
+        else:
+            last=cols[i]
+    return rows[keep],cols[keep]
+
+def ranges(lengths):
+    """return the concatenation of np.arange(n) for every n in lengths."""
+    if not len(lengths):
+        return np.array([],dtype=int)
+    starts=np.cumsum(lengths)-lengths
+    return np.arange(np.sum(lengths))-np.repeat(starts,lengths)
+
+def gather(data,rows,cols,size):
+    """
+    return a 2d array (event,point) of size points of data starting at each
+    (row,col). Points beyond the edge of a row are np.nan.
+    """
+    cols=np.asarray(cols)[:,None]+np.arange(size)
+    valid=(cols>=0)&(cols<data.shape[1])
+    chunks=data[np.asarray(rows)[:,None],np.clip(cols,0,data.shape[1]-1)]
+    return np.where(valid,chunks,np.nan)
+
+def measure(data,rows,cols,sign,pointsPerMs,baselinePoints,windowPoints):
+    """
+    Return a dict of arrays (baseline, amplitude, msRise, msDecay) describing
+    the events starting at each (row,col) of data. All events are measured at
+    once from windows gathered into a 2d array. Baseline windows are clipped
+    to the start of the sweep (an event at its first point uses that point).
+    """
+    cols=np.asarray(cols)
+    starts=np.clip(cols-baselinePoints,0,None)
+    base=gather(data,rows,starts,baselinePoints)
+    room=np.maximum(cols-starts,1)
+    base[np.arange(baselinePoints)[None,:]>=room[:,None]]=np.nan
+    baseline=np.nanmean(base,axis=1) if len(rows) else np.array([])
+    window=gather(data,rows,cols,windowPoints)
+    signed=sign*(window-baseline[:,None])
+    signed[np.isnan(signed)]=-np.inf
+    peakI=np.argmax(signed,axis=1)
+    ampSigned=signed[np.arange(len(rows)),peakI]
+    points=np.arange(windowPoints)[None,:]
+    frac=signed/ampSigned[:,None]
+
+    # 10-90% rise time (only look before the peak)
+    beforePeak=points<=peakI[:,None]
+    I10=np.argmax(beforePeak&(frac>=.1),axis=1)
+    I90=np.argmax(beforePeak&(frac>=.9),axis=1)
+
+    # decay to 37% of the amplitude (only look after the peak)
+    decayed=(points>peakI[:,None])&(frac<=np.exp(-1))
+    IDecay=np.argmax(decayed,axis=1)
+    msDecay=(IDecay-peakI)/pointsPerMs
+    msDecay[~np.any(decayed,axis=1)]=np.nan
+
+    return {"baseline":baseline,
+            "amplitude":sign*ampSigned,
+            "msRise":(I90-I10)/pointsPerMs,
+            "msDecay":msDecay}
+
+class Events:
+    def __init__(self,abf):
+        """
+        Load an ABF and get ready to do synaptic event detection.
+        After detect(), events are stored as a structured array in
+        Events.events (fields are listed in EVENT_DTYPE).
+        """
+        self.log = logging.getLogger("swhlab events")
+        self.log.setLevel(swhlab.loglevel)
+
+        if abf in [None,False,'']:
+            self.log.error("given invalid abf: [%s]",str(abf))
+            return
+
+        # prepare ABF class
+        if type(abf) is str:
+            self.log.debug("filename given, turning it into an ABF class")
+            abf=ABF(abf)
+        self.abf=abf
+
+        # detection settings
+        self.method="template" # "template" or "deconvolution"
+        self.sign=-1 # -1 for downward events (EPSCs in VC), 1 for upward
+        self.tauRise=.5 # template rise time constant (ms)
+        self.tauDecay=5 # template decay time constant (ms)
+        self.templateMS=25 # length of the template (ms)
+        self.threshold=4 # criterion (scale/standard error) must exceed this
+        self.deconvThreshold=4 # deconvolved peaks must exceed this many SDs
+        self.deconvFilterMS=1 # low-pass sigma applied after deconvolution
+        self.baselineMS=2 # baseline is the average of this much before onset
+        self.detect_time1 = 0 # event detection starts here (sec)
+        self.detect_time2 = abf.sweepLength # event detection ends here (sec)
+
+        # data storage
+        self.events=False # becomes a structured array when detect() is run
+
+    def info(self):
+        print("%d events in memory."%len(self.events))
+
+    def template(self):
+        """return the PSC template as defined by the current settings."""
+        pointsPerMs=self.abf.pointsPerMs
+        return cm.kernel_psc(self.templateMS*pointsPerMs,
+                             self.tauRise*pointsPerMs,
+                             self.tauDecay*pointsPerMs)
+
+    ### DETECTION
+
+    def ensureDetection(self):
+        """run detection if it hasn't been run yet."""
+        if self.events is False:
+            self.log.debug("analysis attempted before event detection...")
+            self.detect()
+
+    def detect(self,data=None):
+        """
+        detect events in every sweep at once. If data (a 2d array of sweeps)
+        isn't given, the ABF's sweep matrix is used.
+        """
+        t1=cm.timeit()
+        if data is None:
+            data=self.abf.sweepMatrix()
+        if self.method=="deconvolution":
+            criterion,threshold=self.criterion_deconvolution(data)
+        else:
+            criterion,threshold=self.criterion_template(data)
+
+        # limit detection to the time window of interest
+        I1=int(self.detect_time1*self.abf.pointsPerSec)
+        I2=int(self.detect_time2*self.abf.pointsPerSec)
+        criterion[:,:max(I1,0)]=-np.inf
+        criterion[:,max(I2,0):]=-np.inf
+        minSpacing=self.tauRise*self.abf.pointsPerMs*2
+        if self.method=="template":
+            minSpacing=self.templateMS*self.abf.pointsPerMs/2
+        rows,cols=find_peaks(criterion,threshold,minSpacing)
+        self.fromPeaks(data,rows,cols,criterion[rows,cols])
+        self.log.info("%s detection on %d sweeps found %d events (%s)",
+                      self.method,len(data),len(self.events),cm.timeit(t1))
+
+    def criterion_template(self,data):
+        """return (criterion,threshold) for scaled template matching."""
+        scale,criterion=template_criterion(data,self.template())
+        return criterion*self.sign,self.threshold # positive means matching
+
+    def criterion_deconvolution(self,data):
+        """
+        return (criterion,threshold) for deconvolution. The criterion is the
+        deconvolved trace in units of its robust standard deviation.
+        """
+        fftLength,spectrum=cm.kernel_psc_spectrum(self.abf.pointsPerSec,
+                                                  data.shape[1],self.tauRise,
+                                                  self.tauDecay,self.templateMS)
+        deconv=deconvolve(data,spectrum,fftLength,
+                          self.deconvFilterMS*self.abf.pointsPerMs)
+        deconv*=self.sign
+        deconv/=robust_sd(deconv)[:,None]
+        return deconv,self.deconvThreshold
+
+    def fromPeaks(self,data,rows,cols,criterion):
+        """measure events at the given (sweep,index) and store them."""
+        pointsPerMs=self.abf.pointsPerMs
+        stats=measure(data,rows,cols,self.sign,pointsPerMs,
+                      int(self.baselineMS*pointsPerMs),
+                      int(self.templateMS*pointsPerMs))
+        events=np.zeros(len(rows),dtype=EVENT_DTYPE)
+        events["sweep"]=rows
+        events["I"]=cols
+        events["Tsweep"]=cols/self.abf.pointsPerSec
+        events["T"]=events["Tsweep"]+rows*self.abf.sweepInterval
+        events["criterion"]=criterion
+        for key in stats:
+            events[key]=stats[key]
+        self.events=events
+
+    def save(self):
+        """save the event table as ./swhlab/ID_data_events.npy"""
+        self.ensureDetection()
+        self.abf.output_touch()
+        cm.save_atomic(self.abf.outPre+"data_events.npy",
+                       lambda f:np.save(f,self.events))
+
+    ### ANALYSIS
+
+    def get_bySweep(self,feature="count"):
+        """
+        returns event info by sweep as an array (one value per sweep).
+
+        feature:
+            * "count" - number of events per sweep.
+            * "freq" - event frequency (Hz) per sweep.
+            * "amplitude" - average event amplitude per sweep.
+            * "charge" - sum of event amplitudes per sweep.
+        """
+        self.ensureDetection()
+        sweeps=self.events["sweep"]
+        count=np.bincount(sweeps,minlength=self.abf.sweeps).astype(float)
+        if feature=="count":
+            return count
+        elif feature=="freq":
+            return count/(self.detect_time2-self.detect_time1)
+        elif feature in ["amplitude","charge"]:
+            total=np.bincount(sweeps,weights=self.events["amplitude"],
+                              minlength=self.abf.sweeps)
+            if feature=="charge":
+                return total
+            with np.errstate(invalid='ignore',divide='ignore'):
+                return total/count
+        else:
+            self.log.error("get_bySweep() can't handle [%s]",feature)
+            return None
+
+if __name__=="__main__":
+    abfFile=r"X:\Data\2P01\2016\2016-09-01 PIR TGOT\16d07022.abf"
+    events=Events(abfFile)
+    events.detect()
+    print(events.get_bySweep("freq"))
+    print("DONE")
@@ -0,0 +1,128 @@
+"""
+measurement of evoked responses (like optogenetic BLS responses) in every
+sweep of an ABF at once.
+
+The stimulus is found in the epoch table, every sweep is stacked around it
+(swhlab.analysis.stack), and responses are measured with axis-wise operations
+on the stacked windows:
+    * baseline - average of the window before the stimulus
+    * amplitude - peak minus baseline (signed)
+    * latency - time from stimulus onset to 10% of the peak (ms)
+    * timeToPeak - time from stimulus onset to the peak (ms)
+    * msRise - 10-90% rise time (ms)
+    * msDecay - time from the peak to 37% of the amplitude (ms)
+    * area - integral of the response relative to baseline (units*sec)
+
+Results are returned as a structured array with one row per sweep, ready to
+be plotted against time or saved.
+"""
+
+import logging
+import numpy as np
+
+import swhlab
+import swhlab.common as cm
+from swhlab.analysis.stack import stack_epoch
+
+EVOKED_DTYPE=[("sweep",int), # sweep number
+              ("T",float), # time of the stimulus in the experiment (sec)
+              ("baseline",float), # average value before the stimulus
+              ("amplitude",float), # peak minus baseline (signed)
+              ("latency",float), # stimulus onset to 10% of the peak (ms)
+              ("timeToPeak",float), # stimulus onset to the peak (ms)
+              ("msRise",float), # 10-90% rise time (ms)
+              ("msDecay",float), # time from peak to 37% of amplitude (ms)
+              ("area",float), # integral of the response (units*sec)
+              ]
+
+def measure_stack(stack,sign=None,pointsPerMs=None):
+    """
+    Measure the response in every window of a Stack (aligned so the stimulus
+    is at Xs=0). If sign is None, it's the sign of the largest deflection of
+    the average response. Returns a dict of arrays.
+    """
+    if pointsPerMs is None:
+        pointsPerMs=1.0/(stack.Xs[1]-stack.Xs[0])/1000
+    before,after=stack.Xs<0,stack.Xs>=0
+    with np.errstate(invalid='ignore'):
+        baseline=np.nanmean(stack.chunks[:,before],axis=1)
+        response=stack.chunks[:,after]-baseline[:,None]
+        if sign is None:
+            average=np.nanmean(response,axis=0)
+            sign=1 if np.nanmax(average)>=-np.nanmin(average) else -1
+        signed=sign*response
+        area=np.nansum(response,axis=1)/(pointsPerMs*1000)
+    signed[np.isnan(signed)]=-np.inf
+    peakI=np.argmax(signed,axis=1)
+    ampSigned=signed[np.arange(len(signed)),peakI]
+    points=np.arange(signed.shape[1])[None,:]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        frac=signed/ampSigned[:,None]
+
+    # 10% and 90% crossings (only look before the peak)
+    beforePeak=points<=peakI[:,None]
+    I10=np.argmax(beforePeak&(frac>=.1),axis=1)
+    I90=np.argmax(beforePeak&(frac>=.9),axis=1)
+
+    # decay to 37% of the amplitude (only look after the peak)
+    decayed=(points>peakI[:,None])&(frac<=np.exp(-1))
+    IDecay=np.argmax(decayed,axis=1)
+    msDecay=(IDecay-peakI)/pointsPerMs
+    msDecay[~np.any(decayed,axis=1)]=np.nan
+
+    measured=np.isfinite(ampSigned)&(ampSigned>0)
+    stats={"baseline":baseline,
+           "amplitude":sign*ampSigned,
+           "latency":I10/pointsPerMs,
+           "timeToPeak":peakI/pointsPerMs,
+           "msRise":(I90-I10)/pointsPerMs,
+           "msDecay":msDecay,
+           "area":area}
+    for key in stats:
+        if key!="baseline":
+            stats[key]=np.where(measured,stats[key],np.nan)
+    return stats
+
+def evoked(abf,epoch=2,baselineMS=50,windowMS=None,sign=None,saveToo=False):
+    """
+    measure the response to a stimulus starting at an epoch (A=0, B=1, ...)
+    in every sweep of an ABF and return a structured array (fields are listed
+    in EVOKED_DTYPE). The response window lasts windowMS from stimulus onset
+    (default: the epoch duration plus 100 ms). If saveToo, save it as
+    ./swhlab/ID_data_evoked.npy
+    """
+    log=logging.getLogger("swhlab evoked")
+    t1=cm.timeit()
+    table=abf.epochTable()
+    if epoch>=len(table):
+        log.error("protocol doesn't have epoch %d",epoch)
+        return None
+    if windowMS is None:
+        windowMS=(table["T2"][epoch]-table["T1"][epoch])*1000+100
+    stack=stack_epoch(abf,epoch,baselineMS/1000.0,windowMS/1000.0)
+    stats=measure_stack(stack,sign,abf.pointsPerMs)
+    result=np.zeros(abf.sweeps,dtype=EVOKED_DTYPE)
+    result["sweep"]=np.arange(abf.sweeps)
+    result["T"]=result["sweep"]*abf.sweepInterval+table["T1"][epoch]
+    for key in stats:
+        result[key]=stats[key]
+    log.info("evoked responses of %d sweeps took %s",abf.sweeps,cm.timeit(t1))
+    if saveToo:
+        abf.output_touch()
+        cm.save_atomic(abf.outPre+"data_evoked.npy",lambda f:np.save(f,result))
+    return result
+
+def summary(result,units=""):
+    """return a multi-line string of the average evoked response values."""
+    msg="evoked (n=%d)\n"%len(result)
+    units={"amplitude":units,"latency":"ms","timeToPeak":"ms",
+           "msRise":"ms","msDecay":"ms"}
+    for key in ["amplitude","latency","timeToPeak","msRise","msDecay"]:
+        msg+="%s=%.02f %s\n"%(key,np.nanmean(result[key]),units[key])
+    return msg.strip()
+
+if __name__=="__main__":
+    abfFile=r"X:\Data\2P01\2016\2017-01-09 AT1\17109009.abf"
+    abf=swhlab.ABF(abfFile)
+    print(summary(evoked(abf),abf.units))
+    print("DONE")
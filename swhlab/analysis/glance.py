@@ -22,6 +22,7 @@ import matplotlib.pyplot as plt
 
 sys.path.insert(0,'../../')
 import swhlab
+import swhlab.plotting.render as render
 
 def processFolder(abfFolder):
     """call processAbf() for every ABF in a folder."""
@@ -44,59 +45,64 @@ def processAbf(abfFname,saveAs=False,dpi=100,show=True):
         return
     abf=swhlab.ABF(abfFname)
     plot=swhlab.plotting.ABFplot(abf)
-    plot.figure_height=6
-    plot.figure_width=10
-    plot.subplot=False
-    plot.figure(True)
+    figsize=(10,6)
     if abf.get_protocol_sequence(0)==abf.get_protocol_sequence(1) or abf.sweeps<2:
         # same protocol every time
         if abf.lengthMinutes<2:
             # short (probably a memtest or tau)
-            ax1=plt.subplot(211)
+            fig,(ax1,ax2)=render.figure(figsize,2,1,sharex="col")
+            plot.ax=ax1
             plot.figure_sweeps()
-            plt.title("{} ({} sweeps)".format(abf.ID,abf.sweeps))
-            plt.gca().get_xaxis().set_visible(False)
-            plt.subplot(212,sharex=ax1)
+            ax1.set_title("{} ({} sweeps)".format(abf.ID,abf.sweeps))
+            ax1.get_xaxis().set_visible(False)
+            plot.ax=ax2
             plot.figure_protocol()
-            plt.title("")
+            ax2.set_title("")
         else:
             # long (probably a drug experiment)
+            fig,(plot.ax,)=render.figure(figsize)
             plot.figure_chronological()
     else:
         # protocol changes every sweep
-        plots=[211,212] # assume we want 2 images
+        ap=None
         if abf.units=='mV': # maybe it's something with APs?
             ap=swhlab.AP(abf) # go ahead and do AP detection
             ap.detect() # try to detect APs
-            if len(ap.APs): # if we found some
-                plots=[221,223,222,224] # get ready for 4 images
-        ax1=plt.subplot(plots[0])
+        if ap and len(ap.APs): # if we found some, get ready for 4 images
+            fig,(ax1,ax3,ax2,ax4)=render.figure(figsize,2,2,sharex="col")
+        else:
+            fig,(ax1,ax2)=render.figure(figsize,2,1,sharex="col")
+        plot.ax=ax1
         plot.figure_sweeps()
-        plt.title("{} ({} sweeps)".format(abf.ID,abf.sweeps))
-        plt.gca().get_xaxis().set_visible(False)
-        plt.subplot(plots[1],sharex=ax1)
+        ax1.set_title("{} ({} sweeps)".format(abf.ID,abf.sweeps))
+        ax1.get_xaxis().set_visible(False)
+        plot.ax=ax2
         plot.figure_protocols()
-        plt.title("protocol")
-        if len(plots)>2:
+        ax2.set_title("protocol")
+        if len(fig.axes)>2:
             # assume we want to look at the first AP
-            ax2=plt.subplot(plots[2])
+            plot.ax=ax3
+            plot.decimate=False # we zoom in on the AP
             plot.rainbow=False
             plot.kwargs["color"]='b'
             plot.figure_chronological()
-            plt.gca().get_xaxis().set_visible(False)
-            plt.title("first AP magnitude")
+            ax3.get_xaxis().set_visible(False)
+            ax3.set_title("first AP magnitude")
             # velocity plot
-            plt.subplot(plots[3],sharex=ax2)
+            plot.ax=ax4
             plot.abf.derivative=True
             plot.rainbow=False
             plot.traceColor='r'
             plot.figure_chronological()
-            plt.axis([ap.APs[0]["T"]-.05,ap.APs[0]["T"]+.05,None,None])
-            plt.title("first AP velocity")
+            ax4.axis([ap.APs[0]["T"]-.05,ap.APs[0]["T"]+.05,None,None])
+            ax4.set_title("first AP velocity")
+    render.layout(fig)
 
     if saveAs:
         print("saving",os.path.abspath(saveAs))
-        plt.savefig(os.path.abspath(saveAs),dpi=dpi)
+        fig.savefig(os.path.abspath(saveAs),dpi=dpi)
+        if render.isPyplot(fig):
+            plt.close(fig)
         return
     if show:
         plot.show()
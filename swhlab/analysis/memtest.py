@@ -0,0 +1,172 @@
+"""
+membrane test (Ih, Ra, Rm, Cm, tau) for every sweep of an ABF at once.
+
+The step used for the memtest is found in the epoch table (the first epoch
+whose level differs from the holding value), so no setsweep() is needed. All
+measurements are made on the sweep matrix with array slicing, and the decay
+of the capacitive transient is fit for every sweep at once (swhlab.fitting).
+Results are returned as a structured array with one row per sweep, ready to
+be plotted against time or saved.
+
+Voltage clamp (units are pA), where the cell steps from V1 to V2 and back:
+    * P1 - current at the end of the step
+    * P2 - current after returning (this is Ih)
+    * PP - peak of the capacitive transient after returning
+    * Ra=dV/(PP-P2), Rm=dV/(P2-P1), Cm=tau/Ra
+
+Current clamp (units are mV), where a current step dI is applied:
+    * the response is fit from 10% to 90% of its steady state
+    * Rm=dV/dI, Cm=tau/Rm, and the Ih field holds the resting potential
+"""
+
+import logging
+import numpy as np
+
+import swhlab
+import swhlab.common as cm
+import swhlab.fitting as fitting
+
+MEMTEST_DTYPE=[("sweep",int), # sweep number
+               ("T",float), # time of the sweep in the experiment (sec)
+               ("Ih",float), # holding current (pA) or resting potential (mV)
+               ("Ra",float), # access resistance (MOhm)
+               ("Rm",float), # membrane resistance (MOhm)
+               ("Cm",float), # membrane capacitance (pF)
+               ("tau",float), # time constant of the fitted decay (ms)
+               ]
+
+def first_index(condition,default):
+    """return the index of the first True in every row (or default)."""
+    found=np.any(condition,axis=1)
+    return np.where(found,np.argmax(condition,axis=1),default)
+
+def memtest_VC(data,I_step,I_return,I_end,dV,pointsPerMs,peakMS=5):
+    """
+    Voltage clamp memtest of every row of data (sweep,point).
+    The step starts at I_step and returns at I_return. I_end is the last
+    point of the returned level. dV (mV) is the returned level minus the
+    step level (one value, or one per sweep). Returns a dict of arrays.
+    """
+    dV=np.broadcast_to(np.asarray(dV,dtype=float),(len(data),))
+    sign=np.where(dV<0,-1.0,1.0)[:,None] # flip so the transient goes up
+    signed=data*sign
+    dT1,dT2=I_return-I_step,I_end-I_return
+    T1A,T1B=int(I_step+.5*dT1),int(I_step+.9*dT1)
+    T2A,T2B=int(I_return+.5*dT2),int(I_return+.9*dT2)
+    P1=np.mean(signed[:,T1A:T1B],axis=1)
+    P2=np.mean(signed[:,T2A:T2B],axis=1)
+    peakPoints=min(int(peakMS*pointsPerMs),T2A-I_return)
+    PP=np.max(signed[:,I_return:I_return+peakPoints],axis=1)
+    TP=np.argmax(signed[:,I_return:I_return+peakPoints],axis=1)
+
+    # fit the transient decay from 90% to 10% of its amplitude
+    decay=signed[:,I_return:T2A]-P2[:,None]
+    frac=decay/(PP-P2)[:,None]
+    points=np.arange(decay.shape[1])[None,:]
+    afterPeak=points>=TP[:,None]
+    TCA=first_index(afterPeak&(frac<.9),decay.shape[1])
+    TCB=first_index(afterPeak&(frac<.1),decay.shape[1])
+    fitMask=(points>=TCA[:,None])&(points<TCB[:,None])
+    fit=fitting.fit_exp(decay,fitMask,dx=1.0/pointsPerMs,offset=False)
+    tau=np.where(fit["ok"],fit["tau"],np.nan)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        Ra=np.abs(dV)*1e3/(PP-P2) # MOhm=uV/pA
+        Rm=np.abs(dV)*1e3/(P2-P1) # MOhm=uV/pA
+        Cm=tau/Ra*1e3 # pF
+    return {"Ih":P2*sign[:,0],"Ra":Ra,"Rm":Rm,"Cm":Cm,"tau":tau}
+
+def memtest_IC(data,I_step,I_return,dI,pointsPerMs):
+    """
+    Current clamp memtest of every row of data (sweep,point).
+    The current step (dI, pA) starts at I_step and ends at I_return.
+    Returns a dict of arrays.
+    """
+    dI=np.broadcast_to(np.asarray(dI,dtype=float),(len(data),))
+    dT=I_return-I_step
+    base=np.mean(data[:,int(I_step*.75):I_step],axis=1)
+    steady=np.mean(data[:,int(I_step+.75*dT):I_return],axis=1)
+    dVss=steady-base
+
+    # fit the approach to steady state from 10% to 90% of the response
+    remaining=(steady[:,None]-data[:,I_step:I_return])*np.sign(dVss)[:,None]
+    frac=remaining/np.abs(dVss)[:,None]
+    points=np.arange(remaining.shape[1])[None,:]
+    TCA=first_index(frac<.9,remaining.shape[1])
+    TCB=first_index(frac<.1,remaining.shape[1])
+    fitMask=(points>=TCA[:,None])&(points<TCB[:,None])
+    fit=fitting.fit_exp(remaining,fitMask,dx=1.0/pointsPerMs,offset=False)
+    tau=np.where(fit["ok"],fit["tau"],np.nan)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        Rm=np.abs(dVss/dI)*1e3 # MOhm=uV/pA
+        Cm=tau/Rm*1e3 # pF
+    return {"Ih":base,"Ra":np.full(len(data),np.nan),"Rm":Rm,"Cm":Cm,"tau":tau}
+
+def step_epochs(abf):
+    """
+    return (I_step,I_return,I_end,stepLevels,returnLevels) describing the
+    first epoch whose level differs from holding, using the epoch table.
+    Levels are arrays (one per sweep). Returns None if there is no step.
+    """
+    table=abf.epochTable()
+    table=table[table["I2"]>table["I1"]]
+    sweeps=np.arange(abf.sweeps)
+    levels=table["level"][None,:]+np.outer(sweeps,table["levelInc"])
+    stepped=np.where(np.any(levels!=abf.holding,axis=0))[0]
+    if not len(stepped):
+        return None
+    step=stepped[0]
+    stepLevels=levels[:,step]
+    if step+1<len(table):
+        I_end=table["I2"][step+1]
+        returnLevels=levels[:,step+1]
+    else:
+        I_end=abf.sweepSize
+        returnLevels=np.full(abf.sweeps,abf.holding,dtype=float)
+    return table["I1"][step],table["I2"][step],I_end,stepLevels,returnLevels
+
+def memtest(abf,saveToo=False):
+    """
+    perform a memtest on every sweep of an ABF and return a structured array
+    (fields are listed in MEMTEST_DTYPE). Returns None if the protocol has no
+    step to analyze. If saveToo, save it as ./swhlab/ID_data_memtest.npy
+    """
+    log=logging.getLogger("swhlab memtest")
+    t1=cm.timeit()
+    epochs=step_epochs(abf)
+    if epochs is None:
+        log.error("protocol doesn't have a step to analyze")
+        return None
+    I_step,I_return,I_end,stepLevels,returnLevels=epochs
+    data=abf.sweepMatrix(abf.channel)
+    if abf.units=="mV":
+        stats=memtest_IC(data,I_step,I_return,stepLevels-abf.holding,
+                         abf.pointsPerMs)
+    else:
+        stats=memtest_VC(data,I_step,I_return,I_end,returnLevels-stepLevels,
+                         abf.pointsPerMs)
+    result=np.zeros(abf.sweeps,dtype=MEMTEST_DTYPE)
+    result["sweep"]=np.arange(abf.sweeps)
+    result["T"]=result["sweep"]*abf.sweepInterval
+    for key in stats:
+        result[key]=stats[key]
+    log.info("memtest of %d sweeps took %s",abf.sweeps,cm.timeit(t1))
+    if saveToo:
+        abf.output_touch()
+        cm.save_atomic(abf.outPre+"data_memtest.npy",lambda f:np.save(f,result))
+    return result
+
+def summary(result):
+    """return a multi-line string of the average memtest values."""
+    msg="memtest (n=%d)\n"%len(result)
+    units={"Ih":"pA","Ra":"MOhm","Rm":"MOhm","Cm":"pF","tau":"ms"}
+    for key in ["Ih","Ra","Rm","Cm","tau"]:
+        msg+="%s=%.02f %s\n"%(key,np.nanmean(result[key]),units[key])
+    return msg.strip()
+
+if __name__=="__main__":
+    abfFile=r"C:\Apps\pythonModules\abfs\16701010.abf"
+    abf=swhlab.ABF(abfFile)
+    print(summary(memtest(abf)))
+    print("DONE")
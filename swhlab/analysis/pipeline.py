@@ -0,0 +1,176 @@
+"""
+run many analyses of an ABF in a single pass over its sweeps.
+
+Protocol analyses used to loop over every sweep once per thing they needed
+(AP detection, each plot, averages, window statistics), paying setsweep() and
+the derivative every time. A Pipeline holds a list of stages instead:
+    * matrix stages receive the whole sweep matrix (sweep,point) once
+    * sweep stages are called with the ABF set to each sweep in turn
+The pipeline loads each sweep once (with its derivative if any stage needs
+it) and feeds every stage, so N passes become one.
+
+Typical use:
+    pipe=Pipeline(abf)
+    avg=pipe.add(Average())
+    aps=pipe.add(APs(.1,.7))
+    pipe.run()
+    plt.plot(avg.result["average"])
+    print(aps.result.get_bySweep("count"))
+
+Stages are small classes. Override matrix() and/or sweep(), then set
+self.result in finish(). Set needsDerivative if sweep() uses abf.sweepD.
+"""
+
+import logging
+import numpy as np
+
+import swhlab
+from swhlab.core import ABF
+import swhlab.common as cm
+from swhlab.analysis.ap import AP
+
+class Stage:
+    needsDerivative=False # True if sweep() uses abf.sweepD
+
+    def __init__(self,name=None):
+        """a pipeline stage. Its output is stored in self.result."""
+        self.name=name if name else self.__class__.__name__
+        self.result=None
+
+    def start(self,abf):
+        """called once before anything else."""
+        pass
+
+    def matrix(self,abf,data):
+        """called once with the sweep matrix (sweep,point)."""
+        pass
+
+    def sweep(self,abf):
+        """called once per sweep with the ABF set to that sweep."""
+        pass
+
+    def finish(self,abf):
+        """called once after every sweep has been seen."""
+        pass
+
+    def usesSweeps(self):
+        """return True if this stage overrides sweep()."""
+        return type(self).sweep is not Stage.sweep
+
+class Pipeline:
+    def __init__(self,abf):
+        """hold stages to run over an ABF in one pass."""
+        self.log = logging.getLogger("swhlab pipeline")
+        self.log.setLevel(swhlab.loglevel)
+        if type(abf) is str:
+            self.log.debug("filename given, turning it into an ABF class")
+            abf=ABF(abf)
+        self.abf=abf
+        self.stages=[]
+
+    def add(self,stage):
+        """add a stage to the pipeline and return it (to read its result)."""
+        self.stages.append(stage)
+        return stage
+
+    def results(self):
+        """return a dict of stage results by stage name."""
+        return dict([(stage.name,stage.result) for stage in self.stages])
+
+    def run(self):
+        """run every stage, loading each sweep only once."""
+        t1=cm.timeit()
+        abf=self.abf
+        for stage in self.stages:
+            stage.start(abf)
+        data=abf.sweepMatrix(abf.channel)
+        for stage in self.stages:
+            stage.matrix(abf,data)
+        sweepStages=[x for x in self.stages if x.usesSweeps()]
+        if len(sweepStages):
+            derivative=abf.derivative
+            for sweep in range(abf.sweeps):
+                abf.derivative=any([x.needsDerivative for x in sweepStages])
+                abf.setsweep(sweep)
+                for stage in sweepStages:
+                    stage.sweep(abf)
+            abf.derivative=derivative
+        for stage in self.stages:
+            stage.finish(abf)
+        self.log.debug("%d stages on %d sweeps took %s",len(self.stages),
+                       abf.sweeps,cm.timeit(t1))
+        return self.results()
+
+### STAGES
+
+class Average(Stage):
+    def __init__(self,sweepFirst=0,sweepLast=None,name="average"):
+        """average (and standard deviation) of a range of sweeps."""
+        Stage.__init__(self,name)
+        self.sweepFirst,self.sweepLast=sweepFirst,sweepLast
+
+    def matrix(self,abf,data):
+        sweepLast=abf.sweeps-1 if self.sweepLast is None else self.sweepLast
+        data=data[self.sweepFirst:sweepLast+1]
+        self.result={"average":np.mean(data,axis=0),
+                     "stdev":np.std(data,axis=0)}
+
+class Derivative(Stage):
+    def __init__(self,name="derivative"):
+        """first derivative of every sweep (same units as ABF.sweepD)."""
+        Stage.__init__(self,name)
+
+    def matrix(self,abf,data):
+        D=np.empty(data.shape)
+        D[:,1:]=np.diff(data,axis=1)
+        D[:,0]=D[:,1]
+        self.result=D*abf.pointsPerMs
+
+class WindowStats(Stage):
+    def __init__(self,t1=0,t2=None,name="window"):
+        """mean, stdev, min, and max of every sweep between t1 and t2 (sec)."""
+        Stage.__init__(self,name)
+        self.t1,self.t2=t1,t2
+
+    def matrix(self,abf,data):
+        t2=abf.sweepLength if self.t2 is None else min(self.t2,abf.sweepLength)
+        I1,I2=int(max(self.t1,0)*abf.pointsPerSec),int(t2*abf.pointsPerSec)
+        chunk=data[:,I1:I2]
+        if not chunk.shape[1]:
+            nans=np.full(len(data),np.nan)
+            self.result={"mean":nans,"stdev":nans,"min":nans,"max":nans}
+            return
+        self.result={"mean":np.mean(chunk,axis=1),
+                     "stdev":np.std(chunk,axis=1),
+                     "min":np.min(chunk,axis=1),
+                     "max":np.max(chunk,axis=1)}
+
+class APs(Stage):
+    needsDerivative=True
+
+    def __init__(self,detect_time1=None,detect_time2=None,name="APs"):
+        """AP detection (swhlab.analysis.ap) of every sweep."""
+        Stage.__init__(self,name)
+        self.detect_time1,self.detect_time2=detect_time1,detect_time2
+
+    def start(self,abf):
+        self.result=AP(abf)
+        if self.detect_time1 is not None:
+            self.result.detect_time1=self.detect_time1
+        if self.detect_time2 is not None:
+            self.result.detect_time2=self.detect_time2
+        self.result.APs=[]
+
+    def sweep(self,abf):
+        self.result.detectSweep(abf.sweep)
+        abf.derivative=True # detectSweep() turns it off
+
+if __name__=="__main__":
+    abfFile=r"C:\Users\scott\Documents\important\abfs\16o14018.abf"
+    pipe=Pipeline(abfFile)
+    aps=pipe.add(APs())
+    window=pipe.add(WindowStats(.1,.2))
+    pipe.run()
+    print(aps.result.get_bySweep("count"))
+    print(window.result["mean"])
+    print("DONE")
@@ -18,6 +18,10 @@ if not os.path.abspath('../../') in sys.path:
     sys.path.append('../../')
 
 import glob
+import time
+import logging
+import functools
+import multiprocessing
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -26,7 +30,14 @@ from swhlab import ABF
 from swhlab.plotting import ABFplot
 from swhlab.plotting.core import frameAndSave
 from swhlab.analysis.ap import AP
+import swhlab.analysis.memtest as memtest
+import swhlab.analysis.stack
+import swhlab.analysis.evoked as evoked
+import swhlab.analysis.pipeline as pipeline
+import swhlab.fitting as fitting
 import swhlab.plotting.core
+import swhlab.plotting.render as render
+import swhlab.plotting.thumbnail as thumbnail
 import swhlab.common as cm
 
 #from swhlab.swh_abf import ABF
@@ -39,6 +50,21 @@ import swhlab.common as cm
 
 SQUARESIZE=8
 
+PROTOCOLS={} # analysis function for every protocol comment (see register)
+
+def register(*protocols,outputs=()):
+    """
+    decorator which makes a function the analysis of these protocols.
+    outputs are the ./swhlab/ files it makes, named without the "ID_" prefix.
+    """
+    def decorator(function):
+        function.outputs=list(outputs)
+        for protocol in protocols:
+            PROTOCOLS[protocol]=function
+        return function
+    return decorator
+
+@register(outputs=["plot_unknown.jpg"])
 def proto_unknown(theABF):
     """protocol: unknown."""
     abf=ABF(theABF)
@@ -49,64 +75,82 @@ def proto_unknown(theABF):
     plot.figure_height,plot.figure_width=SQUARESIZE,SQUARESIZE
     plot.kwargs["lw"]=.5
     plot.figure_chronological()
-    plt.gca().set_axis_bgcolor('#AAAAAA') # different background if unknown protocol
-    frameAndSave(abf,"UNKNOWN")
+    plot.ax.set_facecolor('#AAAAAA') # different background if unknown protocol
+    frameAndSave(abf,"UNKNOWN",fig=plot.ax.figure)
 
+@register("0101",outputs=["plot_ic_tau.jpg"])
 def proto_0101(theABF):
     abf=ABF(theABF)
     abf.log.info("analyzing as an IC tau")
     #plot=ABFplot(abf)
 
-    plt.figure(figsize=(SQUARESIZE/2,SQUARESIZE/2))
-    plt.grid()
-    plt.ylabel("relative potential (mV)")
-    plt.xlabel("time (sec)")
+    fig,(ax,)=render.figure((SQUARESIZE/2,SQUARESIZE/2))
+    ax.grid()
+    ax.set_ylabel("relative potential (mV)")
+    ax.set_xlabel("time (sec)")
     m1,m2=[.05,.1]
-    for sweep in range(abf.sweeps):
-        abf.setsweep(sweep)
-        plt.plot(abf.sweepX2,abf.sweepY-abf.average(m1,m2),alpha=.2,color='#AAAAFF')
-    average=abf.averageSweep()
-    average-=np.average(average[int(m1**abf.pointsPerSec):int(m2*abf.pointsPerSec)])
-    plt.plot(abf.sweepX2,average,color='b',lw=2,alpha=.5)
-    plt.axvspan(m1,m2,color='r',ec=None,alpha=.1)
-    plt.axhline(0,color='r',ls="--",alpha=.5,lw=2)
-    plt.margins(0,.1)
+    pipe=pipeline.Pipeline(abf)
+    avg=pipe.add(pipeline.Average())
+    base=pipe.add(pipeline.WindowStats(m1,m2))
+    pipe.run()
+    data=abf.sweepMatrix(abf.channel)
+    Xs=np.arange(data.shape[1])/abf.pointsPerSec
+    ax.plot(Xs,(data-base.result["mean"][:,None]).T,alpha=.2,color='#AAAAFF')
+    average=avg.result["average"]-np.mean(base.result["mean"])
+    ax.plot(Xs,average,color='b',lw=2,alpha=.5)
+    ax.axvspan(m1,m2,color='r',ec=None,alpha=.1)
+    ax.axhline(0,color='r',ls="--",alpha=.5,lw=2)
+
+    # fit the relaxation after the step of every sweep at once
+    epochs=memtest.step_epochs(abf)
+    if epochs:
+        I_step,I_return,I_end=epochs[:3]
+        data=abf.sweepMatrix(abf.channel)[:,I_return:I_end]
+        fits=fitting.fit_exp(data,dx=1.0/abf.pointsPerMs)
+        taus=fits["tau"][fits["ok"]]
+        if len(taus):
+            avgFit=fitting.fit_exp(average[I_return:I_end],dx=1.0/abf.pointsPerMs)
+            curve=fitting.evaluate(avgFit,I_end-I_return,1.0/abf.pointsPerMs)[0]
+            ax.plot(Xs[I_return:I_end],curve,color='r',ls='--',lw=2)
+            msg="tau=%.02f ms (median of %d)"%(np.median(taus),len(taus))
+            abf.log.info(msg)
+            ax.annotate(msg,(.95,.05),xycoords='axes fraction',ha='right',
+                         va='bottom',weight='bold',family='monospace',
+                         size=10,color='r')
+    ax.margins(0,.1)
 
     # save it
-    plt.tight_layout()
-    frameAndSave(abf,"IC tau")
-    plt.close('all')
+    frameAndSave(abf,"IC tau",fig=fig)
 
 
+@register("0111",outputs=["plot_ap_shape.jpg"])
 def proto_0111(theABF):
     """protocol: IC ramp for AP shape analysis."""
     abf=ABF(theABF)
     abf.log.info("analyzing as an IC ramp")
 
-    # AP detection
-    ap=AP(abf)
-    ap.detect()
+    # AP detection and derivative of every sweep in one pass
+    pipe=pipeline.Pipeline(abf)
+    aps=pipe.add(pipeline.APs())
+    deriv=pipe.add(pipeline.Derivative())
+    pipe.run()
+    ap=aps.result
     firstAP=ap.APs[0]["T"]
 
-    # also calculate derivative for each sweep
-    abf.derivative=True
-
     # create the multi-plot figure
-    plt.figure(figsize=(SQUARESIZE,SQUARESIZE))
-    ax1=plt.subplot(221)
-    plt.ylabel(abf.units2)
-    ax2=plt.subplot(222,sharey=ax1)
-    ax3=plt.subplot(223)
-    plt.ylabel(abf.unitsD2)
-    ax4=plt.subplot(224,sharey=ax3)
+    fig,(ax1,ax2,ax3,ax4)=render.figure((SQUARESIZE,SQUARESIZE),2,2,
+                                        sharey="row")
+    ax1.set_ylabel(abf.units2)
+    ax3.set_ylabel(abf.unitsD2)
 
     # put data in each subplot
-    for sweep in range(abf.sweeps):
-        abf.setsweep(sweep)
-        ax1.plot(abf.sweepX,abf.sweepY,color='b',lw=.25)
-        ax2.plot(abf.sweepX,abf.sweepY,color='b')
-        ax3.plot(abf.sweepX,abf.sweepD,color='r',lw=.25)
-        ax4.plot(abf.sweepX,abf.sweepD,color='r')
+    data=abf.sweepMatrix(abf.channel)
+    Xs=(np.arange(data.shape[1])/abf.pointsPerSec)[None,:]
+    Xs=(Xs+np.arange(abf.sweeps)[:,None]*abf.sweepInterval).T
+    ax1.plot(Xs,data.T,color='b',lw=.25)
+    ax2.plot(Xs,data.T,color='b')
+    ax3.plot(Xs,deriv.result.T,color='r',lw=.25)
+    ax4.plot(Xs,deriv.result.T,color='r')
 
     # modify axis
     for ax in [ax1,ax2,ax3,ax4]: # everything
@@ -122,13 +166,10 @@ def proto_0111(theABF):
     # show message from first AP
     firstAP=ap.APs[0]
     msg="\n".join(["%s = %s"%(x,str(firstAP[x])) for x in sorted(firstAP.keys()) if not "I" in x[-2:]])
-    plt.subplot(221)
-    plt.gca().text(0.02, 0.98, msg, transform= plt.gca().transAxes, fontsize=10, verticalalignment='top', family='monospace')
+    ax1.text(0.02, 0.98, msg, transform= ax1.transAxes, fontsize=10, verticalalignment='top', family='monospace')
 
     # save it
-    plt.tight_layout()
-    frameAndSave(abf,"AP shape")
-    plt.close('all')
+    frameAndSave(abf,"AP shape",fig=fig)
 
 def proto_gain(theABF,stepSize=25,startAt=-100):
     """protocol: gain function of some sort. step size and start at are pA."""
@@ -140,18 +181,18 @@ def proto_gain(theABF,stepSize=25,startAt=-100):
     currents=np.arange(abf.sweeps)*stepSize-startAt
 
     # AP detection
-    ap=AP(abf)
-    ap.detect_time1=.1
-    ap.detect_time2=.7
-    ap.detect()
+    pipe=pipeline.Pipeline(abf)
+    ap=pipe.add(pipeline.APs(.1,.7))
+    pipe.run()
+    ap=ap.result
 
     # stacked plot
-    plt.figure(figsize=(SQUARESIZE,SQUARESIZE))
+    fig,(ax1,ax2,ax3,ax4)=render.figure((SQUARESIZE,SQUARESIZE),2,2)
 
-    ax1=plt.subplot(221)
+    plot.ax=ax1
     plot.figure_sweeps()
 
-    ax2=plt.subplot(222)
+    plot.ax=ax2
     ax2.get_yaxis().set_visible(False)
     plot.figure_sweeps(offsetY=150)
 
@@ -161,41 +202,41 @@ def proto_gain(theABF,stepSize=25,startAt=-100):
             ax.axvline(limit,color='r',ls='--',alpha=.5,lw=2)
 
     # make stacked gain function
-    ax4=plt.subplot(223)
-    plt.ylabel("frequency (Hz)")
-    plt.ylabel("seconds")
-    plt.grid(alpha=.5)
+    ax3.set_ylabel("frequency (Hz)")
+    ax3.set_ylabel("seconds")
+    ax3.grid(alpha=.5)
     freqs=ap.get_bySweep("freqs")
     times=ap.get_bySweep("times")
     for i in range(abf.sweeps):
         if len(freqs[i]):
-            plt.plot(times[i][:-1],freqs[i],'-',alpha=.5,lw=2,
+            ax3.plot(times[i][:-1],freqs[i],'-',alpha=.5,lw=2,
                      color=plot.getColor(i/abf.sweeps))
 
     # make gain function graph
-    ax4=plt.subplot(224)
     ax4.grid(alpha=.5)
-    plt.plot(currents,ap.get_bySweep("median"),'b.-',label="median")
-    plt.plot(currents,ap.get_bySweep("firsts"),'g.-',label="first")
-    plt.xlabel("applied current (pA)")
-    plt.legend(loc=2,fontsize=10)
-    plt.axhline(40,color='r',alpha=.5,ls="--",lw=2)
-    plt.margins(.02,.1)
+    ax4.plot(currents,ap.get_bySweep("median"),'b.-',label="median")
+    ax4.plot(currents,ap.get_bySweep("firsts"),'g.-',label="first")
+    ax4.set_xlabel("applied current (pA)")
+    ax4.legend(loc=2,fontsize=10)
+    ax4.axhline(40,color='r',alpha=.5,ls="--",lw=2)
+    ax4.margins(.02,.1)
 
     # save it
-    plt.tight_layout()
-    frameAndSave(abf,"AP Gain %d_%d"%(startAt,stepSize))
-    plt.close('all')
+    frameAndSave(abf,"AP Gain %d_%d"%(startAt,stepSize),fig=fig)
 
+@register("0112",outputs=["plot_ap_gain_-50_10.jpg"])
 def proto_0112(theABF):
     proto_gain(theABF,10,-50)
 
+@register("0113",outputs=["plot_ap_gain_-100_25.jpg"])
 def proto_0113(theABF):
     proto_gain(theABF,25)
 
+@register("0114",outputs=["plot_ap_gain_-100_100.jpg"])
 def proto_0114(theABF):
     proto_gain(theABF,100)
 
+@register("0201",outputs=["plot_membrane_test.jpg","data_memtest.npy"])
 def proto_0201(theABF):
     """protocol: membrane test."""
     abf=ABF(theABF)
@@ -204,11 +245,17 @@ def proto_0201(theABF):
     plot.figure_height,plot.figure_width=SQUARESIZE/2,SQUARESIZE/2
     plot.figure_sweeps()
 
+    # calculate the memtest of every sweep and show the average
+    result=memtest.memtest(abf,saveToo=True)
+    if result is not None:
+        plot.ax.text(0.02, 0.98, memtest.summary(result),
+                     transform=plot.ax.transAxes, fontsize=8,
+                     verticalalignment='top', family='monospace')
+
     # save it
-    plt.tight_layout()
-    frameAndSave(abf,"membrane test")
-    plt.close('all')
+    frameAndSave(abf,"membrane test",fig=plot.ax.figure)
 
+@register("0202",outputs=["plot_mtiv.jpg"])
 def proto_0202(theABF):
     """protocol: MTIV."""
     abf=ABF(theABF)
@@ -221,15 +268,14 @@ def proto_0202(theABF):
 
     # frame to uppwer/lower bounds, ignoring peaks from capacitive transients
     abf.setsweep(0)
-    plt.axis([None,None,abf.average(.9,1)-100,None])
+    plot.ax.axis([None,None,abf.average(.9,1)-100,None])
     abf.setsweep(-1)
-    plt.axis([None,None,None,abf.average(.9,1)+100])
+    plot.ax.axis([None,None,None,abf.average(.9,1)+100])
 
     # save it
-    plt.tight_layout()
-    frameAndSave(abf,"MTIV")
-    plt.close('all')
+    frameAndSave(abf,"MTIV",fig=plot.ax.figure)
 
+@register("0203",outputs=["plot_fast_iv.jpg"])
 def proto_0203(theABF):
     """protocol: vast IV."""
     abf=ABF(theABF)
@@ -237,84 +283,95 @@ def proto_0203(theABF):
     plot=ABFplot(abf)
     plot.title=""
     m1,m2=.7,1
-    plt.figure(figsize=(SQUARESIZE,SQUARESIZE/2))
+    fig,(ax1,ax2)=render.figure((SQUARESIZE,SQUARESIZE/2),1,2)
 
-    plt.subplot(121)
+    plot.ax=ax1
     plot.figure_sweeps()
-    plt.axvspan(m1,m2,color='r',ec=None,alpha=.1)
+    ax1.axvspan(m1,m2,color='r',ec=None,alpha=.1)
 
-    plt.subplot(122)
-    plt.grid(alpha=.5)
+    ax2.grid(alpha=.5)
     Xs=np.arange(abf.sweeps)*5-110
     Ys=[]
     for sweep in range(abf.sweeps):
         abf.setsweep(sweep)
         Ys.append(abf.average(m1,m2))
-    plt.plot(Xs,Ys,'.-',ms=10)
-    plt.axvline(-70,color='r',ls='--',lw=2,alpha=.5)
-    plt.axhline(0,color='r',ls='--',lw=2,alpha=.5)
-    plt.margins(.1,.1)
-    plt.xlabel("membrane potential (mV)")
+    ax2.plot(Xs,Ys,'.-',ms=10)
+    ax2.axvline(-70,color='r',ls='--',lw=2,alpha=.5)
+    ax2.axhline(0,color='r',ls='--',lw=2,alpha=.5)
+    ax2.margins(.1,.1)
+    ax2.set_xlabel("membrane potential (mV)")
 
     # save it
-    plt.tight_layout()
-    frameAndSave(abf,"fast IV")
-    plt.close('all')
+    frameAndSave(abf,"fast IV",fig=fig)
 
+@register("0401",outputs=["experiment_sweep_vs_average.jpg"])
 def proto_0401(theABF):
     proto_avgRange(theABF,.5,2.0)
 
+@register("0404",outputs=["experiment_sweep_vs_average.jpg"])
 def proto_0404(theABF):
     proto_avgRange(theABF,1.0,1.1)
 
+@register("0501",outputs=["experiment_bls.jpg","experiment_bls_amplitude.jpg",
+          "data_evoked.npy"])
 def proto_0501(theABF):
     BLS_average_stack(theABF)
+@register("0502",outputs=["experiment_bls.jpg","experiment_bls_amplitude.jpg",
+          "data_evoked.npy"])
 def proto_0502(theABF):
     BLS_average_stack(theABF)
 
 def BLS_average_stack(theABF):
     abf=ABF(theABF)
-    T1,T2=abf.epochTimes(2)
+    table=abf.epochTable()
+    T1,T2=table["T1"][2],table["T2"][2]
     padding=.1
     if abf.units=="mV":
         padding=.25
-    Tdiff=max([T2-T1,padding])
     Tdiff=min([T1,padding])
-    X1,X2=T1-Tdiff,T2+Tdiff
-    I1,I2=X1*abf.pointsPerSec,X2*abf.pointsPerSec
-
-    plt.figure(figsize=(10,10))
-    chunks=np.empty((abf.sweeps,I2-I1))
-    Xs=np.array(abf.sweepX2[I1:I2])
-    for sweep in abf.setsweeps():
-        chunks[sweep]=abf.sweepY[I1:I2]
-        plt.subplot(211)
-        plt.plot(Xs,chunks[sweep],alpha=.2,color='.5',lw=2)
-        plt.subplot(212)
-        if abf.units=='pA':
-            plt.plot(Xs,chunks[sweep]+100*(abf.sweeps-sweep),alpha=.5,color='b',lw=2) # if VC, focus on BLS
-        else:
-            plt.plot(abf.sweepX2,abf.sweepY+100*(abf.sweeps-sweep),alpha=.5,color='b',lw=2) # if IC, show full sweep
-
-    plt.subplot(211)
-    plt.plot(Xs,np.average(chunks,axis=0),alpha=.5,lw=2)
-    plt.title("%s.abf - BLS - average of %d sweeps"%(abf.ID,abf.sweeps))
-    plt.ylabel(abf.units2)
-    plt.axvspan(T1,T2,alpha=.2,color='y',lw=0)
-    plt.margins(0,.1)
-
-    plt.subplot(212)
-    plt.xlabel("time (sec)")
-    plt.ylabel("stacked sweeps")
-    plt.axvspan(T1,T2,alpha=.2,color='y',lw=0)
+    stack=swhlab.analysis.stack.stack_epoch(abf,2,Tdiff,T2-T1+Tdiff)
+    Xs=stack.Xs+T1
+
+    fig,(ax1,ax2)=render.figure((10,10),2,1)
+    ax1.plot(Xs,stack.chunks.T,alpha=.2,color='.5',lw=2)
+    ax1.plot(Xs,stack.average,alpha=.5,lw=2)
+    ax1.set_title("%s.abf - BLS - average of %d sweeps"%(abf.ID,abf.sweeps))
+    ax1.set_ylabel(abf.units2)
+    ax1.axvspan(T1,T2,alpha=.2,color='y',lw=0)
+    ax1.margins(0,.1)
+
+    offsets=100*(abf.sweeps-np.arange(abf.sweeps))[:,None]
+    if abf.units=='pA':
+        ax2.plot(Xs,(stack.chunks+offsets).T,alpha=.5,color='b',lw=2) # if VC, focus on BLS
+    else:
+        data=abf.sweepMatrix(abf.channel)
+        Xfull=np.arange(data.shape[1])/abf.pointsPerSec
+        ax2.plot(Xfull,(data+offsets).T,alpha=.5,color='b',lw=2) # if IC, show full sweep
+    ax2.set_xlabel("time (sec)")
+    ax2.set_ylabel("stacked sweeps")
+    ax2.axvspan(T1,T2,alpha=.2,color='y',lw=0)
     if abf.units=='mV':
-        plt.axvline(T1,color='r',alpha=.2,lw=3)
-#        plt.axvline(T2,color='r',alpha=.2,lw=3)
-    plt.margins(0,.1)
-
-    plt.tight_layout()
-    frameAndSave(abf,"BLS","experiment")
-    plt.close('all')
+        ax2.axvline(T1,color='r',alpha=.2,lw=3)
+    ax2.margins(0,.1)
+
+    frameAndSave(abf,"BLS","experiment",fig=fig)
+
+    # measure the response of every sweep and plot its time course
+    result=evoked.evoked(abf,2,saveToo=True)
+    if result is None:
+        return
+    fig,(ax,)=render.figure((SQUARESIZE,SQUARESIZE/2))
+    ax.grid(alpha=.5)
+    ax.plot(result["T"]/60,result["amplitude"],'.-',ms=10,alpha=.5)
+    for t in abf.comment_times:
+        ax.axvline(t/60,color='r',alpha=.5,lw=2,ls='--')
+    ax.set_ylabel("response amplitude (%s)"%abf.units)
+    ax.set_xlabel("minutes")
+    ax.annotate(evoked.summary(result,abf.units),(.01,.99),
+                xycoords='axes fraction',ha='left',va='top',
+                family='monospace',size=8,alpha=.5)
+    ax.margins(.05,.1)
+    frameAndSave(abf,"BLS amplitude","experiment",fig=fig)
 
 
 def proto_avgRange(theABF,m1=1.0,m2=1.1):
@@ -323,29 +380,27 @@ def proto_avgRange(theABF,m1=1.0,m2=1.1):
     abf.log.info("analyzing as a fast IV")
     plot=ABFplot(abf)
 
-    plt.figure(figsize=(SQUARESIZE*2,SQUARESIZE/2))
+    fig,(ax1,ax2)=render.figure((SQUARESIZE*2,SQUARESIZE/2),1,2)
 
-    plt.subplot(121)
+    plot.ax=ax1
     plot.title="first sweep"
     plot.figure_sweep()
-    plt.axvspan(m1,m2,color='r',ec=None,alpha=.1)
+    ax1.axvspan(m1,m2,color='r',ec=None,alpha=.1)
 
-    plt.subplot(122)
-    plt.grid(alpha=.5)
+    ax2.grid(alpha=.5)
     Ts=np.arange(abf.sweeps)*abf.sweepInterval
-    Ys=np.empty(abf.sweeps)*np.nan
-    for sweep in range(abf.sweeps):
-        Ys[sweep]=abf.average(m1,m2,setsweep=sweep)
+    pipe=pipeline.Pipeline(abf)
+    window=pipe.add(pipeline.WindowStats(m1,m2))
+    pipe.run()
+    Ys=window.result["mean"]
     for i,t in enumerate(abf.comment_times):
-        plt.axvline(t/60,color='r',alpha=.5,lw=2,ls='--')
-    plt.plot(Ts/60,Ys,'.')
-    plt.title(str(abf.comment_tags))
-    plt.ylabel(abf.units2)
-    plt.xlabel("minutes")
+        ax2.axvline(t/60,color='r',alpha=.5,lw=2,ls='--')
+    ax2.plot(Ts/60,Ys,'.')
+    ax2.set_title(str(abf.comment_tags))
+    ax2.set_ylabel(abf.units2)
+    ax2.set_xlabel("minutes")
 
-    plt.tight_layout()
-    frameAndSave(abf,"sweep vs average","experiment")
-    plt.close('all')
+    frameAndSave(abf,"sweep vs average","experiment",fig=fig)
 
 def analyze(fname=False,save=True,show=None):
     """given a filename or ABF object, try to analyze it."""
@@ -357,19 +412,151 @@ def analyze(fname=False,save=True,show=None):
             swhlab.plotting.core.IMAGE_SHOW=False
     #swhlab.plotting.core.IMAGE_SHOW=show
     abf=ABF(fname) # ensure it's a class
-    print(">>>>> PROTOCOL >>>>>",abf.protocomment)
-    runFunction="proto_unknown"
-    if "proto_"+abf.protocomment in globals():
-        runFunction="proto_"+abf.protocomment
-    abf.log.debug("running %s()"%(runFunction))
+    abf.log.info("protocol: %s",abf.protocomment)
+    runFunction=PROTOCOLS.get(abf.protocomment,proto_unknown)
+    abf.log.debug("running %s()"%(runFunction.__name__))
     plt.close('all') # get ready
     try:
-        globals()[runFunction](abf) # run that function
-    except:
+        runFunction(abf) # run that function
+    except Exception as e:
         abf.log.error("EXCEPTION DURING PROTOCOL FUNCTION")
-        abf.log.error(sys.exc_info()[0])
+        abf.log.error(cm.exceptionToString(e))
     plt.close('all') # clean up
 
+def outputs(abf):
+    """
+    return the full paths of the files the analysis of an ABF may make.
+    Some are only made if the ABF has what they need (like a memtest step).
+    """
+    function=PROTOCOLS.get(abf.protocomment,proto_unknown)
+    return [abf.outPre+x for x in function.outputs]
+
+def run(abf,function,db=None,outputs=None):
+    """
+    run function(abf) unless the outputs (./swhlab/ files named without the
+    "ID_" prefix, function.outputs if not given) it made last time are all
+    still there and would come out the same: their render cache key (see
+    swhlab.plotting.render) in db, the output folder's Manifest, didn't
+    change. Then nothing is even loaded.
+    """
+    if outputs is None:
+        outputs=function.outputs
+    fnames=[abf.outPre+x for x in outputs]
+    params={"outputs":outputs,
+            "decimate":getattr(abf,"decimate",swhlab.plotting.core.DECIMATE)}
+    key=render.cacheKey(abf,function.__name__,params,db)
+    made=[x for x in fnames if key and db.renderKey(x)==key]
+    if render.isCached(db,made,key):
+        abf.log.info("outputs of %s() are unchanged, not making them",
+                     function.__name__)
+        return
+    before=dict([(x,os.path.getmtime(x)) for x in fnames if os.path.exists(x)])
+    function(abf)
+    made=[x for x in fnames if os.path.exists(x) and
+          os.path.getmtime(x)!=before.get(x)]
+    render.cached(db,made,abf.ID,key)
+
+def analyze_file(fname,save=True,outFolder=None,declareOnly=False):
+    """
+    analyze an ABF without showing anything and return a report (dict):
+        * fname - the ABF file
+        * protocol - its protocol comment
+        * outputs - full paths of the files its analysis made
+        * seconds - how long it took
+        * error - None, or the exception as a string if analysis failed
+        * hash - the ABF's content hash if it was needed (see run), so
+          recording the report (see Manifest.record) needn't read it again
+    Outputs go in ./swhlab/ unless another outFolder is given. If declareOnly,
+    the ABF isn't analyzed, just reported with the outputs its protocol may
+    make (so they can be made later). Outputs which would come out the same
+    aren't made again (see run). A thumbnail (see swhlab.plotting.thumbnail)
+    is saved either way.
+    """
+    t1=time.time()
+    report={"fname":fname,"protocol":None,"outputs":[],"seconds":0,"error":None,
+            "hash":None}
+    swhlab.plotting.core.IMAGE_SAVE=save
+    swhlab.plotting.core.IMAGE_SHOW=False
+    if render.PYPLOT:
+        plt.close('all')
+    db=None
+    try:
+        abf=ABF(fname)
+        if outFolder:
+            abf.outFolder=os.path.abspath(outFolder)
+            abf.outPre=os.path.join(abf.outFolder,abf.ID)+'_'
+        abf.decimate=True # nobody zooms into these figures (see ABFplot)
+        report["protocol"]=abf.protocomment
+        report["outputs"]=outputs(abf)
+        if save:
+            db=render.cacheManifest(abf.outPre)
+            run(abf,thumbnail.thumbnail,db,[thumbnail.SUFFIX])
+            report["outputs"].append(abf.outPre+thumbnail.SUFFIX)
+        if not declareOnly:
+            run(abf,PROTOCOLS.get(abf.protocomment,proto_unknown),db)
+        report["hash"]=abf.cache.get("hash")
+    except Exception as e:
+        report["error"]=cm.exceptionToString(e)
+    if db:
+        db.close()
+    if not declareOnly:
+        report["outputs"]=[x for x in report["outputs"] if os.path.exists(x)]
+    if render.PYPLOT:
+        plt.close('all')
+    report["seconds"]=time.time()-t1
+    return report
+
+def worker_init():
+    """
+    prepare a worker process to draw figures without a display (on reused
+    Agg figures instead of pyplot's, see swhlab.plotting.render).
+    """
+    plt.switch_backend('Agg')
+    render.PYPLOT=False
+
+def analyze_many(files,workers=None,save=True):
+    """
+    analyze many ABFs (a list of files or a folder) using a pool of worker
+    processes (one per CPU core by default) and return a list of reports
+    (see analyze_file) in the same order as the files. Figures and data are
+    written atomically, so a half-made output never appears in ./swhlab/
+    """
+    log=logging.getLogger("swhlab protocols")
+    if type(files) is str and os.path.isdir(files):
+        files=[os.path.join(files,x) for x in cm.abfSort(os.listdir(files))
+               if x.lower().endswith(".abf")]
+    if not len(files):
+        return []
+    if workers is None:
+        workers=multiprocessing.cpu_count()
+    workers=max(1,min(workers,len(files)))
+    log.info("analyzing %d ABFs with %d workers",len(files),workers)
+    t1=cm.timeit()
+    reports=[]
+    if workers==1:
+        results=(analyze_file(fname,save) for fname in files)
+    else:
+        pool=multiprocessing.Pool(workers,worker_init)
+        results=pool.imap(functools.partial(analyze_file,save=save),files)
+    try:
+        for report in results:
+            reports.append(report)
+            name=os.path.basename(report["fname"])
+            if report["error"]:
+                log.error("%s (%s) FAILED after %.02f s:\n%s",name,
+                          report["protocol"],report["seconds"],report["error"])
+            else:
+                log.info("%s (%s) took %.02f s",name,report["protocol"],
+                         report["seconds"])
+    finally:
+        if workers>1:
+            pool.close()
+            pool.join()
+    failed=len([x for x in reports if x["error"]])
+    log.info("analyzed %d ABFs (%d failed) in %s",len(reports),failed,
+             cm.timeit(t1))
+    return reports
+
 if __name__=="__main__":
     print("DONT RUN THIS DIRECTLY. Call analyze() externally.")
     fname=r"X:\Data\SCOTT\2017-01-09 AT1 NTS\17503052.abf"
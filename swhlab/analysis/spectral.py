@@ -0,0 +1,178 @@
+"""
+power spectral density (PSD) and spectrogram calculation.
+
+Everything here is built on strided segment views: a 2d array of sweeps is
+viewed (without copying) as a 3d array of overlapping segments, every segment
+is windowed, and a single batched rfft along the last axis produces the power
+of every segment of every sweep at once. Windows are cached by size.
+
+Results are (freqs,power) arrays ready for ABFplot.figure_psd(). PSD units are
+(units of the data)^2/Hz.
+
+Typical use:
+    freqs,psd=psd_abf(abf) # average PSD of the whole file
+    plot=swhlab.PLOT(abf)
+    plot.figure_psd(freqs,psd)
+"""
+
+import os
+import logging
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import swhlab
+import swhlab.common as cm
+
+WINDOWS={} # window() results by (name,size)
+
+def window(size,name="hann"):
+    """return a (cached) window function of a given size."""
+    key=(name,size)
+    if not key in WINDOWS:
+        if name=="hann":
+            WINDOWS[key]=np.hanning(size)
+        elif name=="hamming":
+            WINDOWS[key]=np.hamming(size)
+        elif name=="blackman":
+            WINDOWS[key]=np.blackman(size)
+        else:
+            WINDOWS[key]=np.ones(size)
+    return WINDOWS[key]
+
+def segments(data,segmentSize,step):
+    """
+    return a read-only strided view of a 2d array (sweep,point) as a 3d array
+    (sweep,segment,point) of segments of segmentSize starting every step.
+    """
+    data=np.ascontiguousarray(np.atleast_2d(data))
+    nSegments=(data.shape[1]-segmentSize)//step+1
+    if nSegments<1:
+        return np.empty((len(data),0,segmentSize))
+    strideSweep,stridePoint=data.strides
+    view=as_strided(data,shape=(len(data),nSegments,segmentSize),
+                    strides=(strideSweep,stridePoint*step,stridePoint))
+    view.flags.writeable=False
+    return view
+
+def segment_power(data,rate,segmentSize,step,windowName="hann"):
+    """
+    return (freqs,power) where power is a 3d array (sweep,segment,freq) of the
+    one-sided power spectral density of every segment of every sweep.
+    """
+    segs=segments(data,segmentSize,step)
+    win=window(segmentSize,windowName)
+    detrended=segs-np.mean(segs,axis=2)[:,:,None]
+    spectrum=np.fft.rfft(detrended*win,axis=2)
+    power=np.abs(spectrum)**2/(rate*np.sum(win**2))
+    if segmentSize%2:
+        power[:,:,1:]*=2 # no Nyquist bin
+    else:
+        power[:,:,1:-1]*=2
+    return np.fft.rfftfreq(segmentSize,1.0/rate),power
+
+def welch(data,rate,segmentSec=1.0,overlap=.5,windowName="hann"):
+    """
+    return (freqs,psd) using Welch's method. Data can be a single sweep or a
+    2d array (sweep,point), in which case psd is also 2d (sweep,freq).
+    """
+    data=np.asarray(data,dtype=float)
+    segmentSize=min(int(segmentSec*rate),data.shape[-1])
+    step=max(1,int(segmentSize*(1-overlap)))
+    freqs,power=segment_power(data,rate,segmentSize,step,windowName)
+    psd=np.mean(power,axis=1)
+    if data.ndim==1:
+        psd=psd[0]
+    return freqs,psd
+
+def psd_abf(abf,segmentSec=1.0,overlap=.5,bySweep=False):
+    """
+    return (freqs,psd) of an ABF. The PSD is averaged across every segment of
+    every sweep unless bySweep is True, in which case it's 2d (sweep,freq).
+    """
+    freqs,psd=welch(abf.sweepMatrix(),abf.pointsPerSec,segmentSec,overlap)
+    if bySweep:
+        return freqs,psd
+    return freqs,np.mean(psd,axis=0)
+
+def spectrogram(chunks,rate,segmentSec=1.0,overlap=.5,windowName="hann"):
+    """
+    Given an iterator of data chunks (like apstream.abfChunks), yield
+    (times,freqs,power) for every segment that becomes complete. Only the
+    unfinished tail of the data is kept, so long recordings can be processed
+    with bounded memory. Times (sec) are segment centers.
+    """
+    segmentSize=int(segmentSec*rate)
+    step=max(1,int(segmentSize*(1-overlap)))
+    tail=np.array([])
+    tailStart=0 # absolute index of tail[0]
+    for chunk in chunks:
+        tail=np.concatenate((tail,np.asarray(chunk,dtype=float)))
+        nSegments=(len(tail)-segmentSize)//step+1
+        if nSegments<1:
+            continue
+        freqs,power=segment_power(tail,rate,segmentSize,step,windowName)
+        starts=tailStart+np.arange(nSegments)*step
+        yield (starts+segmentSize/2)/rate,freqs,power[0]
+        tail=tail[nSegments*step:]
+        tailStart+=nSegments*step
+
+def spectrogram_abf(abf,segmentSec=1.0,overlap=.5,maxHz=None):
+    """
+    return (times,freqs,power) of every sweep of an ABF treated as one
+    continuous recording. Power is 2d (time,freq), with no rows if the
+    recording is shorter than one segment.
+    """
+    from swhlab.analysis.apstream import abfChunks
+    segmentSize=int(segmentSec*abf.pointsPerSec)
+    freqs=np.fft.rfftfreq(segmentSize,1.0/abf.pointsPerSec)
+    times,power=[np.array([])],[np.zeros((0,len(freqs)))] # if it's too short
+    for chunkTimes,freqs,chunkPower in spectrogram(abfChunks(abf,segmentSec*10),
+                                                   abf.pointsPerSec,
+                                                   segmentSec,overlap):
+        times.append(chunkTimes)
+        power.append(chunkPower)
+    times,power=np.concatenate(times),np.concatenate(power)
+    if maxHz:
+        power=power[:,freqs<=maxHz]
+        freqs=freqs[freqs<=maxHz]
+    return times,freqs,power
+
+def band_power(freqs,psd,f1,f2):
+    """return the power (units^2) between f1 and f2 (Hz) of a PSD."""
+    binHz=freqs[1]-freqs[0]
+    inBand=(freqs>=f1)&(freqs<f2)
+    return np.sum(psd[...,inBand],axis=-1)*binHz
+
+def noise_summary(fnames,baseFrequency=60,segmentSec=1.0):
+    """
+    Given a folder path or list of ABF files, return a dict (by ABF ID) of
+    noise statistics for rig noise QC. Each ABF costs one batched FFT pass.
+        * rms - total RMS noise (from the PSD, excluding DC)
+        * rmsLine - RMS noise in +/- 1 Hz of baseFrequency and its harmonics
+        * rms1k - RMS noise from 1 Hz to 1 kHz
+    """
+    log=logging.getLogger("swhlab spectral")
+    if type(fnames) is str and os.path.isdir(fnames):
+        fnames=[os.path.join(fnames,x) for x in cm.abfSort(os.listdir(fnames))
+                if x.lower().endswith(".abf")]
+    t1=cm.timeit()
+    summary={}
+    for fname in fnames:
+        abf=swhlab.ABF(fname)
+        freqs,psd=psd_abf(abf,segmentSec)
+        line=0
+        for harmonic in np.arange(baseFrequency,freqs[-1],baseFrequency):
+            line+=band_power(freqs,psd,harmonic-1,harmonic+1)
+        summary[abf.ID]={"units":abf.units,
+                         "rms":np.sqrt(band_power(freqs,psd,freqs[1],np.inf)),
+                         "rmsLine":np.sqrt(line),
+                         "rms1k":np.sqrt(band_power(freqs,psd,1,1000))}
+    log.info("noise summary of %d ABFs took %s",len(fnames),cm.timeit(t1))
+    return summary
+
+if __name__=="__main__":
+    abfFile=R"X:\Data\DIC1\2013\08-2013\08-16-2013-DP\13816004.abf"
+    abf=swhlab.ABF(abfFile)
+    freqs,psd=psd_abf(abf)
+    print("peak noise at %.02f Hz"%freqs[np.argmax(psd[1:])+1])
+    print("DONE")
@@ -0,0 +1,323 @@
+"""
+spike train statistics computed from detected action potential times.
+
+AP detection (swhlab.analysis.ap) produces a list of dicts. This module turns
+those into columnar arrays (one sweep number and one time per AP) and computes
+every metric for every sweep at once using numpy array operations. There are
+no python loops over sweeps or APs here, so gain function summaries of entire
+folders are limited by AP detection (which can be cached to disk) rather than
+by the statistics.
+
+Per-sweep metrics are returned as arrays of length abf.sweeps. Sweeps where a
+metric can't be calculated (no APs, or not enough ISIs) get np.nan.
+"""
+
+import os
+import logging
+import numpy as np
+
+import swhlab
+from swhlab.core import ABF
+from swhlab.analysis.ap import AP
+import swhlab.common as cm
+
+ms=.001 # easy access to a millisecond
+
+class SpikeTrain:
+    def __init__(self,ap,useCache=False):
+        """
+        Load AP times and get ready to calculate spike train statistics.
+
+        Arguments:
+            ap - an AP object, ABF object, or ABF filename. If an AP object
+                 is given its existing detection is used (or run).
+            useCache - if True, AP times are loaded from (or saved to)
+                 ./swhlab/ID_data_aps.npy so detection only happens once.
+        """
+        self.log = logging.getLogger("swhlab spikes")
+        self.log.setLevel(swhlab.loglevel)
+
+        if type(ap) is str or isinstance(ap,ABF):
+            ap=AP(ap)
+        self.ap=ap
+        self.abf=ap.abf
+        self.sweeps=self.abf.sweeps
+        self.sweepLength=self.abf.sweepLength
+        self.sweepInterval=self.abf.sweepInterval
+
+        if useCache and self.load():
+            return
+        self.ap.ensureDetection()
+        self.fromAPs(self.ap.APs)
+        if useCache:
+            self.save()
+
+    ### LOADING AND SAVING
+
+    def fromAPs(self,APs):
+        """populate the columnar arrays from a list of AP dicts."""
+        sweep=np.array([ap["sweep"] for ap in APs],dtype=int)
+        times=np.array([ap["Tsweep"] for ap in APs],dtype=float)
+        self.setColumns(sweep,times)
+
+    def setColumns(self,sweep,times):
+        """set the AP sweep/time arrays, sorting by sweep then time."""
+        order=np.lexsort((times,sweep))
+        self.sweep=np.asarray(sweep,dtype=int)[order] # sweep of every AP
+        self.times=np.asarray(times,dtype=float)[order] # time in sweep (sec)
+        self.counts=np.bincount(self.sweep,minlength=self.sweeps)
+
+    def cacheFname(self):
+        return self.abf.outPre+"data_aps.npy"
+
+    def settings(self):
+        """
+        return every AP detection setting the times depend on as a 2-row
+        array (padded with 0), saved in the first columns of the cache.
+        """
+        settings=[self.ap.detect_time1,self.ap.detect_time2,self.ap.detect_over]
+        settings+=[0]*(len(settings)%2)
+        return np.array(settings,dtype=float).reshape(-1,2).T
+
+    def save(self):
+        """
+        save AP sweeps and times as a 2-row array in ./swhlab/.
+        The first columns hold the detection settings the times came from.
+        """
+        self.abf.output_touch()
+        data=np.hstack((self.settings(),np.vstack((self.sweep,self.times))))
+        cm.save_atomic(self.cacheFname(),lambda f:np.save(f,data))
+        self.log.debug("saved %d AP times",len(self.times))
+
+    def load(self):
+        """load cached AP times if they are newer than the ABF."""
+        fname=self.cacheFname()
+        if not os.path.exists(fname):
+            return False
+        if os.path.getmtime(fname)<os.path.getmtime(self.abf.filename):
+            self.log.debug("AP cache is older than the ABF, ignoring it")
+            return False
+        data=np.load(fname)
+        settings=self.settings()
+        n=settings.shape[1]
+        if data.shape[1]<n or not np.array_equal(data[:,:n],settings):
+            self.log.debug("AP cache used different detection settings")
+            return False
+        self.setColumns(data[0,n:].astype(int),data[1,n:])
+        self.log.debug("loaded %d AP times from cache",len(self.times))
+        return True
+
+    ### INTERSPIKE INTERVALS
+
+    def isi(self):
+        """
+        return (sweep,ISI) arrays of every interspike interval (sec).
+        Intervals never span two sweeps.
+        """
+        same=self.sweep[1:]==self.sweep[:-1]
+        return self.sweep[1:][same],np.diff(self.times)[same]
+
+    def isi_histogram(self,bins=None):
+        """
+        return (edges,counts) where counts is a 2d array (sweep,bin) of ISIs.
+        If bins isn't given, 50 log-spaced bins from 1 ms to 1 sec are used.
+        """
+        if bins is None:
+            bins=np.logspace(np.log10(1*ms),np.log10(1),51)
+        bins=np.asarray(bins)
+        sweep,isi=self.isi()
+        binI=np.digitize(isi,bins)-1
+        valid=(binI>=0)&(binI<len(bins)-1)
+        nBins=len(bins)-1
+        flat=sweep[valid]*nBins+binI[valid]
+        counts=np.bincount(flat,minlength=self.sweeps*nBins)
+        return bins,counts.reshape(self.sweeps,nBins)
+
+    def bySweep(self,sweep,isi,func):
+        """apply a reduction to the ISIs of every sweep (nan if no ISIs)."""
+        result=np.empty(self.sweeps)*np.nan
+        if not len(isi):
+            return result
+        n=np.bincount(sweep,minlength=self.sweeps)
+        has=n>0
+        if func=="mean":
+            total=np.bincount(sweep,weights=isi,minlength=self.sweeps)
+            result[has]=total[has]/n[has]
+        elif func=="median":
+            order=np.lexsort((isi,sweep))
+            isiSorted=isi[order]
+            offset=np.cumsum(n)-n
+            lo=offset+(n-1)//2
+            hi=offset+n//2
+            result[has]=(isiSorted[lo[has]]+isiSorted[hi[has]])/2
+        elif func=="first":
+            offset=np.cumsum(n)-n
+            result[has]=isi[offset[has]]
+        elif func=="last":
+            result[has]=isi[np.cumsum(n)[has]-1]
+        return result
+
+    ### PER-SWEEP METRICS
+
+    def count(self):
+        """return the number of APs in every sweep."""
+        return self.counts.astype(float)
+
+    def freq_first(self):
+        """return the first instantaneous frequency (Hz) of every sweep."""
+        return 1/self.bySweep(*self.isi(),func="first")
+
+    def freq_last(self):
+        """return the last instantaneous frequency (Hz) of every sweep."""
+        return 1/self.bySweep(*self.isi(),func="last")
+
+    def freq_mean(self):
+        """return the mean instantaneous frequency (Hz) of every sweep."""
+        sweep,isi=self.isi()
+        return self.bySweep(sweep,1/isi,func="mean")
+
+    def freq_median(self):
+        """return the median instantaneous frequency (Hz) of every sweep."""
+        sweep,isi=self.isi()
+        return self.bySweep(sweep,1/isi,func="median")
+
+    def isi_mean(self):
+        """return the mean ISI (sec) of every sweep."""
+        return self.bySweep(*self.isi(),func="mean")
+
+    def isi_cv(self):
+        """return the coefficient of variation of ISIs of every sweep."""
+        sweep,isi=self.isi()
+        mean=self.bySweep(sweep,isi,func="mean")
+        if not len(isi):
+            return mean
+        dev=(isi-mean[sweep])**2
+        var=self.bySweep(sweep,dev,func="mean")
+        return np.sqrt(var)/mean
+
+    def adaptation(self):
+        """
+        return the adaptation ratio (last ISI / first ISI) of every sweep.
+        Values >1 mean the cell slowed down. Requires at least 2 ISIs.
+        """
+        sweep,isi=self.isi()
+        first=self.bySweep(sweep,isi,func="first")
+        last=self.bySweep(sweep,isi,func="last")
+        ratio=last/first
+        ratio[self.counts<3]=np.nan
+        return ratio
+
+    def latency(self,t0=0):
+        """
+        return the time (sec) from t0 to the first AP after it in every sweep.
+        t0 can be a single time or an array of times (one per sweep).
+        """
+        t0=np.broadcast_to(np.asarray(t0,dtype=float),(self.sweeps,))
+        rel=self.times-t0[self.sweep]
+        after=rel>=0
+        result=np.full(self.sweeps,np.inf)
+        np.minimum.at(result,self.sweep[after],rel[after])
+        result[np.isinf(result)]=np.nan
+        return result
+
+    def rate(self,t1=0,t2=None):
+        """return the firing rate (Hz) between t1 and t2 of every sweep."""
+        if t2 is None:
+            t2=self.sweepLength
+        inside=(self.times>=t1)&(self.times<t2)
+        n=np.bincount(self.sweep[inside],minlength=self.sweeps)
+        return n/float(t2-t1)
+
+    ### BURSTS AND BINNING
+
+    def bursts(self,maxISI=10*ms,startISI=None,minSpikes=3):
+        """
+        detect bursts as runs of ISIs shorter than maxISI (within a sweep).
+        A burst must contain at least minSpikes APs, and if startISI is given
+        its first ISI must be shorter than startISI.
+
+        Returns a dict of equal-length arrays (one entry per burst):
+            sweep, T1, T2 (sec in sweep), APs (count), freq (Hz)
+        """
+        if startISI is None:
+            startISI=maxISI
+        empty=np.array([])
+        burst={"sweep":empty.astype(int),"T1":empty,"T2":empty,
+               "APs":empty.astype(int),"freq":empty}
+        if len(self.times)<2:
+            return burst
+        same=self.sweep[1:]==self.sweep[:-1]
+        link=same&(np.diff(self.times)<=maxISI) # APs i and i+1 in a burst
+        edges=np.diff(np.concatenate(([0],link.astype(int),[0])))
+        starts=np.where(edges==1)[0] # first AP index of each run
+        ends=np.where(edges==-1)[0] # last AP index of each run
+        nAPs=ends-starts+1
+        firstISI=self.times[starts+1]-self.times[starts]
+        keep=(nAPs>=minSpikes)&(firstISI<=startISI)
+        starts,ends,nAPs=starts[keep],ends[keep],nAPs[keep]
+        burst["sweep"]=self.sweep[starts]
+        burst["T1"]=self.times[starts]
+        burst["T2"]=self.times[ends]
+        burst["APs"]=nAPs
+        burst["freq"]=(nAPs-1)/(burst["T2"]-burst["T1"])
+        return burst
+
+    def bursts_bySweep(self,**kwargs):
+        """return the number of bursts in every sweep."""
+        burst=self.bursts(**kwargs)
+        return np.bincount(burst["sweep"],minlength=self.sweeps)
+
+    def psth(self,binSize=10*ms,t1=0,t2=None):
+        """
+        return (edges,rates) where rates is a 2d array (sweep,bin) of the
+        firing rate (Hz) in every time bin of every sweep.
+        Average across sweeps with np.average(rates,axis=0).
+        """
+        if t2 is None:
+            t2=self.sweepLength
+        nBins=int(np.ceil((t2-t1)/binSize))
+        edges=t1+np.arange(nBins+1)*binSize
+        binI=np.floor((self.times-t1)/binSize).astype(int)
+        valid=(binI>=0)&(binI<nBins)
+        flat=self.sweep[valid]*nBins+binI[valid]
+        counts=np.bincount(flat,minlength=self.sweeps*nBins)
+        return edges,counts.reshape(self.sweeps,nBins)/binSize
+
+def gainSummary(fnames,t1=None,t2=None,useCache=True):
+    """
+    Given a folder path or list of ABF files, return a dict (by ABF ID) of
+    gain function summaries. Each value is a dict of per-sweep arrays:
+    count, rate, first (Hz), median (Hz), adaptation, latency (sec).
+    Detection results are cached so summaries of re-analyzed folders are fast.
+    """
+    if type(fnames) is str and os.path.isdir(fnames):
+        fnames=[os.path.join(fnames,x) for x in cm.abfSort(os.listdir(fnames))
+                if x.lower().endswith(".abf")]
+    log=logging.getLogger("swhlab spikes")
+    summary={}
+    t0=cm.timeit()
+    for fname in fnames:
+        ap=AP(fname)
+        if t1 is not None:
+            ap.detect_time1=t1
+        if t2 is not None:
+            ap.detect_time2=t2
+        train=SpikeTrain(ap,useCache=useCache)
+        summary[ap.abf.ID]={
+            "count":train.count(),
+            "rate":train.rate(ap.detect_time1,ap.detect_time2),
+            "first":train.freq_first(),
+            "median":train.freq_median(),
+            "adaptation":train.adaptation(),
+            "latency":train.latency(ap.detect_time1),
+            }
+    log.info("gain summary of %d ABFs took %s",len(fnames),cm.timeit(t0))
+    return summary
+
+if __name__=="__main__":
+    abfFile=r"C:\Users\scott\Documents\important\abfs\16o14018.abf"
+    train=SpikeTrain(abfFile)
+    print(train.count())
+    print(train.freq_median())
+    print(train.bursts())
+    print("DONE")
@@ -0,0 +1,125 @@
+"""
+stack windows of data aligned to something (event-triggered averaging).
+
+Every function here returns a Stack: a 2d array (window,point) of data
+windows aligned to epochs, comment tags, detected events, or arbitrary
+times, along with the time base and the mean and standard deviation of the
+windows. All windows are pulled out of the sweep matrix with a single fancy
+index (no setsweep() loops), and points beyond the edge of the data are nan.
+
+Times in the experiment (comments, absolute times) treat the sweeps as one
+continuous recording (like sweepX does), so windows may cross sweeps. Times
+within a sweep (epochs, events) stay inside the sweep they're in.
+
+Typical use:
+    stack=stack_epoch(abf,2,pre=.1,post=.5)
+    plt.plot(stack.Xs,stack.chunks.T,color='.5')
+    plt.plot(stack.Xs,stack.average)
+"""
+
+import numpy as np
+
+import swhlab
+from swhlab.analysis.events import gather
+
+class Stack:
+    def __init__(self,chunks,Xs,sweeps,times):
+        """windows of data (one row per window) aligned at Xs=0."""
+        self.chunks=chunks # 2d array (window,point)
+        self.Xs=Xs # time (sec) of every point relative to the alignment
+        self.sweeps=sweeps # sweep every window is aligned in
+        self.times=times # alignment time (sec) of every window in its sweep
+        with np.errstate(invalid='ignore'):
+            if len(chunks):
+                self.average=np.nanmean(chunks,axis=0)
+                self.stdev=np.nanstd(chunks,axis=0)
+            else:
+                self.average=np.full(len(Xs),np.nan)
+                self.stdev=np.full(len(Xs),np.nan)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def baseline(self,t1,t2):
+        """return a new Stack with the average from t1 to t2 (sec) removed."""
+        inWindow=(self.Xs>=t1)&(self.Xs<t2)
+        with np.errstate(invalid='ignore'):
+            base=np.nanmean(self.chunks[:,inWindow],axis=1)
+        return Stack(self.chunks-base[:,None],self.Xs,self.sweeps,self.times)
+
+def points(abf,pre,post):
+    """return (prePoints,size,Xs) of a window from -pre to +post sec."""
+    prePoints=int(round(pre*abf.pointsPerSec))
+    size=prePoints+int(round(post*abf.pointsPerSec))
+    return prePoints,size,(np.arange(size)-prePoints)/abf.pointsPerSec
+
+def stack_indexes(abf,sweeps,indexes,pre,post,channel=None):
+    """
+    return a Stack of windows aligned to point indexes within sweeps.
+    This is what all the other stack functions use.
+    """
+    if channel is None:
+        channel=abf.channel
+    sweeps=np.asarray(sweeps,dtype=int)
+    indexes=np.asarray(indexes,dtype=int)
+    prePoints,size,Xs=points(abf,pre,post)
+    data=abf.sweepMatrix(channel)
+    chunks=gather(data,sweeps,indexes-prePoints,size)
+    return Stack(chunks,Xs,sweeps,indexes/abf.pointsPerSec)
+
+def stack_sweepTime(abf,t,pre,post,sweeps=None,channel=None):
+    """return a Stack aligned to the same time (sec) in every sweep."""
+    if sweeps is None:
+        sweeps=np.arange(abf.sweeps)
+    indexes=np.full(len(sweeps),int(round(t*abf.pointsPerSec)))
+    return stack_indexes(abf,sweeps,indexes,pre,post,channel)
+
+def stack_epoch(abf,epoch=2,pre=.1,post=.5,end=False,sweeps=None,channel=None):
+    """
+    return a Stack aligned to the start (or end) of an epoch (A=0, B=1, ...)
+    in every sweep, using the epoch table.
+    """
+    table=abf.epochTable()
+    t=table["T2" if end else "T1"][epoch]
+    return stack_sweepTime(abf,t,pre,post,sweeps,channel)
+
+def stack_times(abf,times,pre,post,channel=None):
+    """
+    return a Stack aligned to times (sec) in the experiment. Sweeps are
+    treated as one continuous recording so windows may cross sweeps.
+    """
+    if channel is None:
+        channel=abf.channel
+    times=np.asarray(times,dtype=float)
+    prePoints,size,Xs=points(abf,pre,post)
+    data=abf.sweepMatrix(channel)
+    continuous=data.reshape(1,-1)
+    indexes=np.round(times*abf.pointsPerSec).astype(int)
+    chunks=gather(continuous,np.zeros(len(times),dtype=int),
+                  indexes-prePoints,size)
+    sweeps=indexes//data.shape[1]
+    return Stack(chunks,Xs,sweeps,(indexes%data.shape[1])/abf.pointsPerSec)
+
+def stack_comments(abf,pre,post,tag=None,channel=None):
+    """
+    return a Stack aligned to every comment (or only comments containing tag)
+    of an ABF. Use stack.sweeps to see which sweep each comment was in.
+    """
+    times=[t for t,text in zip(abf.comment_times,abf.comment_tags)
+           if tag is None or tag in text]
+    return stack_times(abf,times,pre,post,channel)
+
+def stack_events(abf,events,pre,post,channel=None):
+    """
+    return a Stack aligned to detected events. Events are a structured array
+    with "sweep" and "I" fields (index within the sweep), like the results of
+    swhlab.analysis.events.Events.
+    """
+    return stack_indexes(abf,events["sweep"],events["I"],pre,post,channel)
+
+if __name__=="__main__":
+    abfFile=r"X:\Data\2P01\2016\2017-01-09 AT1\17109009.abf"
+    abf=swhlab.ABF(abfFile)
+    stack=stack_epoch(abf,2,.1,.5)
+    print("stacked %d windows of %d points"%stack.chunks.shape)
+    print("DONE")
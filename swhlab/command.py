@@ -8,6 +8,9 @@ Call this script directly:
     python.exe command.py info
 
     python C:\Users\swharden\Documents\GitHub\SWHLab\swhlab\command.py glanceFolder
+
+glanceFolder shows a thumbnail of every ABF (fast). Add "full" to make the
+full glance figure of every ABF instead (slow).
 """
 
 import os
@@ -16,6 +19,7 @@ sys.path.insert(0,'../')
 sys.path.insert(0,os.path.dirname(__file__)+'/../')
 import swhlab
 import swhlab.analysis.glance
+import swhlab.plotting.thumbnail as thumbnail
 import tempfile
 import webbrowser
 import glob
@@ -39,6 +43,7 @@ def processArgs():
         if not abfFolder or not os.path.isdir(abfFolder):
             print("bad path")
             return
+        full=len(sys.argv)>2 and sys.argv[2]=='full'
         fnames=sorted(glob.glob(abfFolder+"/*.abf"))
         outFolder=tempfile.gettempdir()+"/swhlab/"
         if os.path.exists(outFolder):
@@ -52,7 +57,10 @@ def processArgs():
             saveAs=os.path.join(os.path.dirname(outFolder),os.path.basename(fname))+".png"
             out+='<br><br><br><code>%s</code><br>'%os.path.abspath(fname)
             out+='<a href="%s"><img src="%s"></a><br>'%(saveAs,saveAs)
-            swhlab.analysis.glance.processAbf(fname,saveAs)
+            if full:
+                swhlab.analysis.glance.processAbf(fname,saveAs)
+            else:
+                thumbnail.thumbnail(fname,saveAs,width=800,height=200)
         out+='</body></html>'
         with open(outFile,'w') as f:
             f.write(out)
@@ -9,6 +9,7 @@ import numpy as np
 import time
 import datetime
 import tempfile
+import bisect
 
 ### numpy
 
@@ -33,6 +34,73 @@ def kernel_gaussian(size=100, sigma=None, forwardOnly=False):
         points[:int(len(points)/2)]=0
     return points/sum(points)
 
+def kernel_psc(size,tauRise,tauDecay):
+    """
+    return a 1d bi-exponential post-synaptic current shape of a given size.
+    Time constants are in points. The peak is normalized to 1.
+    """
+    t=np.arange(int(size),dtype=float)
+    points=(1-np.exp(-t/tauRise))*np.exp(-t/tauDecay)
+    return points/np.max(points)
+
+KERNEL_SPECTRA={} # kernel_psc_spectrum() results by (rate,size,taus,length)
+
+def kernel_psc_spectrum(rate,size,tauRiseMS,tauDecayMS,kernelMS):
+    """
+    return (fftLength,spectrum) of a kernel_psc() zero-padded so signals of
+    the given size can be convolved or deconvolved without wrapping around.
+    Spectra are cached, since every sweep of a file shares the same one.
+    """
+    key=(rate,size,tauRiseMS,tauDecayMS,kernelMS)
+    if not key in KERNEL_SPECTRA:
+        pointsPerMs=rate/1000.0
+        kernel=kernel_psc(kernelMS*pointsPerMs,tauRiseMS*pointsPerMs,
+                          tauDecayMS*pointsPerMs)
+        fftLength=fftSize(size+len(kernel))
+        KERNEL_SPECTRA[key]=(fftLength,np.fft.rfft(kernel,fftLength))
+    return KERNEL_SPECTRA[key]
+
+def fftSize(size):
+    """return the smallest power of 2 at least as large as size."""
+    return int(2**np.ceil(np.log2(max(size,1))))
+
+HARMONIC_MASKS={} # harmonic_mask() results by (size,rate,base,count,width)
+
+def harmonic_mask(size,rate,baseFrequency=60,harmonics=50,notchWidth=0):
+    """
+    return a boolean array (one value per rfft bin of a signal of the given
+    size) which is True for bins at baseFrequency and its harmonics.
+    If notchWidth (Hz) is given, every bin within notchWidth/2 is included.
+    Masks are cached since every sweep of a file shares the same one.
+    """
+    key=(size,rate,baseFrequency,harmonics,notchWidth)
+    if not key in HARMONIC_MASKS:
+        freqs=np.fft.rfftfreq(size,1.0/rate)
+        binHz=freqs[1]-freqs[0] if len(freqs)>1 else rate
+        centers=baseFrequency*np.arange(1,harmonics+1)
+        centers=centers[centers<=freqs[-1]]
+        halfWidth=max(notchWidth/2.0,binHz/2.0)
+        nearest=np.searchsorted(freqs,centers-halfWidth)
+        mask=np.zeros(len(freqs),dtype=bool)
+        for I1,center in zip(nearest,centers):
+            I2=np.searchsorted(freqs,center+halfWidth,side='right')
+            mask[I1:max(I2,I1+1)]=True
+        HARMONIC_MASKS[key]=mask
+    return HARMONIC_MASKS[key]
+
+def denoise(data,rate,baseFrequency=60,harmonics=50,notchWidth=0):
+    """
+    Remove line noise (baseFrequency and its harmonics) by silencing those
+    frequencies with an rfft. Data can be a single sweep or a 2d array of
+    sweeps (sweep,point), in which case every sweep is done in one call.
+    """
+    data=np.asarray(data,dtype=float)
+    size=data.shape[-1]
+    mask=harmonic_mask(size,rate,baseFrequency,harmonics,notchWidth)
+    spectrum=np.fft.rfft(data,axis=-1)
+    spectrum[...,mask]=0
+    return np.fft.irfft(spectrum,size,axis=-1)
+
 def lowpass(data,filterSize=None):
     """
     minimal complexity low-pass filtering.
@@ -94,6 +162,24 @@ def isIpython():
         return False
 
 
+def save_atomic(fname,write):
+    """
+    call write(f) with a temporary file (opened for binary writing) in the
+    same folder as fname, then move it to fname. Anything reading fname (like
+    a web browser or another process) never sees a half-written file.
+    """
+    fname=os.path.abspath(fname)
+    handle,tmp=tempfile.mkstemp(prefix=".tmp_",suffix=ext(fname),
+                                dir=os.path.dirname(fname))
+    try:
+        with os.fdopen(handle,'wb') as f:
+            write(f)
+        os.replace(tmp,fname)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
 def timeit(timer=None):
     """simple timer. returns a time object, or a string."""
     if timer is None:
@@ -160,28 +246,25 @@ def ext(fname):
         return os.path.splitext(fname)[1]
     return fname
 
+def abfSortKey(ID):
+    """
+    sort key which places goofy ABF names (like 16o01001) after normal ones.
+    IDs containing 'o' come after normal ones, then 'n', then 'd'.
+    """
+    if 'o' in ID:
+        return (1,ID)
+    elif 'n' in ID:
+        return (2,ID)
+    elif 'd' in ID:
+        return (3,ID)
+    return (0,ID)
+
 def abfSort(IDs):
     """
     given a list of goofy ABF names, return it sorted intelligently.
     This places things like 16o01001 after 16901001.
     """
-    IDs=list(IDs)
-    monO=[]
-    monN=[]
-    monD=[]
-    good=[]
-    for ID in IDs:
-        if ID is None:
-            continue
-        if 'o' in ID:
-            monO.append(ID)
-        elif 'n' in ID:
-            monN.append(ID)
-        elif 'd' in ID:
-            monD.append(ID)
-        else:
-            good.append(ID)
-    return sorted(good)+sorted(monO)+sorted(monN)+sorted(monD)
+    return sorted([x for x in IDs if x is not None],key=abfSortKey)
 
 def abfGroups(abfFolder):
     """
@@ -200,6 +283,9 @@ def abfGroups(abfFolder):
 
     From there, getting children files is trivial. Just find all files in
     the same folder whose filenames begin with one of the children.
+
+    Non-ABF filenames are sorted once so finding the files which start with
+    an ID is a binary search, and ABFs are bucketed by day in a single pass.
     """
 
     # prepare the list of files, filenames, and IDs
@@ -212,26 +298,26 @@ def abfGroups(abfFolder):
     files=list_to_lowercase(files)
 
     # group every filename in a different list, and determine parents
-    abfs, IDs, others, parents, days = [],[],[],[],[]
+    abfs, IDs, others, days = [],[],[],{}
     for fname in files:
         if fname.endswith(".abf"):
             abfs.append(fname)
             IDs.append(fname[:-4])
-            days.append(fname[:5])
+            days.setdefault(fname[:5],[]).append(fname)
         else:
             others.append(fname)
+    others.sort()
+    parents=set()
     for ID in IDs:
-        for fname in others:
-            if fname.startswith(ID):
-                parents.append(ID)
-    parents=abfSort(set(parents)) # allow only one copy each
-    days=abfSort(set(days)) # allow only one copy each
+        i=bisect.bisect_left(others,ID)
+        if i<len(others) and others[i].startswith(ID):
+            parents.add(ID)
 
     # match up children with parents, respecting daily orphans.
     groups={}
-    for day in days:
+    for day in abfSort(days.keys()):
         parent=None
-        for fname in [x for x in abfs if x.startswith(day)]:
+        for fname in days[day]:
             ID=fname[:-4]
             if ID in parents:
                 parent=ID
@@ -244,17 +330,37 @@ def abfGroupFiles(groups,folder):
     """
     when given a dictionary where every key contains a list of IDs, replace
     the keys with the list of files matching those IDs. This is how you get a
-    list of files belonging to each child for each parent.
+    list of files belonging to each child for each parent. Folder can be a
+    path or a list of filenames (like INDEX.files2).
+
+    Files match every ID they contain. Rather than searching every file for
+    every ID, every substring of every filename (of the lengths IDs have) is
+    looked up in a set of IDs, so this scales with the number of files.
     """
-    assert os.path.exists(folder)
-    files=os.listdir(folder)
+    if type(folder) is list:
+        files=folder
+    else:
+        assert os.path.exists(folder)
+        files=os.listdir(folder)
+    IDs=set()
+    for children in groups.values():
+        IDs.update([x for x in children if x])
+    lengths=set([len(x) for x in IDs])
+    filesByID={}
+    for fname in [x.lower() for x in files]:
+        found=set()
+        for length in lengths:
+            for i in range(len(fname)-length+1):
+                if fname[i:i+length] in IDs:
+                    found.add(fname[i:i+length])
+        for ID in found:
+            filesByID.setdefault(ID,[]).append(fname)
     group2={}
     for parent in groups.keys():
         if not parent in group2.keys():
             group2[parent]=[]
         for ID in groups[parent]:
-            for fname in [x.lower() for x in files if ID in x.lower()]:
-                group2[parent].extend([fname])
+            group2[parent].extend(filesByID.get(ID,[]))
     return group2
 
 def parent(groups,ID):
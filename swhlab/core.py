@@ -110,6 +110,7 @@ class ABF:
         self.setsweep() # run setsweep to populate sweep properties
         self.comments_load() # populate comments
         self.kernel=None # variable which may be set for convolution
+        self.cache={} # derived data (sweep matrices, etc) computed on demand
         if createFolder:
             self.output_touch() # make sure output folder exists
         #TODO: detect if invalid or corrupted ABF
@@ -125,9 +126,10 @@ class ABF:
         if sweep<0:
             sweep=self.sweeps-1-sweep # if negative, start from the end
         sweep=max(0,min(sweep,self.sweeps-1)) # correct for out of range sweeps
-        if 'sweep' in dir(self) and self.sweep == sweep and self.derivative is False:
-            self.log.debug("sweep %d already set",sweep)
-            return
+        if 'sweep' in dir(self) and (self.sweep,self.channel)==(sweep,channel):
+            if self.derivative is False or len(self.sweepD)>1:
+                self.log.debug("sweep %d (Ch%d) already set",sweep,channel)
+                return
         #self.log.debug("loading sweep %d (Ch%d)",sweep,channel)
         self.channels=self.ABFblock.segments[sweep].size["analogsignals"]
         if self.channels>1 and sweep==0:
@@ -338,6 +340,30 @@ class ABF:
         else:
             return times
 
+    def epochTable(self):
+        """
+        Return the epochs of the protocol as a structured array (one row per
+        epoch). I1/I2 are point indexes in the sweep (corrected for offsetX
+        the same way the protocol is), T1/T2 are the same in seconds. The
+        level of an epoch in any sweep is level+levelInc*sweep, so a 2d array
+        (sweep,epoch) of levels is table["level"]+np.outer(sweeps,levelInc).
+        """
+        dtype=[("epoch",int),("type",int),("I1",int),("I2",int),
+               ("T1",float),("T2",float),("level",float),("levelInc",float)]
+        if not len(self.header['dictEpochInfoPerDAC']):
+            return np.zeros(0,dtype=dtype)
+        epochs=self.header['dictEpochInfoPerDAC'][self.channel]
+        table=np.zeros(len(epochs),dtype=dtype)
+        I1=self.offsetX
+        for i,key in enumerate(sorted(epochs.keys())):
+            epoch=epochs[key]
+            I2=I1+epoch['lEpochInitDuration']
+            table[i]=(key,epoch.get('nEpochType',1),I1,I2,
+                      I1/self.pointsPerSec,I2/self.pointsPerSec,
+                      epoch['fEpochInitLevel'],epoch['fEpochLevelInc'])
+            I1=I2
+        return table
+
     ### advanced data access
 
     def average(self,t1=0,t2=None,setsweep=False):
@@ -373,6 +399,24 @@ class ABF:
         #TODO: standard deviation?
         return average
 
+    def sweepMatrix(self,channel=None):
+        """
+        Return every sweep of a channel (default is the current one) as a 2d
+        array (sweep,point) without calling setsweep(). This is what
+        vectorized analyses work on. The array is built once and cached, so
+        treat it as read-only.
+        """
+        if channel is None:
+            channel=self.channel
+        key=("sweepMatrix",channel)
+        if not key in self.cache:
+            sweeps=[seg.analogsignals[channel].magnitude.flatten()
+                    for seg in self.ABFblock.segments]
+            size=min([len(x) for x in sweeps])
+            self.cache[key]=np.array([x[:size] for x in sweeps],dtype=float)
+            self.log.debug("built %d x %d sweep matrix",len(sweeps),size)
+        return self.cache[key]
+
     def kernel_gaussian(self, sizeMS, sigmaMS=None, forwardOnly=False):
         """create kernel based on this ABF info."""
         sigmaMS=sizeMS/10 if sigmaMS is None else sigmaMS
@@ -392,6 +436,34 @@ class ABF:
         """return the sweep with sweepYfiltered subtracted from it."""
         return self.sweepY-self.sweepYfiltered()
 
+    def sweepYdenoised(self,baseFrequency=60,harmonics=50,notchWidth=0):
+        """
+        return the current sweep with line noise (baseFrequency and its
+        harmonics) removed. If the whole channel has been denoised with
+        sweepMatrixDenoised() using the same settings, that result is used
+        (unless its rows were trimmed shorter than this sweep).
+        """
+        key=("denoised",self.channel,baseFrequency,harmonics,notchWidth)
+        if key in self.cache and self.cache[key].shape[1]==len(self.sweepY):
+            return self.cache[key][self.sweep]
+        return swhlab.common.denoise(self.sweepY,self.rate,baseFrequency,
+                                     harmonics,notchWidth)
+
+    def sweepMatrixDenoised(self,baseFrequency=60,harmonics=50,notchWidth=0,
+                            channel=None):
+        """
+        return every sweep of a channel (like sweepMatrix) with line noise
+        removed. The whole channel is denoised in one call and cached.
+        """
+        if channel is None:
+            channel=self.channel
+        key=("denoised",channel,baseFrequency,harmonics,notchWidth)
+        if not key in self.cache:
+            self.cache[key]=swhlab.common.denoise(self.sweepMatrix(channel),
+                                                  self.rate,baseFrequency,
+                                                  harmonics,notchWidth)
+        return self.cache[key]
+
     def phasicNet(self,biggestEvent=50,m1=.5,m2=None):
         """
         Calculates the net difference between positive/negative phasic events
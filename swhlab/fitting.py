@@ -0,0 +1,237 @@
+"""
+curve fitting of many equal-length traces at once (numpy only, no scipy).
+
+Every function here takes a 2d array (trace,point) of equally spaced samples,
+such as every sweep or every AP decay, and fits all traces simultaneously.
+Initial estimates come from closed-form or linearized solutions, then a fixed
+number of Gauss-Newton (Levenberg-Marquardt damped) iterations refine every
+trace together by solving a small batch of normal equations with
+np.linalg.solve. Points can be excluded with a boolean mask (or by making them
+np.nan), so windows of different length can still share one array.
+
+Results are structured arrays (one row per trace) with an "ok" flag. It's
+only True if the fit converged and explains the trace better than a constant
+(flat, empty or noise-only traces aren't ok even though they "converge").
+Time constants are in units of dx (points if dx isn't given).
+
+Models:
+    * mono:  Y = A*exp(-x/tau) + C
+    * bi:    Y = A1*exp(-x/tau1) + A2*exp(-x/tau2) + C
+"""
+
+import numpy as np
+
+MIN_EXPLAINED=.2 # fraction of the variance a fit must explain to be ok
+
+MONO_DTYPE=[("A",float),("tau",float),("C",float),
+            ("rss",float),("iterations",int),("ok",bool)]
+BI_DTYPE=[("A1",float),("tau1",float),("A2",float),("tau2",float),
+          ("C",float),("rss",float),("iterations",int),("ok",bool)]
+
+def prepare(Y,mask=None):
+    """return (Y,weights) where excluded and non-finite points have 0 weight."""
+    Y=np.atleast_2d(np.asarray(Y,dtype=float))
+    weights=np.isfinite(Y)
+    if mask is not None:
+        weights=weights&np.broadcast_to(mask,Y.shape)
+    return np.where(weights,Y,0),weights.astype(float)
+
+def fit_exp_linear(Y,mask=None):
+    """
+    Fit Y=A*exp(-x/tau) (no offset) to every row using least squares on
+    log(Y). Returns (A,tau,ok) arrays with tau in points. Only positive points
+    are used, and rows with fewer than 3 of them are not ok.
+    """
+    Y,w=prepare(Y,mask)
+    w=w*(Y>0)
+    x=np.arange(Y.shape[1],dtype=float)[None,:]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        z=np.log(np.where(w>0,Y,1))*w
+        n=np.sum(w,axis=1)
+        sx,sz=np.sum(w*x,axis=1),np.sum(z,axis=1)
+        sxx,sxz=np.sum(w*x*x,axis=1),np.sum(x*z,axis=1)
+        slope=(n*sxz-sx*sz)/(n*sxx-sx**2)
+        intercept=(sz-slope*sx)/n
+        tau=-1/slope
+    ok=(n>=3)&(tau>0)&np.isfinite(tau)
+    tau[~ok]=np.nan
+    return np.exp(intercept),tau,ok
+
+def estimate_exp_offset(Y,w):
+    """
+    Closed-form (A,k,C) estimate of Y=A*exp(-k*x)+C for every row.
+    Integrating the model gives Y=Y0+k*C*x-k*S where S is the running sum of
+    Y, so a linear regression of Y against (1,x,S) gives k and C. Summing
+    averages out noise, but included points should be (mostly) contiguous.
+    """
+    x=np.arange(Y.shape[1],dtype=float)[None,:]*np.ones((len(Y),1))
+    S=np.cumsum(Y*w,axis=1)-Y*w/2 # trapezoid running sum
+    X=np.stack((w,x*w,S*w),axis=1)
+    XTX=np.einsum('tpn,tqn->tpq',X,X)+np.eye(3)[None,:,:]*1e-12
+    XTY=np.einsum('tpn,tn->tp',X,Y*w)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        try:
+            coeffs=np.linalg.solve(XTX,XTY[:,:,None])[:,:,0]
+        except np.linalg.LinAlgError:
+            coeffs=np.array([np.linalg.lstsq(a,b,rcond=None)[0]
+                             for a,b in zip(XTX,XTY)])
+        k=-coeffs[:,2]
+        k=np.where(np.isfinite(k)&(k>0),k,1.0/max(Y.shape[1],1))
+        C=coeffs[:,1]/k
+        # with k and C known, A is a linear least squares solution
+        e=np.exp(-k[:,None]*x)
+        A=np.sum(w*e*(Y-C[:,None]),axis=1)/np.sum(w*e*e,axis=1)
+    return np.nan_to_num(A),k,np.nan_to_num(C)
+
+def explains(Y,w,rss,amplitude):
+    """
+    return True for every row whose fit (with residual sum of squares rss and
+    exponential amplitude) explains at least MIN_EXPLAINED of its variance.
+    """
+    n=np.maximum(np.sum(w,axis=1),1)
+    mean=np.sum(w*Y,axis=1)/n
+    rssFlat=np.sum(w*(Y-mean[:,None])**2,axis=1) # rss of a constant
+    scale=np.max(np.abs(Y)*w,axis=1)
+    return (rss<rssFlat*(1-MIN_EXPLAINED))&(np.abs(amplitude)>scale*1e-9)
+
+def gauss_newton(model,Y,w,params,iterations=20,tol=1e-6):
+    """
+    Refine params (trace,param) of model(x,params)->(fit,jacobian) for every
+    trace at once. Returns (params,rss,iterations,converged).
+    """
+    x=np.arange(Y.shape[1],dtype=float)[None,:]
+    nParams=params.shape[1]
+    damping=np.full(len(Y),1e-3)
+    fit,J=model(x,params)
+    rss=np.sum(w*(Y-fit)**2,axis=1)
+    converged=np.zeros(len(Y),dtype=bool)
+    done=np.zeros(len(Y),dtype=int)
+    eye=np.eye(nParams)[None,:,:]
+    for i in range(iterations):
+        active=~converged
+        if not np.any(active):
+            break
+        JW=J*w[:,None,:]
+        JTJ=np.einsum('tpn,tqn->tpq',JW,J)
+        JTr=np.einsum('tpn,tn->tp',JW,Y-fit)
+        diag=np.einsum('tpp->tp',JTJ)
+        diag=np.where(diag>0,diag,1)[:,:,None]*eye # fixed params don't move
+        with np.errstate(all='ignore'):
+            try:
+                step=np.linalg.solve(JTJ+damping[:,None,None]*diag,
+                                     JTr[:,:,None])[:,:,0]
+            except np.linalg.LinAlgError:
+                step=np.zeros_like(params)
+                for t in range(len(Y)): # fall back to traces one at a time
+                    try:
+                        step[t]=np.linalg.solve(JTJ[t]+damping[t]*diag[t],JTr[t])
+                    except np.linalg.LinAlgError:
+                        pass
+        step=np.nan_to_num(step)*active[:,None]
+        trial=params+step
+        with np.errstate(all='ignore'):
+            trialFit,trialJ=model(x,trial)
+            trialRss=np.sum(w*(Y-trialFit)**2,axis=1)
+        better=np.isfinite(trialRss)&(trialRss<=rss)&active
+
+        # accept improvements, adjust damping like Levenberg-Marquardt
+        relChange=np.abs(rss-trialRss)/np.maximum(rss,1e-300)
+        params=np.where(better[:,None],trial,params)
+        fit=np.where(better[:,None],trialFit,fit)
+        J=np.where(better[:,None,None],trialJ,J)
+        rss=np.where(better,trialRss,rss)
+        damping=np.where(better,damping/10,damping*10)
+        done+=active
+        converged|=active&((better&(relChange<tol))|(damping>1e10))
+    return params,rss,done,converged
+
+def model_mono(x,params):
+    """Y=A*exp(-k*x)+C and its jacobian with respect to (A,k,C)."""
+    A,k,C=[params[:,i][:,None] for i in range(3)]
+    e=np.exp(-k*x)
+    fit=A*e+C
+    J=np.stack((e,-A*x*e,np.ones_like(fit)),axis=1)
+    return fit,J
+
+def model_bi(x,params):
+    """Y=A1*exp(-k1*x)+A2*exp(-k2*x)+C and its jacobian."""
+    A1,k1,A2,k2,C=[params[:,i][:,None] for i in range(5)]
+    e1,e2=np.exp(-k1*x),np.exp(-k2*x)
+    fit=A1*e1+A2*e2+C
+    J=np.stack((e1,-A1*x*e1,e2,-A2*x*e2,np.ones_like(fit)),axis=1)
+    return fit,J
+
+def fit_exp(Y,mask=None,dx=1.0,offset=True,iterations=20):
+    """
+    Fit Y=A*exp(-x/tau)+C to every row of Y and return a structured array
+    (fields in MONO_DTYPE). If offset is False, C is fixed at 0.
+    """
+    Y,w=prepare(Y,mask)
+    if offset:
+        A,k,C=estimate_exp_offset(Y,w)
+        params=np.vstack((A,k,C)).T
+        params,rss,done,ok=gauss_newton(model_mono,Y,w,params,iterations)
+    else:
+        A,tau,ok=fit_exp_linear(Y,w>0)
+        params=np.vstack((A,np.nan_to_num(1/tau),np.zeros(len(Y)))).T
+        def model(x,p):
+            fit,J=model_mono(x,p)
+            return fit,J*np.array([1,1,0])[None,:,None] # C stays at 0
+        params,rss,done,ok=gauss_newton(model,Y,w,params,iterations)
+    result=np.zeros(len(Y),dtype=MONO_DTYPE)
+    result["A"],result["C"]=params[:,0],params[:,2]
+    with np.errstate(divide='ignore'):
+        result["tau"]=dx/params[:,1]
+    result["rss"],result["iterations"]=rss,done
+    result["ok"]=ok&(params[:,1]>0)&(np.sum(w,axis=1)>3)
+    result["ok"]&=explains(Y,w,rss,params[:,0])
+    return result
+
+def fit_biexp(Y,mask=None,dx=1.0,iterations=50):
+    """
+    Fit Y=A1*exp(-x/tau1)+A2*exp(-x/tau2)+C to every row of Y and return a
+    structured array (fields in BI_DTYPE). tau1 is always the faster one.
+    Two sets of initial estimates are refined and the better one is kept:
+    one splits the trace in half (the second half gives the slow component
+    and offset, what's left of the first half gives the fast component) and
+    one spreads the time constant of a mono fit of the whole trace.
+    """
+    Y,w=prepare(Y,mask)
+    x=np.arange(Y.shape[1])[None,:]
+    half=Y.shape[1]//2
+    A2,k2,C=estimate_exp_offset(Y[:,half:],w[:,half:])
+    A2=A2*np.exp(np.minimum(k2*half,100)) # slow amplitude at x=0
+    residual=Y-A2[:,None]*np.exp(-k2[:,None]*x)-C[:,None]
+    A1,k1,C1=estimate_exp_offset(residual[:,:half],w[:,:half])
+    k1=np.maximum(k1,k2*2)
+    guessSplit=np.vstack((A1,k1,A2,k2,C)).T
+    A,k,C=estimate_exp_offset(Y,w)
+    guessSpread=np.vstack((A/2,k*3,A/2,k/3,C)).T
+
+    params,rss,done,ok=gauss_newton(model_bi,Y,w,guessSplit,iterations)
+    params2,rss2,done2,ok2=gauss_newton(model_bi,Y,w,guessSpread,iterations)
+    better=rss2<rss
+    params=np.where(better[:,None],params2,params)
+    rss,ok=np.where(better,rss2,rss),np.where(better,ok2,ok)
+    done=done+done2
+
+    # sort components so tau1 is the fast one
+    swap=params[:,1]<params[:,3]
+    params[swap]=params[swap][:,[2,3,0,1,4]]
+    result=np.zeros(len(Y),dtype=BI_DTYPE)
+    result["A1"],result["A2"],result["C"]=params[:,0],params[:,2],params[:,4]
+    with np.errstate(divide='ignore'):
+        result["tau1"],result["tau2"]=dx/params[:,1],dx/params[:,3]
+    result["rss"],result["iterations"]=rss,done
+    result["ok"]=ok&(params[:,1]>0)&(params[:,3]>0)&(np.sum(w,axis=1)>5)
+    result["ok"]&=explains(Y,w,rss,np.abs(params[:,0])+np.abs(params[:,2]))
+    return result
+
+def evaluate(result,size,dx=1.0):
+    """return a 2d array (trace,point) of the fitted curves of a result."""
+    x=np.arange(size)[None,:]*dx
+    if "tau2" in result.dtype.names:
+        return (result["A1"][:,None]*np.exp(-x/result["tau1"][:,None])+
+                result["A2"][:,None]*np.exp(-x/result["tau2"][:,None])+
+                result["C"][:,None])
+    return result["A"][:,None]*np.exp(-x/result["tau"][:,None])+result["C"][:,None]
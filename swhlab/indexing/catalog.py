@@ -0,0 +1,89 @@
+"""
+a catalog of every cell in an index, kept as ./swhlab/catalog.js
+
+The menu used to be one HTML link per cell, regenerated whenever anything
+changed. Now the menu is a static page which renders (with pagination and
+filtering) from the catalog in the browser. Every line of the catalog is one
+cell's record (JSON) wrapped so the page can load it with a <script> tag,
+which works when browsing the index straight off the network share:
+    CATALOG.push({"ID": "16o14001", "protocols": ["0101 IC tau"], ...});
+A cell which is new or changed only appends a line (later lines replace
+earlier ones with the same ID). The file is rewritten (compacted) only when
+cells are removed or replaced lines pile up.
+"""
+
+import os
+import json
+import logging
+
+import swhlab
+import swhlab.common as cm
+
+CATALOG_FNAME="catalog.js"
+LINE_START="CATALOG.push("
+LINE_END=");\n"
+
+class Catalog:
+    def __init__(self,folder2):
+        """open (or create) the catalog of an output (./swhlab/) folder."""
+        self.log = logging.getLogger("swhlab catalog")
+        self.log.setLevel(swhlab.loglevel)
+        self.fname=os.path.join(folder2,CATALOG_FNAME)
+        self.records={} # by ID
+        self.lines=0 # lines in the file (including replaced records)
+        self.load()
+
+    def load(self):
+        """read every record from the catalog file (if there is one)."""
+        if not os.path.exists(self.fname):
+            return
+        with open(self.fname) as f:
+            for line in f:
+                if not line.startswith(LINE_START):
+                    continue
+                self.lines+=1
+                try:
+                    record=json.loads(line[len(LINE_START):].rstrip()[:-2])
+                except ValueError:
+                    self.log.error("ignoring unreadable catalog line")
+                    continue
+                self.records[record["ID"]]=record
+
+    def line(self,record):
+        """return a record as a line of the catalog file."""
+        return LINE_START+json.dumps(record,sort_keys=True)+LINE_END
+
+    def update(self,records):
+        """
+        make the catalog hold exactly these records (a list of dicts with an
+        ID), appending only those which are new or changed.
+        """
+        IDs=set([x["ID"] for x in records])
+        removed=[x for x in self.records if not x in IDs]
+        changed=[x for x in records if self.records.get(x["ID"])!=x]
+        for record in changed:
+            self.records[record["ID"]]=record
+        for ID in removed:
+            del self.records[ID]
+        if removed or not os.path.exists(self.fname) or \
+           self.lines+len(changed)>2*len(self.records)+100:
+            self.compact()
+        elif changed:
+            with open(self.fname,'a') as f:
+                f.write("".join([self.line(x) for x in changed]))
+            self.lines+=len(changed)
+        self.log.debug("catalog has %d cells (%d changed, %d removed)",
+                       len(self.records),len(changed),len(removed))
+        return changed
+
+    def compact(self):
+        """rewrite the catalog file with one line per record."""
+        lines=[self.line(self.records[x]) for x in cm.abfSort(self.records)]
+        text="var CATALOG=CATALOG||[];\n"+"".join(lines)
+        cm.save_atomic(self.fname,lambda f:f.write(text.encode()))
+        self.lines=len(lines)
+
+if __name__=="__main__":
+    catalog=Catalog(r"X:\Data\SCOTT\2017-01-09 AT1 NTS\swhlab")
+    print("%d cells in the catalog"%len(catalog.records))
+    print("DONE")
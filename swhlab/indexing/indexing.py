@@ -23,13 +23,25 @@ import swhlab
 import time
 # now import things regularly
 
+import json
 import logging
 import shutil
+import hashlib
+import threading
+import webbrowser
 import numpy as np
 import swhlab.analysis.protocols as protocols
 import swhlab.indexing.imaging as imaging
 import swhlab.indexing.style as style
+import swhlab.plotting.thumbnail as thumbnail
 import swhlab.common as cm
+from swhlab.indexing.manifest import Manifest, fileID
+import swhlab.indexing.scanner as scanner
+from swhlab.indexing.scanner import Scanner
+from swhlab.indexing.scheduler import Scheduler
+from swhlab.indexing.catalog import Catalog
+
+PAGES_FNAME=".pages.json" # input hashes of written pages (in folder2)
 
 class INDEX:
     def __init__(self,ABFfolder):
@@ -66,99 +78,374 @@ class INDEX:
             os.mkdir(self.folder2)
 
         # scan the folders for files
-        self.scan()
-
-        # figure out parent/children ABF, ID, and file groups
-        self.groups=cm.abfGroups(self.folder1) # keys are a list of parents
-        self.log.debug("identified %d cells",len(self.groups))
-        nChildren=[len(x) for x in self.groups.values()]
-        self.log.debug("average parent has %.02f children",np.average(nChildren))
-        self.groupFiles=cm.abfGroupFiles(self.groups,self.folder2)
-        nChildrenFiles=[len(x) for x in self.groupFiles.values()]
-        self.log.debug("average parent has %.02f ./swhlab/ files",np.average(nChildrenFiles))
-
-    def scan(self):
+        self.lock=threading.Lock() # hold while scanning from build() tasks
+        self.scanner1=Scanner(self.folder1,os.path.join(self.folder2,".scan_abfs.json"))
+        self.scanner2=Scanner(self.folder2,os.path.join(self.folder2,".scan.json"))
+        self.scan() # also groups files by cell
+        self.pages=self.loadPages()
+        self.declared={} # outputs (by ID) of ABFs which aren't made yet
+        manifest=Manifest(self.folder2)
+        for record in manifest.records().values():
+            self.declare(record)
+        manifest.close()
+
+    def scan(self,fnames1=None,fnames2=None):
         """
         scan folder1 and folder2 into files1 and files2.
         since we are on windows, simplify things by making them all lowercase.
         this WILL cause problems on 'nix operating systems.If this is the case,
         just run a script to rename every file to all lowercase.
+        What changed since the last scan is stored in diff1 and diff2 (see
+        swhlab.indexing.scanner). Lists are only rebuilt if files came or went.
+        If you know which files changed, give them as fnames1 and/or fnames2
+        and only those are looked at (instead of listing the whole folder).
         """
         t1=cm.timeit()
-        self.files1=cm.list_to_lowercase(sorted(os.listdir(self.folder1)))
-        self.files2=cm.list_to_lowercase(sorted(os.listdir(self.folder2)))
-        self.files1abf=[x for x in self.files1 if x.endswith(".abf")]
-        self.files1abf=cm.list_to_lowercase(cm.abfSort(self.files1abf))
-        self.IDs=[x[:-4] for x in self.files1abf]
+        if fnames1 is None:
+            self.diff1=self.scanner1.scan()
+        else:
+            self.diff1=self.scanner1.update(fnames1)
+        if fnames2 is None:
+            self.diff2=self.scanner2.scan()
+        else:
+            self.diff2=self.scanner2.update(fnames2)
+        self.files2=self.scanner2.names()
+        if self.scanner1.names() is not getattr(self,"files1",None):
+            self.files1=self.scanner1.names()
+            self.files1abf=[x for x in self.files1 if x.endswith(".abf")]
+            self.files1abf=cm.list_to_lowercase(cm.abfSort(self.files1abf))
+            self.IDs=[x[:-4] for x in self.files1abf]
         self.log.debug("folder1 has %d files",len(self.files1))
         self.log.debug("folder1 has %d abfs",len(self.files1abf))
         self.log.debug("folder2 has %d files",len(self.files2))
-        self.log.debug("scanning folders took %s",cm.timeit(t1)) # ~200ms
+        self.log.debug("scanning folders took %s",cm.timeit(t1))
+        self.group()
+
+    def group(self):
+        """
+        figure out parent/children ABF, ID, and file groups from the scanned
+        file lists. Groups are only recalculated if files came or went.
+        """
+        grouped=getattr(self,"groupedFrom",(None,None))
+        if grouped[0] is self.files1 and grouped[1] is self.files2:
+            return
+        if grouped[0] is self.files1:
+            # only output files came or went, so just update their groups
+            removed=set(self.diff2["removed"])
+            if removed:
+                for parent in self.groupFiles:
+                    self.groupFiles[parent]=[x for x in self.groupFiles[parent]
+                                             if not x in removed]
+            added=cm.abfGroupFiles(self.groups,self.diff2["added"])
+            for parent in added:
+                self.groupFiles[parent]=self.groupFiles.get(parent,[])+added[parent]
+            self.groupedFrom=(self.files1,self.files2)
+            return
+        self.groups=cm.abfGroups(self.files1) # keys are a list of parents
+        self.log.debug("identified %d cells",len(self.groups))
+        nChildren=[len(x) for x in self.groups.values()]
+        self.log.debug("average parent has %.02f children",np.average(nChildren))
+        self.groupFiles=cm.abfGroupFiles(self.groups,self.files2)
+        nChildrenFiles=[len(x) for x in self.groupFiles.values()]
+        self.log.debug("average parent has %.02f ./swhlab/ files",np.average(nChildrenFiles))
+        self.groupedFrom=(self.files1,self.files2)
+
+    def declare(self,report):
+        """
+        note which outputs of an analysis report (or manifest record) don't
+        exist yet, like those of a lazy build. Pages still show them, and
+        swhlab.indexing.server makes them when they're first requested.
+        """
+        ID=fileID(report.get("fname",report.get("ID","")))
+        files2=set(self.files2)
+        missing=[os.path.basename(x) for x in report["outputs"]]
+        missing=[x for x in missing if not x.lower() in files2]
+        if missing and not report["error"]:
+            self.declared[ID]=missing
+        else:
+            self.declared.pop(ID,None)
+
+    def cellFiles(self,parentID):
+        """
+        return every file (existing or declared) belonging to a cell, except
+        thumbnails (which are only for the menu).
+        """
+        files=[x for x in self.groupFiles.get(parentID,[])
+               if not x.endswith("_"+thumbnail.SUFFIX)]
+        for ID in self.groups.get(parentID,[]):
+            files.extend([x for x in self.declared.get(ID,[]) if not x in files])
+        return files
+
+    def changedIDs(self):
+        """return a set of ABF IDs with files changed in the last scan."""
+        IDs=set(self.IDs)
+        changed=set()
+        for fname in scanner.changed(self.diff1)+scanner.changed(self.diff2):
+            ID=os.path.splitext(fname)[0].split("_")[0]
+            if ID in IDs:
+                changed.add(ID)
+        return changed
 
     ### DATA ANALYSIS AND CONVERSION
 
-    def convertImages(self):
+    def imageJobs(self):
         """
-        run this to turn all folder1 TIFs and JPGs into folder2 data.
+        return a list of images in folder1 which need to be in folder2 as
+        (ID, source path, destination path, True if it's a TIF to convert).
         TIFs will be treated as micrographs and converted to JPG with enhanced
         contrast. JPGs will simply be copied over.
         """
-
-        # copy over JPGs (and such)
-        exts=['.jpg','.png']
-        for fname in [x for x in self.files1 if cm.ext(x) in exts]:
+        jobs=[]
+        for fname in self.files1:
+            if cm.ext(fname) in ['.jpg','.png']:
+                tif=False
+            elif cm.ext(fname) in ['.tif','.tiff']:
+                tif=True
+            else:
+                continue
             ID="UNKNOWN"
             if len(fname)>8 and fname[:8] in self.IDs:
                 ID=fname[:8]
-            fname2=ID+"_jpg_"+fname
-            if not fname2 in self.files2:
-                self.log.info("copying over [%s]"%fname2)
-                shutil.copy(os.path.join(self.folder1,fname),os.path.join(self.folder2,fname2))
+            if tif:
+                fname2=ID+"_tif_"+fname+".jpg"
+            else:
+                fname2=ID+"_jpg_"+fname
             if not fname[:8]+".abf" in self.files1:
                 self.log.error("orphan image: %s",fname)
-
-        # convert TIFs (and such) to JPGs
-        exts=['.tif','.tiff']
-        for fname in [x for x in self.files1 if cm.ext(x) in exts]:
-            ID="UNKNOWN"
-            if len(fname)>8 and fname[:8] in self.IDs:
-                ID=fname[:8]
-            fname2=ID+"_tif_"+fname+".jpg"
             if not fname2 in self.files2:
-                self.log.info("converting micrograph [%s]"%fname2)
-                imaging.TIF_to_jpg(os.path.join(self.folder1,fname),saveAs=os.path.join(self.folder2,fname2))
-            if not fname[:8]+".abf" in self.files1:
-                self.log.error("orphan image: %s",fname)
+                jobs.append((ID,os.path.join(self.folder1,fname),
+                             os.path.join(self.folder2,fname2),tif))
+        return jobs
 
-    def analyzeAll(self):
-        """analyze every unanalyzed ABF in the folder."""
-        searchableData=str(self.files2)
-        self.log.debug("considering analysis for %d ABFs",len(self.IDs))
-        for ID in self.IDs:
-            if not ID+"_" in searchableData:
-                self.log.debug("%s needs analysis",ID)
-                try:
-                    self.analyzeABF(ID)
-                except:
-                    print("EXCEPTION! "*100)
-            else:
-                self.log.debug("%s has existing analysis, not overwriting",ID)
+    def convertImages(self):
+        """run this to turn all folder1 TIFs and JPGs into folder2 data."""
+        for ID,fname,fname2,tif in self.imageJobs():
+            self.log.info("making [%s]",os.path.basename(fname2))
+            convertImage(fname,fname2,tif)
+
+    def analyzeAll(self,workers=None):
+        """
+        analyze every ABF in the folder which is new, changed, or was analyzed
+        by a different version of swhlab (using every core).
+        """
+        manifest=Manifest(self.folder2)
+        needed=self.staleABFs(manifest)
+        for fname in needed:
+            self.deleteData(fileID(fname))
+        manifest.record(protocols.analyze_many(needed,workers))
+        manifest.close()
         self.log.debug("verified analysis of %d ABFs",len(self.IDs))
 
-    def analyzeABF(self,ID):
+    def staleABFs(self,manifest,lazy=False):
         """
-        Analye a single ABF: make data, index it.
-        If called directly, will delete all ID_data_ and recreate it.
+        return full paths of ABFs which are new, changed, or were analyzed by
+        a different version of swhlab (according to a Manifest). If lazy,
+        ABFs missing outputs aren't stale (their outputs are made on demand).
         """
+        self.log.debug("considering analysis for %d ABFs",len(self.IDs))
+        fnames=[os.path.join(self.folder1,ID+".abf") for ID in self.IDs]
+        needed=manifest.stale(fnames,None if lazy else self.files2)
+
+        # ABFs analyzed before the manifest existed are adopted, not redone
+        records=manifest.records()
+        prefixes=set([x.split("_")[0] for x in self.files2 if "_" in x])
+        adopt=[x for x in needed if not fileID(x) in records and
+               fileID(x) in prefixes]
+        if len(adopt):
+            self.log.debug("adopting existing analysis of %d ABFs",len(adopt))
+            manifest.record([{"fname":x,"hash":None} for x in adopt])
+            needed=[x for x in needed if not x in adopt]
+        return needed
+
+    def deleteData(self,ID):
+        """delete every ID_data_ file of an ABF and return their filenames."""
+        deleted=[]
         for fname in self.files2:
             if fname.startswith(ID+"_data_"):
                 self.log.debug("deleting [%s]",fname)
                 os.remove(os.path.join(self.folder2,fname))
+                deleted.append(fname)
+        return deleted
+
+    def analyzeABF(self,ID):
+        """
+        Analye a single ABF: make data, index it.
+        If called directly, will delete all ID_data_ and recreate it.
+        """
+        self.deleteData(ID)
         self.log.info("analyzing (with overwrite) [%s]",ID)
-        protocols.analyze(os.path.join(self.folder1,ID+".abf"))
+        report=protocols.analyze_file(os.path.join(self.folder1,ID+".abf"))
+        manifest=Manifest(self.folder2)
+        manifest.record(report)
+        manifest.close()
+
+    def analyzeNew(self,fnames,workers=None):
+        """
+        analyze a few new (or rewritten) ABF files and update the index pages
+        of their cells and the menu. Only these files and their outputs are
+        looked at, so this is fast no matter how big the folder is.
+        """
+        fnames=[os.path.join(self.folder1,os.path.basename(x)) for x in fnames]
+        self.log.info("analyzing %d new ABFs",len(fnames))
+        changed2=[]
+        for fname in fnames:
+            changed2.extend(self.deleteData(fileID(fname)))
+        reports=protocols.analyze_many(fnames,workers)
+        manifest=Manifest(self.folder2)
+        manifest.record(reports)
+        manifest.close()
+        for report in reports:
+            changed2.extend([os.path.basename(x) for x in report["outputs"]])
+        self.scan(fnames,changed2)
+        for report in reports:
+            self.declare(report)
+        parents=set([cm.parent(self.groups,x) for x in self.changedIDs()])
+        parents=list(parents-set([None]))
+        self.html_single_basic(parents,overwrite=True)
+        self.html_single_plot(parents,overwrite=True)
+        pages=[x+"_basic.html" for x in parents]+[x+"_plot.html" for x in parents]
+        self.scan([],pages)
+        self.html_index(launch=False)
+
+    ### BUILDING
+
+    def build(self,analyze=True,convert=True,index=True,overwrite=False,
+              launch=False,processes=None,lazy=False):
+        """
+        analyze ABFs, convert images, and make pages for everything that needs
+        it as tasks of a Scheduler, so independent work overlaps: a cell's
+        pages are made as soon as its own ABFs and images are done, while other
+        cells are still being analyzed. Analysis and TIF conversion use a pool
+        of processes (one per core by default). If overwrite, the pages of
+        every cell are remade (not just cells with something new). If lazy,
+        ABFs are only inspected (not analyzed) and their figures are made
+        when someone looks at them (see swhlab.indexing.server).
+        """
+        t1=cm.timeit()
+        sched=Scheduler(processes,initializer=protocols.worker_init)
+        work={} # names of tasks making files by ID
+        analyses=[]
+        if analyze:
+            manifest=Manifest(self.folder2)
+            needed=self.staleABFs(manifest,lazy)
+            manifest.close()
+            for fname in needed:
+                ID=fileID(fname)
+                self.deleteData(ID)
+                name=sched.add("analyze "+ID,protocols.analyze_file,[fname],
+                               {"declareOnly":lazy},kind="cpu")
+                work.setdefault(ID,[]).append(name)
+                analyses.append(name)
+        if convert:
+            for ID,fname,fname2,tif in self.imageJobs():
+                name=sched.add("image "+os.path.basename(fname2),convertImage,
+                               [fname,fname2,tif],kind="cpu" if tif else "io")
+                work.setdefault(ID,[]).append(name)
+        if index:
+            if overwrite:
+                parents=set(self.groups.keys())
+            else:
+                changed=self.changedIDs()|set(work.keys())
+                parents=set([cm.parent(self.groups,x) for x in changed])
+            pages=[]
+            for parentID in cm.abfSort(parents):
+                deps=[]
+                for ID in self.groups[parentID]:
+                    deps.extend(work.get(ID,[]))
+                pages.append(sched.add("pages "+parentID,self.htmlCell,
+                                       [parentID,sched,deps],deps=deps,
+                                       anyway=True))
+            sched.add("menu",self.htmlMenu,[sched,pages,launch],deps=pages,
+                      anyway=True)
+        sched.run()
+
+        reports=[sched.result(x) for x in analyses if sched.result(x)]
+        for report in reports:
+            self.declare(report)
+        for report in [x for x in reports if x["error"]]:
+            self.log.error("%s (%s) FAILED:\n%s",os.path.basename(report["fname"]),
+                           report["protocol"],report["error"])
+        manifest=Manifest(self.folder2)
+        manifest.record(reports)
+        manifest.close()
+        self.log.info("building the index took %s",cm.timeit(t1))
+
+    def htmlCell(self,parentID,sched=None,deps=[]):
+        """
+        remake the pages of a cell. If given a Scheduler and the names of its
+        tasks which made files for this cell, note those files first.
+        """
+        results=[sched.result(x) for x in deps]
+        made=[]
+        for result in results:
+            made.extend(madeFiles(result))
+        with self.lock:
+            self.scan([],made)
+            for result in [x for x in results if type(x) is dict]:
+                self.declare(result)
+        self.html_single_basic([parentID],overwrite=True)
+        self.html_single_plot([parentID],overwrite=True)
+        return [parentID+"_basic.html",parentID+"_plot.html"]
+
+    def htmlMenu(self,sched=None,deps=[],launch=False):
+        """
+        remake the menu. If given a Scheduler and the names of its tasks which
+        made pages, note those pages first.
+        """
+        made=[]
+        for name in deps:
+            made.extend(madeFiles(sched.result(name)))
+        with self.lock:
+            self.scan([],made)
+        self.html_index(launch=launch)
 
     ### HTML GENERATION
 
+    def loadPages(self):
+        """return the input hashes (by filename) of pages already written."""
+        fname=os.path.join(self.folder2,PAGES_FNAME)
+        if not os.path.exists(fname):
+            return {}
+        try:
+            with open(fname) as f:
+                return json.load(f)
+        except Exception:
+            self.log.error("ignoring unreadable page hashes [%s]",fname)
+            return {}
+
+    def pageKey(self,fname,files):
+        """
+        return a hash of everything a page is made from: the names of the
+        files it shows, the sizes and mtimes of those which aren't HTML (pages
+        change every time they're written), and the template version.
+        """
+        inputs=[style.TEMPLATE_VERSION,self.folder1,fname]
+        for name in sorted(files):
+            if name.endswith(".html"):
+                inputs.append(name)
+            else:
+                inputs.append([name]+list(self.scanner2.files.get(name,[])))
+        return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()
+
+    def pageNeeded(self,fname,key,overwrite=True):
+        """
+        return True if a page is missing, or if overwrite and what it's made
+        from changed since it was written.
+        """
+        if not fname in self.files2:
+            return True
+        return overwrite and self.pages.get(fname)!=key
+
+    def pagesWritten(self,keys):
+        """remember the input hashes (a dict by filename) of written pages."""
+        if not keys:
+            return
+        with self.lock:
+            self.pages.update(keys)
+            text=json.dumps(self.pages).encode()
+            cm.save_atomic(os.path.join(self.folder2,PAGES_FNAME),
+                           lambda f:f.write(text))
+
     def htmlFor(self,fname):
         """return appropriate HTML determined by file extension."""
         if os.path.splitext(fname)[1].lower() in ['.jpg','.png']:
@@ -180,15 +467,20 @@ class INDEX:
         generate a generic flat file html for an ABF parent. You could give
         this a single ABF ID, its parent ID, or a list of ABF IDs.
         If a child ABF is given, the parent will automatically be used.
+        Pages are only rewritten if the files they show changed.
         """
         if type(abfID) is str:
             abfID=[abfID]
+        written={}
         for thisABFid in cm.abfSort(abfID):
             parentID=cm.parent(self.groups,thisABFid)
             saveAs=os.path.abspath("%s/%s_basic.html"%(self.folder2,parentID))
-            if overwrite is False and os.path.basename(saveAs) in self.files2:
+            files=self.cellFiles(parentID)
+            key=self.pageKey(os.path.basename(saveAs),files)
+            if not self.pageNeeded(os.path.basename(saveAs),key,overwrite):
                 continue
-            filesByType=cm.filesByType(self.groupFiles[parentID])
+            written[os.path.basename(saveAs)]=key
+            filesByType=cm.filesByType(files)
             html=""
             html+='<div style="background-color: #DDDDDD;">'
             html+='<span class="title">summary of data from: %s</span></br>'%parentID
@@ -214,17 +506,21 @@ class INDEX:
                 html+='<br>'*3
             print("creating",saveAs,'...')
             style.save(html,saveAs,launch=launch)
+        self.pagesWritten(written)
 
     def html_single_plot(self,abfID,launch=False,overwrite=False):
-        """create ID_plot.html of just intrinsic properties."""
+        """create ID_plot.html of just intrinsic properties (if they changed)."""
         if type(abfID) is str:
             abfID=[abfID]
+        written={}
         for thisABFid in cm.abfSort(abfID):
             parentID=cm.parent(self.groups,thisABFid)
             saveAs=os.path.abspath("%s/%s_plot.html"%(self.folder2,parentID))
-            if overwrite is False and os.path.basename(saveAs) in self.files2:
+            filesByType=cm.filesByType(self.cellFiles(parentID))
+            key=self.pageKey(os.path.basename(saveAs),filesByType['plot'])
+            if not self.pageNeeded(os.path.basename(saveAs),key,overwrite):
                 continue
-            filesByType=cm.filesByType(self.groupFiles[parentID])
+            written[os.path.basename(saveAs)]=key
             html=""
             html+='<div style="background-color: #DDDDFF;">'
             html+='<span class="title">intrinsic properties for: %s</span></br>'%parentID
@@ -234,45 +530,98 @@ class INDEX:
                 html+=self.htmlFor(fname)
             print("creating",saveAs,'...')
             style.save(html,saveAs,launch=launch)
+        self.pagesWritten(written)
+
 
+    def catalogRecord(self,parentID,records={}):
+        """
+        return the catalog record (dict) of a cell. Protocols come from the
+        records of a Manifest (by ID) if given.
+        """
+        children=[x for x in self.groups[parentID] if x]
+        protocols=[]
+        for ID in children:
+            protocol=records.get(ID,{}).get("protocol")
+            if protocol and not protocol in protocols:
+                protocols.append(protocol)
+        files=self.groupFiles.get(parentID,[])
+        byType=cm.filesByType(files)
+        images=byType["tif"]+[x for x in byType["other"] if "_jpg_" in x]
+        images+=byType["plot"]+byType["experiment"]
+        images=[x for x in images if cm.ext(x) in ['.jpg','.png']]
+        thumb=parentID+"_"+thumbnail.SUFFIX
+        if not thumb in files:
+            thumb=images[0] if images else ""
+        stat=self.scanner1.files.get(parentID+".abf")
+        date=time.strftime("%Y-%m-%d",time.localtime(stat[1])) if stat else ""
+        return {"ID":parentID,
+                "children":children,
+                "protocols":protocols,
+                "date":date,
+                "thumb":thumb,
+                "files":len(files)}
 
     def html_index(self,launch=True):
-        html="<h1>MENU</h1>"
-        htmlFiles=[x for x in self.files2 if x.endswith(".html")]
-        for htmlFile in cm.abfSort(htmlFiles):
-            if not htmlFile.endswith('_basic.html'):
-                continue
-            name=htmlFile.split("_")[0]
-            if name in self.groups.keys():
-                html+='<a href="%s" target="content">%s</a> '%(htmlFile,name)
-                html+='<span style="color: #CCC;">'
-                html+='[<a href="%s" target="content">int</a>]'%(name+"_plot.html")
-                html+='</span>'
-                html+='<br>'
-        style.save(html,os.path.abspath(self.folder2+"/index_menu.html"))
-        html="<h1>SPLASH</h1>"
-        style.save(html,os.path.abspath(self.folder2+"/index_splash.html"))
-        style.frames(os.path.abspath(self.folder2+"/index.html"),launch=launch)
+        """
+        update the catalog of cells (see swhlab.indexing.catalog) which the
+        menu renders from, and create the menu (and the frames around it).
+        The pages themselves only need to be written once.
+        """
+        parents=[x.split("_")[0] for x in self.files2 if x.endswith('_basic.html')]
+        parents=[x for x in cm.abfSort(parents) if x in self.groups.keys()]
+        manifest=Manifest(self.folder2)
+        records=manifest.records()
+        manifest.close()
+        catalog=Catalog(self.folder2)
+        catalog.update([self.catalogRecord(x,records) for x in parents])
+        written={}
+        key=self.pageKey("index_menu.html",[])
+        if self.pageNeeded("index_menu.html",key):
+            style.save(style.menu,os.path.abspath(self.folder2+"/index_menu.html"))
+            written["index_menu.html"]=key
+        key=self.pageKey("index_splash.html",[])
+        if self.pageNeeded("index_splash.html",key):
+            html="<h1>SPLASH</h1>"
+            style.save(html,os.path.abspath(self.folder2+"/index_splash.html"))
+            written["index_splash.html"]=key
+        key=self.pageKey("index.html",[])
+        fname=os.path.abspath(self.folder2+"/index.html")
+        if self.pageNeeded("index.html",key):
+            style.frames(fname)
+            written["index.html"]=key
+        self.pagesWritten(written)
+        if launch:
+            webbrowser.open(fname)
         return
 
+def convertImage(fname,fname2,tif=False):
+    """make a JPG of a TIF (or copy any other image) and return its path."""
+    if tif:
+        imaging.TIF_to_jpg(fname,saveAs=fname2)
+    else:
+        shutil.copy(fname,fname2)
+    return fname2
+
+def madeFiles(result):
+    """
+    return the filenames made by a build task given what it returned
+    (an analysis report, a path, or a list of paths).
+    """
+    if result is None:
+        return []
+    if type(result) is dict:
+        return [os.path.basename(x) for x in result["outputs"]]
+    if type(result) is str:
+        return [os.path.basename(result)]
+    return [os.path.basename(x) for x in result]
+
 ### TODO: streamline from here down #########################################
 
 def doStuff(ABFfolder,analyze=False,convert=False,index=True,overwrite=True,
             launch=True):
     """Inelegant for now, but lets you manually analyze every ABF in a folder."""
     IN=INDEX(ABFfolder)
-    if analyze:
-        IN.analyzeAll()
-    if convert:
-        IN.convertImages()
-    if analyze or convert:
-        IN=INDEX(ABFfolder) # rescan needed
-    if index:
-        IN.scan() # scanning is slow, so don't do it often
-        IN.html_single_basic(IN.groups.keys(),overwrite=overwrite)
-        IN.html_single_plot(IN.groups.keys(),overwrite=overwrite)
-        IN.scan() # scanning is slow, so don't do it often
-        IN.html_index(launch=launch) # generate master
+    IN.build(analyze,convert,index,overwrite,launch)
 
 def analyzeSingle(abfFname):
     """Reanalyze data for a single ABF. Also remakes child and parent html."""
@@ -293,21 +642,17 @@ if __name__=="__main__":
     swhlab.loglevel=swhlab.loglevel_QUIET
     ABFfolder=None
 
-    while True:
-
-        for maybe in [
-                      r"X:\Data\SCOTT\2017-01-09 AT1 NTS",
-                      #r"X:\Data\SCOTT\2017-04-24 aging BLA",
-                      #r"X:\Data\SCOTT\2017-04-19 OT ChR2",
-                      ]:
-            if os.path.isdir(maybe):
-                ABFfolder=maybe
-        print("using ABF folder:",ABFfolder)
+    for maybe in [
+                  r"X:\Data\SCOTT\2017-01-09 AT1 NTS",
+                  #r"X:\Data\SCOTT\2017-04-24 aging BLA",
+                  #r"X:\Data\SCOTT\2017-04-19 OT ChR2",
+                  ]:
+        if os.path.isdir(maybe):
+            ABFfolder=maybe
+    print("using ABF folder:",ABFfolder)
 
-        doStuff(ABFfolder,analyze=True,convert=True,index=True,overwrite=True,launch=False)
-        #doStuff(ABFfolder,analyze=True,convert=True,index=True,overwrite=True)
-        for i in range(10):
-            time.sleep(1)
-            print("waiting",i)
+    # analyze and index new ABFs as they are recorded
+    import swhlab.indexing.watch
+    swhlab.indexing.watch.watch(ABFfolder)
 
-    print("DONE")
\ No newline at end of file
+    print("DONE")
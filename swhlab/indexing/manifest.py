@@ -0,0 +1,204 @@
+"""
+a record of what has been analyzed, kept as ./swhlab/manifest.db (SQLite).
+
+Every analyzed ABF gets one row holding its size, modification time, content
+hash, protocol, the swhlab version that analyzed it, and the outputs it made.
+Deciding what needs analysis is then a dictionary lookup per ABF:
+    * ABFs that were never analyzed
+    * ABFs analyzed by a different swhlab version
+    * ABFs whose size or mtime changed (and whose content hash changed too,
+      so copying a folder which resets mtimes doesn't reanalyze everything)
+    * ABFs whose last successful analysis made outputs which are now missing
+      (if a file list is given)
+Failed analyses are recorded too (with their error), so they aren't retried
+until the file or the version changes.
+
+Hashes are only calculated for new or modified files, so checking tens of
+thousands of unchanged ABFs costs a stat() each and one database query.
+
+Every figure (or other output) made in the output folder also gets a row
+(see swhlab.plotting.render.cacheKey) keyed on what it was made from, so
+reanalysis doesn't draw figures which would come out the same.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+
+import swhlab
+from swhlab.version import __version__
+
+MANIFEST_FNAME="manifest.db"
+
+def fileHash(fname,blockSize=2**20):
+    """return the SHA1 hex digest of the contents of a file."""
+    sha=hashlib.sha1()
+    with open(fname,'rb') as f:
+        for block in iter(lambda: f.read(blockSize),b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def fileID(fname):
+    """return the (lowercase) ID of an ABF file."""
+    return os.path.splitext(os.path.basename(fname))[0].lower()
+
+class Manifest:
+    def __init__(self,folder2,version=__version__):
+        """open (or create) the manifest in an output (./swhlab/) folder."""
+        self.log = logging.getLogger("swhlab manifest")
+        self.log.setLevel(swhlab.loglevel)
+        self.fname=os.path.join(folder2,MANIFEST_FNAME)
+        self.version=version
+        self.db=sqlite3.connect(self.fname)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS abfs (
+                           ID TEXT PRIMARY KEY,
+                           size INTEGER,
+                           mtime REAL,
+                           hash TEXT,
+                           protocol TEXT,
+                           version TEXT,
+                           outputs TEXT,
+                           analyzed REAL,
+                           seconds REAL,
+                           error TEXT)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS renders (
+                           fname TEXT PRIMARY KEY,
+                           ID TEXT,
+                           key TEXT,
+                           rendered REAL)""")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def query(self,sql,args=()):
+        """return a list of records (dicts) from a SELECT statement."""
+        cursor=self.db.execute(sql,args)
+        names=[x[0] for x in cursor.description]
+        records=[]
+        for row in cursor:
+            record=dict(zip(names,row))
+            record["outputs"]=json.loads(record["outputs"] or "[]")
+            records.append(record)
+        return records
+
+    def records(self):
+        """return a dict (by ID) of every record."""
+        return dict([(x["ID"],x) for x in self.query("SELECT * FROM abfs")])
+
+    def get(self,ID):
+        """return the record of an ABF ID (or None)."""
+        records=self.query("SELECT * FROM abfs WHERE ID=?",(ID.lower(),))
+        return records[0] if records else None
+
+    def stale(self,fnames,files2=None):
+        """
+        return the subset of ABF files (in the same order) which need analysis.
+        If files2 (a list of filenames in the output folder) is given, ABFs
+        whose analysis succeeded but whose recorded outputs (what it made, see
+        protocols.analyze_file) are missing from it are also stale.
+        """
+        records=self.records()
+        if files2 is not None:
+            files2=set([x.lower() for x in files2])
+        stale=[]
+        for fname in fnames:
+            ID=fileID(fname)
+            record=records.get(ID)
+            if record is None:
+                self.log.debug("%s has never been analyzed",ID)
+            elif record["version"]!=self.version:
+                self.log.debug("%s was analyzed by version %s",ID,record["version"])
+            elif self.changed(fname,record):
+                self.log.debug("%s changed since it was analyzed",ID)
+            elif files2 is not None and not record["error"] and \
+                 any([not os.path.basename(x).lower() in files2
+                      for x in record["outputs"]]):
+                self.log.debug("%s is missing outputs",ID)
+            else:
+                continue
+            stale.append(fname)
+        self.log.debug("%d of %d ABFs need analysis",len(stale),len(fnames))
+        return stale
+
+    def changed(self,fname,record):
+        """return True if a file's contents differ from its record."""
+        stat=os.stat(fname)
+        if stat.st_size==record["size"] and stat.st_mtime==record["mtime"]:
+            return False
+        if stat.st_size!=record["size"] or record["hash"] is None or \
+           fileHash(fname)!=record["hash"]:
+            return True
+        self.log.debug("%s was touched but not changed",fileID(fname))
+        self.db.execute("UPDATE abfs SET mtime=? WHERE ID=?",
+                        (stat.st_mtime,record["ID"]))
+        self.db.commit()
+        return False
+
+    def abfHash(self,fname):
+        """
+        return the content hash of an ABF, from its record if the file wasn't
+        modified since (so unchanged ABFs aren't read again).
+        """
+        record=self.get(fileID(fname))
+        stat=os.stat(fname)
+        if record and record["hash"] and stat.st_size==record["size"] and \
+           stat.st_mtime==record["mtime"]:
+            return record["hash"]
+        return fileHash(fname)
+
+    def renderKey(self,fname):
+        """return the key a figure (filename) was rendered with (or None)."""
+        row=self.db.execute("SELECT key FROM renders WHERE fname=?",
+                            (os.path.basename(fname).lower(),)).fetchone()
+        return row[0] if row else None
+
+    def rendered(self,fname,ID,key):
+        """note that a figure (filename) of an ABF ID was made with this key."""
+        self.db.execute("INSERT OR REPLACE INTO renders VALUES (?,?,?,?)",
+                        (os.path.basename(fname).lower(),ID.lower(),key,
+                         time.time()))
+        self.db.commit()
+
+    def record(self,reports):
+        """
+        record analysis reports (see protocols.analyze_file) of ABF files.
+        A single report dict may be given instead of a list. The content hash
+        of a file is taken from its report (None if unknown, which is treated
+        as changed if its size or mtime ever changes) or its record, and it's
+        only read if neither has it.
+        """
+        if type(reports) is dict:
+            reports=[reports]
+        rows=[]
+        for report in reports:
+            fname=report["fname"]
+            if not os.path.exists(fname):
+                continue
+            stat=os.stat(fname)
+            rows.append((fileID(fname),stat.st_size,stat.st_mtime,
+                         report["hash"] if "hash" in report else
+                         self.abfHash(fname),
+                         report.get("protocol"),self.version,
+                         json.dumps(report.get("outputs",[])),time.time(),
+                         report.get("seconds"),report.get("error")))
+        self.db.executemany("INSERT OR REPLACE INTO abfs VALUES "
+                            "(?,?,?,?,?,?,?,?,?,?)",rows)
+        self.db.commit()
+        self.log.debug("recorded analysis of %d ABFs",len(rows))
+
+    def forget(self,ID):
+        """remove an ABF from the manifest so it gets analyzed again."""
+        self.db.execute("DELETE FROM abfs WHERE ID=?",(ID.lower(),))
+        self.db.execute("DELETE FROM renders WHERE ID=?",(ID.lower(),))
+        self.db.commit()
+
+if __name__=="__main__":
+    folder=r"X:\Data\SCOTT\2017-01-09 AT1 NTS"
+    manifest=Manifest(os.path.join(folder,"swhlab"))
+    abfs=[os.path.join(folder,x) for x in os.listdir(folder) if x.endswith(".abf")]
+    print("%d of %d ABFs need analysis"%(len(manifest.stale(abfs)),len(abfs)))
+    print("DONE")
@@ -0,0 +1,136 @@
+"""
+incremental folder scanning with a cached stat index.
+
+Listing a folder on a network share is slow, and INDEX used to list (and
+re-sort) its folders several times per run. A Scanner lists a folder once per
+scan with os.scandir (which gets file sizes and times along with the names),
+keeps the result in a small JSON cache, and reports only what changed since
+the last scan:
+    diff=scanner.scan()
+    diff["added"], diff["removed"], diff["modified"] # lists of filenames
+
+Filenames are lowercase (like INDEX uses). Hidden files (starting with a dot,
+like the cache itself and temporary files) are ignored.
+"""
+
+import os
+import json
+import logging
+
+import swhlab
+import swhlab.common as cm
+
+class Scanner:
+    def __init__(self,folder,cacheFname=None):
+        """
+        prepare to scan a folder. If cacheFname is given, the stat index is
+        cached there so diffs persist between runs. Nothing is written by
+        default, since the scanned folder (like one of raw data) may be
+        read-only: keep the cache in an output folder (like ./swhlab/).
+        """
+        self.log = logging.getLogger("swhlab scanner")
+        self.log.setLevel(swhlab.loglevel)
+        self.folder=os.path.abspath(folder)
+        self.cacheFname=cacheFname
+        self.files={} # (size,mtime) by lowercase filename
+        self.sorted=None # sorted list of filenames (made when needed)
+        self.load()
+
+    def load(self):
+        """load the cached stat index (if there is one)."""
+        if not self.cacheFname or not os.path.exists(self.cacheFname):
+            return
+        try:
+            with open(self.cacheFname) as f:
+                self.files=dict([(k,tuple(v)) for k,v in json.load(f).items()])
+        except Exception:
+            self.log.error("ignoring unreadable scan cache [%s]",self.cacheFname)
+            self.files={}
+
+    def save(self):
+        """save the stat index to the cache file."""
+        if not self.cacheFname:
+            return
+        text=json.dumps(self.files).encode()
+        cm.save_atomic(self.cacheFname,lambda f:f.write(text))
+
+    def scan(self):
+        """
+        list the folder and return a dict of lists of filenames which were
+        added, removed, or modified (size or mtime) since the last scan.
+        """
+        t1=cm.timeit()
+        files={}
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith("."):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat=entry.stat()
+            except OSError:
+                continue # it disappeared while we looked
+            files[entry.name.lower()]=(stat.st_size,stat.st_mtime)
+        old=self.files
+        diff={"added":sorted([x for x in files if not x in old]),
+              "removed":sorted([x for x in old if not x in files]),
+              "modified":sorted([x for x in files if x in old and
+                                 tuple(old[x])!=files[x]])}
+        self.files=files
+        if diff["added"] or diff["removed"]:
+            self.sorted=None
+        if diff["added"] or diff["removed"] or diff["modified"]:
+            self.save()
+        self.log.debug("scanned %d files in [%s] (%d added, %d removed, "
+                       "%d modified) in %s",len(files),self.folder,
+                       len(diff["added"]),len(diff["removed"]),
+                       len(diff["modified"]),cm.timeit(t1))
+        return diff
+
+    def update(self,fnames):
+        """
+        like scan(), but only stat the given filenames (or paths) rather than
+        listing the whole folder. Use this when you already know what changed.
+        """
+        diff={"added":[],"removed":[],"modified":[]}
+        for fname in set([os.path.basename(x) for x in fnames]):
+            name=fname.lower()
+            if name.startswith("."):
+                continue
+            try:
+                stat=os.stat(os.path.join(self.folder,fname))
+                value=(stat.st_size,stat.st_mtime)
+            except OSError:
+                value=None
+            if value is None and name in self.files:
+                diff["removed"].append(name)
+                del self.files[name]
+            elif value is not None and not name in self.files:
+                diff["added"].append(name)
+                self.files[name]=value
+            elif value is not None and tuple(self.files[name])!=value:
+                diff["modified"].append(name)
+                self.files[name]=value
+        for key in diff:
+            diff[key].sort()
+        if diff["added"] or diff["removed"]:
+            self.sorted=None
+        if diff["added"] or diff["removed"] or diff["modified"]:
+            self.save()
+        return diff
+
+    def names(self):
+        """return a sorted list of every filename from the last scan."""
+        if self.sorted is None:
+            self.sorted=sorted(self.files.keys())
+        return self.sorted
+
+def changed(diff):
+    """return a sorted list of every filename in a diff."""
+    return sorted(set(diff["added"]+diff["removed"]+diff["modified"]))
+
+if __name__=="__main__":
+    scanner=Scanner(r"X:\Data\SCOTT\2017-01-09 AT1 NTS")
+    diff=scanner.scan()
+    print("%d files, %d changed"%(len(scanner.names()),len(changed(diff))))
+    print("DONE")
@@ -0,0 +1,159 @@
+"""
+a small task scheduler to build an index with every core busy.
+
+Building an index is a lot of small jobs: analyzing ABFs and converting TIFs
+(CPU-bound), and copying images and writing HTML (I/O-bound). Some depend on
+others (a cell's page needs the outputs of its ABFs) but most don't. Tasks
+are added with the names of the tasks they depend on, and run() starts every
+task as soon as its dependencies are done:
+    * "cpu" tasks run in a pool of worker processes (one per core)
+    * "io" tasks run in a pool of threads
+    sched=Scheduler()
+    sched.add("analyze 16o14001",protocols.analyze_file,[fname],kind="cpu")
+    sched.add("page 16o14001",makePage,deps=["analyze 16o14001"])
+    sched.run()
+    sched.result("analyze 16o14001")
+
+CPU task functions (and their arguments) must be picklable (module-level
+functions). A task that fails (or depends on one that failed) keeps its error
+as a string, and the tasks depending on it are skipped (unless they were
+added with anyway=True, like pages which show whatever files were made).
+"""
+
+import time
+import logging
+import multiprocessing
+import concurrent.futures as futures
+
+import swhlab
+import swhlab.common as cm
+
+KINDS=["cpu","io"]
+
+class Task:
+    def __init__(self,name,function,args=(),kwargs={},deps=(),kind="io",
+                 anyway=False):
+        """a function to call (and what it needs done first)."""
+        assert kind in KINDS
+        self.name=name
+        self.function=function
+        self.args=args
+        self.kwargs=kwargs
+        self.deps=list(deps)
+        self.kind=kind
+        self.anyway=anyway # run even if dependencies failed
+        self.result=None
+        self.error=None # None, or a string if the task (or a dep) failed
+        self.seconds=None
+
+class Scheduler:
+    def __init__(self,processes=None,threads=8,initializer=None):
+        """
+        prepare to run tasks in a pool of processes (default: one per core)
+        and a pool of threads. Processes run initializer() when they start.
+        """
+        self.log = logging.getLogger("swhlab scheduler")
+        self.log.setLevel(swhlab.loglevel)
+        if processes is None:
+            processes=multiprocessing.cpu_count()
+        self.processes=max(1,processes)
+        self.threads=max(1,threads)
+        self.initializer=initializer
+        self.tasks={} # by name, in the order they were added
+
+    def add(self,name,function,args=(),kwargs={},deps=(),kind="io",
+            anyway=False):
+        """
+        add a task and return its name (to be used as a dependency). If
+        anyway, it runs after its dependencies even if some of them failed.
+        """
+        if name in self.tasks:
+            raise ValueError("task already exists: %s"%name)
+        self.tasks[name]=Task(name,function,args,kwargs,deps,kind,anyway)
+        return name
+
+    def result(self,name):
+        """return what a task's function returned (None if it failed)."""
+        return self.tasks[name].result
+
+    def errors(self):
+        """return a dict of errors (strings) of tasks which failed."""
+        return dict([(x.name,x.error) for x in self.tasks.values() if x.error])
+
+    def pools(self):
+        """return a dict of executors (by kind) for the kinds of tasks we have."""
+        kinds=set([x.kind for x in self.tasks.values()])
+        pools={}
+        if "cpu" in kinds:
+            pools["cpu"]=futures.ProcessPoolExecutor(self.processes,
+                                                    initializer=self.initializer)
+        if "io" in kinds:
+            pools["io"]=futures.ThreadPoolExecutor(self.threads)
+        return pools
+
+    def run(self):
+        """run every task (respecting dependencies) and return the errors."""
+        t1=cm.timeit()
+        for task in self.tasks.values():
+            missing=[x for x in task.deps if not x in self.tasks]
+            if missing:
+                raise ValueError("%s depends on unknown tasks: %s"%(task.name,
+                                 ", ".join(missing)))
+        waiting=list(self.tasks.values())
+        done=set()
+        running={} # task by future
+        started={} # start time by task name
+        pools=self.pools()
+        try:
+            while waiting or running:
+
+                # start (or skip) every task whose dependencies are done
+                progress=True
+                while progress:
+                    progress=False
+                    for task in [x for x in waiting if set(x.deps)<=done]:
+                        waiting.remove(task)
+                        progress=True
+                        failed=[x for x in task.deps if self.tasks[x].error]
+                        if failed and not task.anyway:
+                            task.error="skipped (%s failed)"%failed[0]
+                            done.add(task.name)
+                            continue
+                        started[task.name]=time.time()
+                        future=pools[task.kind].submit(task.function,
+                                                       *task.args,**task.kwargs)
+                        running[future]=task
+
+                if not running:
+                    if waiting:
+                        raise ValueError("circular dependencies: %s"%
+                                         ", ".join([x.name for x in waiting]))
+                    break
+
+                # collect whatever finishes next
+                finished,_=futures.wait(running,
+                                        return_when=futures.FIRST_COMPLETED)
+                for future in finished:
+                    task=running.pop(future)
+                    task.seconds=time.time()-started[task.name]
+                    try:
+                        task.result=future.result()
+                    except Exception as e:
+                        task.error=str(e) or type(e).__name__
+                        self.log.error("%s FAILED: %s",task.name,task.error)
+                    done.add(task.name)
+                    self.log.debug("%s took %.02f s",task.name,task.seconds)
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+        self.log.info("%d tasks (%d failed) took %s",len(self.tasks),
+                      len(self.errors()),cm.timeit(t1))
+        return self.errors()
+
+if __name__=="__main__":
+    sched=Scheduler()
+    for i in range(10):
+        sched.add("sleep %d"%i,time.sleep,[.5])
+    sched.add("done",print,["all done"],deps=["sleep %d"%i for i in range(10)])
+    sched.run()
+    print("DONE")
@@ -0,0 +1,178 @@
+"""
+a local web server for browsing an index, which makes figures on demand.
+
+Pre-rendering every figure of every ABF takes most of the time of building
+an index, and most figures are never looked at. This server (standard library
+only) serves the ./swhlab/ folder of an index, and when a page asks for an
+output which doesn't exist yet (like those of a lazy build, see INDEX.build)
+it analyzes that ABF with the usual protocol code into a disk cache and serves
+it from there. Cached files are evicted least-recently-used first once the
+cache gets too big.
+    INDEX(ABFfolder).build(lazy=True) # fast: ABFs are only inspected
+    swhlab.indexing.server.serve(ABFfolder) # then browse http://localhost:8000
+"""
+
+import os
+import hashlib
+import logging
+import functools
+import mimetypes
+import threading
+import collections
+import http.server
+import concurrent.futures as futures
+
+import swhlab
+import swhlab.common as cm
+import swhlab.analysis.protocols as protocols
+from swhlab.indexing.indexing import INDEX
+from swhlab.indexing.manifest import Manifest
+
+class RenderCache:
+    def __init__(self,folder,maxMB=500):
+        """
+        a folder of rendered files which never holds more than maxMB.
+        Files are evicted in order of when they were last used (their mtime,
+        so the order survives restarts).
+        """
+        self.log = logging.getLogger("swhlab server")
+        self.log.setLevel(swhlab.loglevel)
+        self.folder=os.path.abspath(folder)
+        self.maxBytes=maxMB*2**20
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.lock=threading.Lock()
+        self.sizes=collections.OrderedDict() # bytes by filename, oldest first
+        entries=[x for x in os.scandir(self.folder) if x.is_file()]
+        for entry in sorted(entries,key=lambda x:x.stat().st_mtime):
+            self.sizes[entry.name]=entry.stat().st_size
+
+    def path(self,fname):
+        return os.path.join(self.folder,os.path.basename(fname))
+
+    def get(self,fname):
+        """return the path of a cached file (marking it used) or None."""
+        fname=os.path.basename(fname)
+        with self.lock:
+            if not fname in self.sizes:
+                return None
+            self.sizes.move_to_end(fname)
+        try:
+            os.utime(self.path(fname))
+        except OSError:
+            with self.lock:
+                self.sizes.pop(fname,None)
+            return None
+        return self.path(fname)
+
+    def add(self,fnames):
+        """note new files which were put in the cache folder, then evict."""
+        with self.lock:
+            for fname in [os.path.basename(x) for x in fnames]:
+                if os.path.exists(self.path(fname)):
+                    self.sizes[fname]=os.path.getsize(self.path(fname))
+                    self.sizes.move_to_end(fname)
+            total=sum(self.sizes.values())
+            while total>self.maxBytes and len(self.sizes)>1:
+                fname,size=self.sizes.popitem(last=False)
+                self.log.debug("evicting [%s]",fname)
+                try:
+                    os.remove(self.path(fname))
+                except OSError:
+                    pass
+                total-=size
+
+class IndexServer(http.server.ThreadingHTTPServer):
+    def __init__(self,address,ABFfolder,cacheFolder=None,cacheMB=500,
+                 workers=None):
+        """serve the index of an ABF folder (rendering figures on demand)."""
+        self.log = logging.getLogger("swhlab server")
+        self.log.setLevel(swhlab.loglevel)
+        self.IN=INDEX(ABFfolder)
+        handler=functools.partial(IndexHandler,directory=self.IN.folder2)
+        http.server.ThreadingHTTPServer.__init__(self,address,handler)
+        if cacheFolder is None:
+            folderHash=hashlib.sha1(self.IN.folder1.encode()).hexdigest()[:10]
+            cacheFolder=os.path.join(cm.userFolder(),"cache",folderHash)
+        self.cache=RenderCache(cacheFolder,cacheMB)
+        self.pool=futures.ProcessPoolExecutor(workers,
+                                              initializer=protocols.worker_init)
+        self.locks={} # by ABF ID (so each ABF is only rendered once at a time)
+        self.lock=threading.Lock()
+
+    def server_close(self):
+        http.server.ThreadingHTTPServer.server_close(self)
+        self.pool.shutdown()
+
+    def render(self,fname):
+        """
+        return the path of an output file (like 16o14001_plot_ic_tau.jpg),
+        analyzing its ABF into the cache if needed. Returns None if it's not
+        an output of an ABF in the index (or its analysis didn't make it).
+        """
+        fname=os.path.basename(fname)
+        cached=self.cache.get(fname)
+        if cached:
+            return cached
+        ID=fname.split("_")[0].lower()
+        if not ID in self.IN.IDs:
+            return None
+        manifest=Manifest(self.IN.folder2)
+        record=manifest.get(ID)
+        manifest.close()
+        names=[os.path.basename(x) for x in record["outputs"]] if record else []
+        names=[x for x in names if x.lower()==fname.lower()]
+        if not names:
+            return None
+        fname=names[0]
+        with self.lock:
+            lock=self.locks.setdefault(ID,threading.Lock())
+        with lock:
+            cached=self.cache.get(fname) # maybe rendered while we waited
+            if cached:
+                return cached
+            self.log.info("rendering %s for [%s]",ID,fname)
+            abfFile=os.path.join(self.IN.folder1,ID+".abf")
+            report=self.pool.submit(protocols.analyze_file,abfFile,True,
+                                    self.cache.folder).result()
+            if report["error"]:
+                self.log.error("rendering %s FAILED:\n%s",ID,report["error"])
+            self.cache.add(report["outputs"])
+        return self.cache.get(fname)
+
+class IndexHandler(http.server.SimpleHTTPRequestHandler):
+
+    def send_head(self):
+        """serve files of the index normally, and render missing outputs."""
+        path=self.translate_path(self.path)
+        if os.path.exists(path):
+            return http.server.SimpleHTTPRequestHandler.send_head(self)
+        rendered=self.server.render(path)
+        if not rendered:
+            self.send_error(404,"File not found")
+            return None
+        f=open(rendered,'rb')
+        self.send_response(200)
+        self.send_header("Content-type",mimetypes.guess_type(rendered)[0] or
+                         "application/octet-stream")
+        self.send_header("Content-Length",str(os.fstat(f.fileno()).st_size))
+        self.end_headers()
+        return f
+
+    def log_message(self,format,*args):
+        self.server.log.debug(format,*args)
+
+def serve(ABFfolder,port=8000,cacheFolder=None,cacheMB=500,workers=None):
+    """browse the index of an ABF folder at http://localhost:port (forever)."""
+    server=IndexServer(("localhost",port),ABFfolder,cacheFolder,cacheMB,workers)
+    print("serving [%s] at http://localhost:%d"%(server.IN.folder2,port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__=="__main__":
+    serve(r"X:\Data\SCOTT\2017-01-09 AT1 NTS")
+    print("DONE")
@@ -13,6 +13,8 @@ import tempfile
 import webbrowser
 #import common
 
+TEMPLATE_VERSION=2 # change when page HTML changes so pages get remade
+
 stylesheet="""
 
 body{
@@ -63,6 +65,91 @@ html_bot="""
 </html>
 """
 
+# the menu renders every cell in catalog.js (see swhlab.indexing.catalog)
+menu="""<h1>MENU</h1>
+<input id="filter" size="18" placeholder="filter (ID, protocol, date)"
+ onkeyup="show(0)"><br>
+<label><input type="checkbox" id="thumbs" onclick="show(page)">thumbnails</label>
+<div id="nav"></div>
+<div id="cells"></div>
+<script>var CATALOG=[];</script>
+<script src="catalog.js"></script>
+<script>
+var PAGE_SIZE=100;
+var page=0;
+
+// the last record of each ID wins (changed cells are appended)
+var cells=[];
+var byID={};
+for (var i=0; i<CATALOG.length; i++){
+    if (!(CATALOG[i].ID in byID)) cells.push(CATALOG[i].ID);
+    byID[CATALOG[i].ID]=CATALOG[i];
+}
+
+function matching(){
+    var words=document.getElementById("filter").value.toLowerCase().split(" ");
+    var found=[];
+    for (var i=0; i<cells.length; i++){
+        var cell=byID[cells[i]];
+        var text=[cell.ID,cell.date,cell.protocols.join(" ")].join(" ").toLowerCase();
+        var ok=true;
+        for (var j=0; j<words.length; j++){
+            if (words[j] && text.indexOf(words[j])<0) ok=false;
+        }
+        if (ok) found.push(cell);
+    }
+    return found;
+}
+
+// catalog fields (like comments from cells files) are text, never HTML
+function link(href,text){
+    var a=document.createElement("a");
+    a.href=encodeURIComponent(href);
+    a.target="content";
+    if (text) a.textContent=text;
+    return a;
+}
+
+function show(newPage){
+    var found=matching();
+    var pages=Math.max(1,Math.ceil(found.length/PAGE_SIZE));
+    page=Math.min(Math.max(0,newPage),pages-1);
+    var thumbs=document.getElementById("thumbs").checked;
+    var list=document.createDocumentFragment();
+    var last=Math.min(found.length,(page+1)*PAGE_SIZE);
+    for (var i=page*PAGE_SIZE; i<last; i++){
+        var cell=found[i];
+        list.appendChild(link(cell.ID+'_basic.html',cell.ID));
+        list.appendChild(document.createTextNode(" "));
+        var span=document.createElement("span");
+        span.style.color="#CCC";
+        span.appendChild(document.createTextNode("["));
+        span.appendChild(link(cell.ID+'_plot.html',"int"));
+        span.appendChild(document.createTextNode("] "+cell.protocols.join(", ")));
+        list.appendChild(span);
+        list.appendChild(document.createElement("br"));
+        if (thumbs && cell.thumb){
+            var a=link(cell.ID+'_basic.html');
+            var img=document.createElement("img");
+            img.src=encodeURIComponent(cell.thumb);
+            img.height=60;
+            a.appendChild(img);
+            list.appendChild(a);
+            list.appendChild(document.createElement("br"));
+        }
+    }
+    var div=document.getElementById("cells");
+    div.textContent="";
+    div.appendChild(list);
+    var nav='<a href="#" onclick="show(page-1); return false;">&lt;</a> ';
+    nav+=(found.length ? page*PAGE_SIZE+1 : 0)+'-'+last+' of '+found.length;
+    nav+=' <a href="#" onclick="show(page+1); return false;">&gt;</a>';
+    document.getElementById("nav").innerHTML=nav;
+}
+show(0);
+</script>
+"""
+
 stylesheetSaved=False # module global
 
 def frames(fname=None,menuWidth=200,launch=False):
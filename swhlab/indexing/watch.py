@@ -0,0 +1,277 @@
+r"""
+watch a folder for new ABFs and analyze and index them as they arrive.
+
+This replaces polling the whole folder every few seconds (and spinning on
+getsize until a copy finishes). A Watcher learns about files from Linux
+inotify events as they happen, or (on other systems, or if inotify isn't
+available) by listing the folder every interval. Either way a file is only
+considered ready once:
+    * its size and mtime haven't changed for `settle` seconds
+    * it has no companion .rsv file (ClampEx holds one while recording)
+Ready files are put on a work queue. watch() runs a Watcher and a worker
+thread which analyzes queued ABFs and updates just their pages in the index:
+    swhlab.indexing.watch.watch(r"X:\Data\SCOTT\2017-01-09 AT1 NTS")
+"""
+
+import os
+import sys
+import time
+import queue
+import struct
+import select
+import logging
+import threading
+import ctypes
+import ctypes.util
+
+import swhlab
+import swhlab.indexing.indexing as indexing
+
+### INOTIFY
+
+IN_MODIFY=0x00000002
+IN_CLOSE_WRITE=0x00000008
+IN_MOVED_FROM=0x00000040
+IN_MOVED_TO=0x00000080
+IN_CREATE=0x00000100
+IN_DELETE=0x00000200
+IN_Q_OVERFLOW=0x00004000
+IN_NONBLOCK=0o4000
+IN_CLOEXEC=0o2000000
+WATCH_MASK=(IN_MODIFY|IN_CLOSE_WRITE|IN_MOVED_FROM|IN_MOVED_TO|IN_CREATE|
+            IN_DELETE)
+EVENT_HEADER="iIII" # wd, mask, cookie, len (then len bytes of name)
+EVENT_HEADER_SIZE=struct.calcsize(EVENT_HEADER)
+
+class Inotify:
+    def __init__(self,folder):
+        """watch a folder with Linux inotify (raises OSError if we can't)."""
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify requires linux")
+        libc=ctypes.CDLL(ctypes.util.find_library("c"),use_errno=True)
+        self.fd=libc.inotify_init1(IN_NONBLOCK|IN_CLOEXEC)
+        if self.fd<0:
+            raise OSError(ctypes.get_errno(),"inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd,os.fsencode(folder),WATCH_MASK)<0:
+            errno=ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno,"inotify_add_watch failed [%s]"%folder)
+
+    def read(self,timeout):
+        """
+        wait up to timeout seconds for events and return a list of the
+        filenames they were about. Returns None if events were lost (the
+        kernel queue overflowed) and the folder must be listed instead.
+        """
+        if not select.select([self.fd],[],[],timeout)[0]:
+            return []
+        try:
+            data=os.read(self.fd,2**16)
+        except BlockingIOError:
+            return []
+        names=[]
+        i=0
+        while i+EVENT_HEADER_SIZE<=len(data):
+            wd,mask,cookie,length=struct.unpack_from(EVENT_HEADER,data,i)
+            i+=EVENT_HEADER_SIZE
+            name=data[i:i+length].split(b"\0")[0]
+            i+=length
+            if mask&IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+### WATCHING
+
+class Watcher:
+    def __init__(self,folder,work=None,exts=[".abf"],settle=2.0,interval=1.0,
+                 polling=False):
+        """
+        watch a folder for new or rewritten files (with these extensions) and
+        put the full path of each one onto a work queue (a queue.Queue) once
+        it's done being written. Files already there aren't new. Use
+        polling=True to list the folder every interval instead of inotify.
+        """
+        self.log = logging.getLogger("swhlab watch")
+        self.log.setLevel(swhlab.loglevel)
+        self.folder=os.path.abspath(folder)
+        self.work=queue.Queue() if work is None else work
+        self.exts=[x.lower() for x in exts]
+        self.settle=settle
+        self.interval=interval
+        self.stats=self.listFolder() # (size,mtime) of every file we know of
+        self.pending={} # [size,mtime,time it last changed] of settling files
+        self.inotify=None
+        if not polling:
+            try:
+                self.inotify=Inotify(self.folder)
+                self.log.debug("watching [%s] with inotify",self.folder)
+            except Exception as e:
+                self.log.info("inotify unavailable (%s), polling instead",e)
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify=None
+
+    def wanted(self,fname):
+        """return True if a filename has an extension we watch for."""
+        return os.path.splitext(fname)[1].lower() in self.exts
+
+    def stat(self,fname):
+        """return (size,mtime) of a file in the folder (or None)."""
+        try:
+            stat=os.stat(os.path.join(self.folder,fname))
+        except OSError:
+            return None
+        return (stat.st_size,stat.st_mtime)
+
+    def listFolder(self):
+        """return (size,mtime) of every watched file in the folder by name."""
+        stats={}
+        for entry in os.scandir(self.folder):
+            if not self.wanted(entry.name):
+                continue
+            try:
+                stat=entry.stat()
+            except OSError:
+                continue
+            stats[entry.name]=(stat.st_size,stat.st_mtime)
+        return stats
+
+    def locked(self,fname):
+        """return True if a file has a companion .rsv file (still recording)."""
+        base=os.path.join(self.folder,os.path.splitext(fname)[0])
+        return os.path.exists(base+".rsv") or os.path.exists(base+".RSV")
+
+    def candidates(self,names):
+        """
+        return the names (of the given ones) which appeared or changed.
+        A lock file (.rsv) coming or going makes its file a candidate.
+        """
+        found=[]
+        for name in set(names):
+            if os.path.splitext(name)[1].lower()==".rsv":
+                base=os.path.splitext(name)[0]
+                name=[base+x for x in self.exts+[x.upper() for x in self.exts]
+                      if os.path.exists(os.path.join(self.folder,base+x))]
+                if not name:
+                    continue
+                name=name[0]
+                self.stats.pop(name,None) # reconsider it even if unchanged
+            if not self.wanted(name):
+                continue
+            stat=self.stat(name)
+            if stat is None:
+                self.stats.pop(name,None)
+                self.pending.pop(name,None)
+            elif self.stats.get(name)!=stat:
+                self.stats[name]=stat
+                found.append(name)
+        return found
+
+    def events(self):
+        """wait for (up to interval) and return a list of changed names."""
+        if self.inotify:
+            names=self.inotify.read(self.interval)
+            if names is not None:
+                return self.candidates(names)
+            self.log.info("inotify queue overflowed, listing the folder")
+        else:
+            time.sleep(self.interval)
+        stats=self.listFolder()
+        found=[x for x in stats if self.stats.get(x)!=stats[x]]
+        for name in [x for x in self.pending if not x in stats]:
+            del self.pending[name]
+        self.stats=stats
+        return found
+
+    def check(self):
+        """return full paths of pending files which are done being written."""
+        now=time.time()
+        ready=[]
+        for name in sorted(self.pending.keys()):
+            size,mtime,since=self.pending[name]
+            stat=self.stat(name)
+            if stat is None:
+                del self.pending[name]
+            elif stat!=(size,mtime):
+                self.pending[name]=[stat[0],stat[1],now]
+            elif now-since>=self.settle and not self.locked(name):
+                del self.pending[name]
+                ready.append(os.path.join(self.folder,name))
+        return ready
+
+    def poll(self):
+        """
+        wait for changes (up to interval seconds), put files which are ready
+        onto the work queue, and return a list of them.
+        """
+        now=time.time()
+        for name in self.events():
+            if not name in self.pending:
+                self.log.debug("%s is being written",name)
+            stat=self.stats[name]
+            self.pending[name]=[stat[0],stat[1],now]
+        ready=self.check()
+        for fname in ready:
+            self.log.info("%s is ready",os.path.basename(fname))
+            self.work.put(fname)
+        return ready
+
+    def run(self,stop=None):
+        """poll forever (or until a threading.Event is set)."""
+        while stop is None or not stop.is_set():
+            self.poll()
+
+### DAEMON
+
+def index_worker(IN,work,workers=None):
+    """
+    analyze ABFs from the work queue (everything queued at once as a batch)
+    and update the index. A None on the queue stops the worker.
+    """
+    log=logging.getLogger("swhlab watch")
+    while True:
+        fnames=[work.get()]
+        while not work.empty():
+            fnames.append(work.get_nowait())
+        stop=None in fnames
+        fnames=[x for x in fnames if x is not None]
+        if len(fnames):
+            try:
+                IN.analyzeNew(fnames,workers)
+            except Exception:
+                log.exception("failed to index %d new ABFs",len(fnames))
+        if stop:
+            return
+
+def watch(ABFfolder,settle=2.0,interval=1.0,polling=False,workers=None,
+          stop=None):
+    """
+    bring the index of a folder up to date, then analyze and index every new
+    ABF as soon as it's done being recorded (forever, or until stop is set).
+    """
+    indexing.doStuff(ABFfolder,analyze=True,convert=True,index=True,
+                     overwrite=False,launch=False)
+    IN=indexing.INDEX(ABFfolder)
+    work=queue.Queue()
+    watcher=Watcher(ABFfolder,work,settle=settle,interval=interval,
+                    polling=polling)
+    worker=threading.Thread(target=index_worker,args=(IN,work,workers))
+    worker.daemon=True
+    worker.start()
+    try:
+        watcher.run(stop)
+    finally:
+        watcher.close()
+        work.put(None)
+        worker.join()
+
+if __name__=="__main__":
+    watch(r"X:\Data\SCOTT\2017-01-09 AT1 NTS")
+    print("DONE")
@@ -12,18 +12,25 @@ import swhlab
 # now import things regularly
 import logging
 import glob
+import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.collections
 
 import swhlab.version as version
+import swhlab.common
 from swhlab.core import ABF
+import swhlab.plotting.decimate as decimate
+import swhlab.plotting.render as render
 
 # global module variables which control behavior
 IMAGE_SAVE=True
 IMAGE_SHOW=True
+DECIMATE=False # plot min/max envelopes of long sweeps (see ABFplot)
 
-def frameAndSave(abf,tag="",dataType="plot",saveAsFname=False):
+def frameAndSave(abf,tag="",dataType="plot",saveAsFname=False,fig=None):
     """
-    frame the current matplotlib plot with ABF info, and optionally save it.
+    frame a matplotlib figure (the current pyplot figure if not given) with
+    ABF info, and optionally save it.
     Note that this is entirely independent of the ABFplot class object.
     if saveImage is False, show it instead.
 
@@ -31,27 +38,31 @@ def frameAndSave(abf,tag="",dataType="plot",saveAsFname=False):
         * plot
         * experiment
     """
-    plt.tight_layout()
-    plt.subplots_adjust(top=.93,bottom =.07)
-    plt.annotate(tag,(.01,.99),xycoords='figure fraction',ha='left',va='top',family='monospace',size=10,alpha=.5)
-    msgBot="%s [%s]"%(abf.ID,abf.protocomment)
-    plt.annotate(msgBot,(.01,.01),xycoords='figure fraction',ha='left',va='bottom',family='monospace',size=10,alpha=.5)
+    if fig is None:
+        fig=plt.gcf()
     fname=tag.lower().replace(" ",'_')+".jpg"
     fname=dataType+"_"+fname
+    if saveAsFname:
+        saveAs=os.path.abspath(saveAsFname)
+    else:
+        saveAs=os.path.abspath(abf.outPre+fname)
+    render.layout(fig)
+    fig.subplots_adjust(top=.93,bottom =.07)
+    fig.text(.01,.99,tag,ha='left',va='top',family='monospace',size=10,alpha=.5)
+    msgBot="%s [%s]"%(abf.ID,abf.protocomment)
+    fig.text(.01,.01,msgBot,ha='left',va='bottom',family='monospace',size=10,alpha=.5)
     if IMAGE_SAVE:
         abf.log.info("saving [%s]",fname)
         try:
-            if saveAsFname:
-                saveAs=os.path.abspath(saveAsFname)
-            else:
-                saveAs=os.path.abspath(abf.outPre+fname)
-            plt.savefig(saveAs)
+            swhlab.common.save_atomic(saveAs,lambda f:
+                fig.savefig(f,format=os.path.splitext(saveAs)[1][1:]))
         except:
             abf.log.error("saving [%s] failed! 'pip install pillow'?",fname)
-    if IMAGE_SHOW:
-        abf.log.info("showing [%s]",fname)
-        plt.show()
-    plt.close('all')
+    if render.isPyplot(fig):
+        if IMAGE_SHOW:
+            abf.log.info("showing [%s]",fname)
+            plt.show()
+        plt.close('all')
 
 class ABFplot:
     def __init__(self,abf):
@@ -59,6 +70,8 @@ class ABFplot:
         self.log = logging.getLogger("swhlab plot")
         self.log.setLevel(swhlab.loglevel)
 
+        self.ax=None # the axes to draw on (made by figure() if not given)
+        self.followed=None # axes figure() took from pyplot (not given to us)
         self.close(True) # premptive?
 
         # prepare ABF class
@@ -71,7 +84,9 @@ class ABFplot:
         self.figure_width=10
         self.figure_height=5
         self.figure_dpi=300
-        self.subplot=False # set to True to prevent running plt.figure()
+        self.subplot=False # set to True to draw on the current pyplot axes
+        # plot min/max envelopes of long sweeps (analyze_file sets abf.decimate)
+        self.decimate=getattr(abf,"decimate",DECIMATE)
 
         self.gridAlpha=.5
         self.title=os.path.basename(abf.filename)
@@ -80,6 +95,8 @@ class ABFplot:
         self.rainbow=True
         self.colormap="Dark2"
         self.marginX,self.marginY=0,.1
+        self.drawn=[] # figure_ calls drawn on our figure (see drawing())
+        self.renderCache=False # let save() skip figures saved before
 
         self.log.debug("plot initiated")
 
@@ -87,16 +104,28 @@ class ABFplot:
     ### high level plot operations
 
     def figure(self,forceNew=False):
-        """make sure a figure is ready."""
-        if plt._pylab_helpers.Gcf.get_num_fig_managers()>0 and forceNew is False:
-            self.log.debug("figure already seen, not creating one.")
-            return
-
-        if self.subplot:
-            self.log.debug("subplot mode enabled, not creating new figure")
-        else:
+        """
+        make sure there's something to draw on, and return it (axes). That's
+        self.ax if it was set (like to a subplot of a render.figure()). With
+        pyplot, it's otherwise the current axes if there's a figure (so
+        plt.subplot() before each figure_ call still picks where it goes), and
+        always in subplot mode. If there's nothing, a new figure is made.
+        """
+        given=self.ax is not None and self.ax is not self.followed and \
+              render.isOpen(self.ax.figure)
+        if self.subplot or (render.PYPLOT and not forceNew and not given and
+                            len(plt.get_fignums())):
+            self.log.debug("drawing on the current pyplot axes")
+            if not plt.gca() is self.ax:
+                self.drawn=[]
+            self.ax=self.followed=plt.gca()
+        elif self.ax is None or forceNew or not render.isOpen(self.ax.figure):
             self.log.debug("creating new figure")
-            plt.figure(figsize=(self.figure_width,self.figure_height))
+            fig,axes=render.figure((self.figure_width,self.figure_height))
+            self.ax=axes[0]
+            self.followed=self.ax if render.PYPLOT else None
+            self.drawn=[]
+        return self.ax
 
     def show(self):
         numFigures=plt._pylab_helpers.Gcf.get_num_fig_managers()
@@ -104,24 +133,69 @@ class ABFplot:
         plt.show()
 
     def close(self,closeAll=True):
+        """forget our figure (closing it, or every figure, if it's pyplot's)."""
+        ax,self.ax=self.ax,None
+        if not render.PYPLOT:
+            return
         numFigures=plt._pylab_helpers.Gcf.get_num_fig_managers()
         if closeAll:
             self.log.debug("closing all %d figures"%numFigures)
             plt.close('all')
         else:
             self.log.debug("closing 1 figure (of %d)"%numFigures)
-            plt.close()
+            plt.close(ax.figure if ax and render.isPyplot(ax.figure) else None)
 
     def save(self,callit="misc",closeToo=True,fullpath=False):
-        """save the existing figure. does not close it."""
+        """
+        save our figure (the current pyplot figure if we have none). If
+        self.renderCache is True and the folder has a manifest, it isn't
+        rendered again if it was saved before from the same figure_ calls
+        (see drawing) and looks the same (see render.figureState).
+        """
         if fullpath is False:
             fname=self.abf.outPre+"plot_"+callit+".jpg"
         else:
             fname=callit
-        plt.savefig(fname)
-        self.log.info("saved [%s]",os.path.basename(fname))
+        fig=self.ax.figure if self.ax else plt.gcf()
+        db=None
+        if self.renderCache and len(self.drawn):
+            db=render.cacheManifest(fname)
+        key=None
+        if db:
+            key=render.cacheKey(self.abf,"ABFplot",{"drawn":self.drawn,
+                                "figure":render.figureState(fig)},db)
+        if render.isCached(db,[fname],key):
+            self.log.info("[%s] is unchanged, not rendering it",
+                          os.path.basename(fname))
+        else:
+            swhlab.common.save_atomic(fname,lambda f:
+                fig.savefig(f,format=os.path.splitext(fname)[1][1:]))
+            render.cached(db,[fname],self.abf.ID,key)
+            self.log.info("saved [%s]",os.path.basename(fname))
+        if db:
+            db.close()
         if closeToo:
-            plt.close()
+            self.close(False)
+
+    def params(self):
+        """return a dict of everything (but the data) a figure_ call uses."""
+        names=["figure_width","figure_height","figure_dpi","decimate",
+               "gridAlpha","title","traceColor","rainbow","colormap",
+               "marginX","marginY"]
+        params=dict([(x,getattr(self,x)) for x in names])
+        params["kwargs"]=dict(self.kwargs)
+        params["derivative"]=self.abf.derivative
+        params["channel"]=self.abf.channel
+        return params
+
+    def drawing(self,*call):
+        """
+        note a figure_ call (its name and arguments, with arrays given as
+        render.arrayHash digests) and our params() as it's drawn. save() keys
+        the render cache on these, so changing a setting after drawing (which
+        doesn't change the figure) doesn't either.
+        """
+        self.drawn.append(call+(self.params(),))
 
     ### misc
     def getColor(self,fraction,reverse=False):
@@ -130,11 +204,71 @@ class ABFplot:
             fraction=1-fraction
         return cm(fraction)
 
-    def setColorBySweep(self):
+    def sweepColor(self,sweep=None):
+        """return the color a sweep is plotted in."""
+        if sweep is None:
+            sweep=self.abf.sweep
         if self.rainbow:
-            self.kwargs["color"]=self.getColor(self.abf.sweep/self.abf.sweeps)
-        else:
-            self.kwargs["color"]=self.traceColor
+            return self.getColor(sweep/self.abf.sweeps)
+        return self.traceColor
+
+    def setColorBySweep(self,sweep=None):
+        self.kwargs["color"]=self.sweepColor(sweep)
+
+    def pixels(self):
+        """return how many pixels wide our figure will be saved."""
+        fig=self.figure().figure
+        return int(fig.get_size_inches()[0]*max(fig.dpi,self.figure_dpi))
+
+    def envelope(self,sweep,pixels):
+        """
+        return (X,Y) of a sweep (X in seconds from the start of the sweep)
+        decimated to look the same across this many pixels, or None if the
+        raw sweep should be plotted. Only set self.decimate=True if the plot
+        won't be zoomed in on afterwards.
+        """
+        if not self.decimate or self.abf.derivative:
+            return None
+        pyramid=decimate.load(self.abf,self.abf.channel)
+        found=pyramid.envelope(sweep,pixels)
+        if found is None:
+            return None
+        return found[0]/self.abf.pointsPerSec,found[1]
+
+    def sweepData(self,sweep,pixels):
+        """
+        return (X,Y) of a sweep to plot (X in seconds from the start of the
+        sweep): its envelope if it can be decimated, otherwise its raw data
+        (or derivative) straight from the sweep matrix.
+        """
+        envelope=self.envelope(sweep,pixels)
+        if envelope:
+            return envelope
+        if self.abf.derivative:
+            self.abf.setsweep(sweep)
+            return self.abf.sweepX2,np.ravel(self.abf.sweepD)
+        Y=self.abf.sweepMatrix(self.abf.channel)[sweep]
+        return np.arange(len(Y))/self.abf.pointsPerSec,Y
+
+    def plotLines(self,lines,colors,**kwargs):
+        """
+        plot a list of (X,Y) lines as a single LineCollection (one artist no
+        matter how many sweeps) with one color per line (or one for all).
+        kwargs (like self.kwargs) are given in plt.plot() terms.
+        """
+        kwargs.pop("color",None)
+        for short,name in [("lw","linewidths"),("linewidth","linewidths"),
+                           ("ls","linestyles"),("linestyle","linestyles")]:
+            if short in kwargs:
+                kwargs[name]=kwargs.pop(short)
+        segments=[np.column_stack((X,np.ravel(Y))) for X,Y in lines]
+        lines=matplotlib.collections.LineCollection(segments,colors=colors,
+                                                    **kwargs)
+        ax=self.figure()
+        ax.add_collection(lines)
+        ax.autoscale_view()
+        return lines
+
     ### plot modifications
 
     def comments(self,minutes=False):
@@ -145,28 +279,30 @@ class ABFplot:
         if self.comments==0:
             return
         self.log.debug("adding comments to plot")
+        ax=self.figure()
         for i,t in enumerate(self.abf.comment_times):
             if minutes:
                 t/=60.0
-            plt.axvline(t,color='r',ls=':')
-            X1,X2,Y1,Y2=plt.axis()
+            ax.axvline(t,color='r',ls=':')
+            X1,X2,Y1,Y2=ax.axis()
             Y2=Y2-abs(Y2-Y1)*.02
-            plt.text(t,Y2,self.abf.comment_tags[i],color='r',rotation='vertical',
+            ax.text(t,Y2,self.abf.comment_tags[i],color='r',rotation='vertical',
                      ha='right',va='top',weight='bold',alpha=.5,size=8,)
 
     def decorate(self,show=False,protocol=False):
         self.log.debug("decorating")
+        ax=self.figure()
         if self.title:
-            plt.title("{}".format(self.abf.ID))
-        plt.xlabel("seconds")
+            ax.set_title("{}".format(self.abf.ID))
+        ax.set_xlabel("seconds")
         if protocol:
-            plt.ylabel(self.abf.protoUnits2)
+            ax.set_ylabel(self.abf.protoUnits2)
         else:
-            plt.ylabel(self.abf.units2)
+            ax.set_ylabel(self.abf.units2)
         if self.gridAlpha:
-            plt.grid(alpha=self.gridAlpha)
-        plt.margins(self.marginX,self.marginY)
-        plt.tight_layout()
+            ax.grid(alpha=self.gridAlpha)
+        ax.margins(self.marginX,self.marginY)
+        render.layout(ax.figure)
         if show:
             plt.show()
 
@@ -176,33 +312,37 @@ class ABFplot:
         """plot every sweep of an ABF file (with comments)."""
         self.log.debug("creating chronological plot")
         self.figure()
+        self.drawing("chronological")
+        pixels=self.pixels()/max(1,self.abf.sweeps)
+        lines=[]
         for sweep in range(self.abf.sweeps):
-            self.abf.setsweep(sweep)
-            self.setColorBySweep()
-            if self.abf.derivative:
-                plt.plot(self.abf.sweepX,self.abf.sweepD,**self.kwargs)
-            else:
-                plt.plot(self.abf.sweepX,self.abf.sweepY,**self.kwargs)
+            X,Y=self.sweepData(sweep,pixels)
+            lines.append((X+sweep*self.abf.sweepInterval,Y))
+        self.plotLines(lines,[self.sweepColor(x) for x in range(len(lines))],
+                       **self.kwargs)
         self.comments()
         self.decorate()
 
     def figure_sweep(self,sweep=0):
         self.log.debug("plotting sweep %d",sweep)
-        self.figure()
+        ax=self.figure()
+        self.drawing("sweep",sweep)
         self.abf.setsweep(sweep)
-        plt.plot(self.abf.sweepX2,self.abf.sweepY,**self.kwargs)
+        ax.plot(self.abf.sweepX2,self.abf.sweepY,**self.kwargs)
         self.decorate()
 
     def figure_sweeps(self, offsetX=0, offsetY=0):
         """plot every sweep of an ABF file."""
         self.log.debug("creating overlayed sweeps plot")
         self.figure()
+        self.drawing("sweeps",offsetX,offsetY)
+        pixels=self.pixels()
+        lines=[]
         for sweep in range(self.abf.sweeps):
-            self.abf.setsweep(sweep)
-            self.setColorBySweep()
-            plt.plot(self.abf.sweepX2+sweep*offsetX,
-                     self.abf.sweepY+sweep*offsetY,
-                     **self.kwargs)
+            X,Y=self.sweepData(sweep,pixels)
+            lines.append((X+sweep*offsetX,Y+sweep*offsetY))
+        self.plotLines(lines,[self.sweepColor(x) for x in range(len(lines))],
+                       **self.kwargs)
         if offsetX:
             self.marginX=.05
         self.decorate()
@@ -210,8 +350,9 @@ class ABFplot:
     def figure_protocol(self):
         """plot the current sweep protocol."""
         self.log.debug("creating overlayed protocols plot")
-        self.figure()
-        plt.plot(self.abf.protoX,self.abf.protoY,color='r')
+        ax=self.figure()
+        self.drawing("protocol",self.abf.sweep)
+        ax.plot(self.abf.protoX,self.abf.protoY,color='r')
         self.marginX=0
         self.decorate(protocol=True)
 
@@ -219,12 +360,43 @@ class ABFplot:
         """plot the protocol of all sweeps."""
         self.log.debug("creating overlayed protocols plot")
         self.figure()
+        self.drawing("protocols")
+        lines=[]
         for sweep in range(self.abf.sweeps):
             self.abf.setsweep(sweep)
-            plt.plot(self.abf.protoX,self.abf.protoY,color='r')
+            lines.append((self.abf.protoX,self.abf.protoY))
+        self.plotLines(lines,'r')
         self.marginX=0
         self.decorate(protocol=True)
 
+    def figure_psd(self,freqs=None,psd=None,maxHz=None):
+        """
+        plot a power spectral density on log axes. If freqs and psd aren't
+        given (see swhlab.analysis.spectral), the whole-file PSD is used.
+        """
+        self.log.debug("creating PSD plot")
+        if freqs is None or psd is None:
+            import swhlab.analysis.spectral
+            freqs,psd=swhlab.analysis.spectral.psd_abf(self.abf)
+        ax=self.figure()
+        self.drawing("psd",maxHz,render.arrayHash(freqs),render.arrayHash(psd))
+        psd=np.atleast_2d(psd)
+        for i,sweepPsd in enumerate(psd):
+            if len(psd)>1 and self.rainbow:
+                kwargs=dict(self.kwargs,color=self.getColor(i/len(psd)))
+            else:
+                kwargs=dict(self.kwargs,color=self.traceColor)
+            ax.loglog(freqs[1:],sweepPsd[1:],**kwargs)
+        if maxHz:
+            ax.axis([None,maxHz,None,None])
+        if self.title:
+            ax.set_title("{}".format(self.abf.ID))
+        ax.set_xlabel("frequency (Hz)")
+        ax.set_ylabel("power (%s^2/Hz)"%self.abf.units)
+        if self.gridAlpha:
+            ax.grid(alpha=self.gridAlpha)
+        render.layout(ax.figure)
+
 
 
 if __name__=="__main__":
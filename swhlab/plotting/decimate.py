@@ -0,0 +1,119 @@
+"""
+min/max envelopes of sweeps at many resolutions, for fast plotting.
+
+Plotting every sample of a long recording sends millions of vertices to
+matplotlib, but an image only has so many pixel columns. If every column
+shows the minimum and maximum of the samples it covers, the picture is the
+same. A pyramid holds the min and max of blocks of every sweep, where each
+level's blocks are `factor` times bigger than the last (level 0 is the raw
+data, which isn't stored). It's computed once per ABF (with reshapes) and
+cached as ./swhlab/ID_data_pyramid.npz (if that folder exists), and plots
+use the coarsest level which still has a few blocks per pixel:
+    pyr=load(abf)
+    I,Y=pyr.envelope(sweep,pixels=2000) # None if raw data is needed
+    plt.plot(I/abf.pointsPerSec,Y)
+"""
+
+import os
+import logging
+import numpy as np
+
+import swhlab
+import swhlab.common as cm
+
+FACTOR=4 # each level's blocks are this many times bigger
+MIN_BLOCKS=64 # don't make levels with fewer blocks per sweep than this
+BLOCKS_PER_PIXEL=4 # plot the coarsest level with at least this many
+
+def levels(data,factor=FACTOR,minBlocks=MIN_BLOCKS):
+    """
+    given a sweep matrix (sweep,point) return a list of (mins,maxs) arrays
+    (sweep,block) of levels 1, 2, ... where level L has blocks of factor**L
+    points. Incomplete blocks at the end of sweeps are padded with the last
+    value so they still count.
+    """
+    result=[]
+    mins=maxs=np.atleast_2d(data)
+    while mins.shape[1]//factor>=minBlocks:
+        pad=-mins.shape[1]%factor
+        if pad:
+            mins=np.pad(mins,((0,0),(0,pad)),mode='edge')
+            maxs=np.pad(maxs,((0,0),(0,pad)),mode='edge')
+        shape=(mins.shape[0],mins.shape[1]//factor,factor)
+        mins=mins.reshape(shape).min(axis=2)
+        maxs=maxs.reshape(shape).max(axis=2)
+        result.append((mins,maxs))
+    return result
+
+class Pyramid:
+    def __init__(self,levels,points,factor=FACTOR):
+        """a list of (mins,maxs) levels of sweeps with this many points."""
+        self.levels=levels
+        self.points=points
+        self.factor=factor
+
+    def level(self,pixels):
+        """return the coarsest level with enough blocks per pixel (0 is raw)."""
+        level=0
+        for i in range(len(self.levels)):
+            if self.points/self.factor**(i+1)>=BLOCKS_PER_PIXEL*pixels:
+                level=i+1
+        return level
+
+    def envelope(self,sweep,pixels):
+        """
+        return (I,Y) of a sweep to plot across this many pixels, where I are
+        (fractional) sample indexes and Y alternates between the min and max
+        of each block. Returns None if the raw data should be plotted.
+        """
+        level=self.level(pixels)
+        if level==0:
+            return None
+        mins,maxs=self.levels[level-1]
+        blockSize=self.factor**level
+        I=np.repeat((np.arange(mins.shape[1])+.5)*blockSize-.5,2)
+        I[:2],I[-2:]=0,self.points-1 # span exactly what the raw data spans
+        Y=np.empty(mins.shape[1]*2)
+        Y[0::2],Y[1::2]=mins[sweep],maxs[sweep]
+        return I,Y
+
+def fname(abf,channel=0):
+    """return the filename of the pyramid cache of an ABF."""
+    return abf.outPre+"data_pyramid%s.npz"%("" if channel==0 else channel)
+
+def load(abf,channel=0):
+    """
+    return the Pyramid of an ABF channel, building it (and saving it if the
+    ./swhlab/ folder exists) unless it was cached for this exact ABF file.
+    """
+    log=logging.getLogger("swhlab decimate")
+    log.setLevel(swhlab.loglevel)
+    key=("pyramid",channel)
+    if key in abf.cache:
+        return abf.cache[key]
+    stat=os.stat(abf.filename)
+    cached=fname(abf,channel)
+    if os.path.exists(cached):
+        try:
+            npz=np.load(cached)
+            if (npz["size"],npz["mtime"])==(stat.st_size,stat.st_mtime):
+                nLevels=len([x for x in npz.files if x.startswith("min")])
+                pyr=Pyramid([(npz["min%d"%i],npz["max%d"%i])
+                             for i in range(nLevels)],
+                            int(npz["points"]),int(npz["factor"]))
+                abf.cache[key]=pyr
+                return pyr
+        except Exception:
+            log.error("ignoring unreadable pyramid [%s]",cached)
+    t1=cm.timeit()
+    data=abf.sweepMatrix(channel)
+    pyr=Pyramid(levels(data),data.shape[1])
+    log.debug("pyramid of %d levels took %s",len(pyr.levels),cm.timeit(t1))
+    abf.cache[key]=pyr
+    if os.path.isdir(abf.outFolder):
+        arrays={"size":stat.st_size,"mtime":stat.st_mtime,
+                "points":pyr.points,"factor":pyr.factor}
+        for i,(mins,maxs) in enumerate(pyr.levels):
+            arrays["min%d"%i],arrays["max%d"%i]=mins,maxs
+        cm.save_atomic(cached,lambda f:np.savez(f,**arrays))
+    return pyr
@@ -0,0 +1,214 @@
+"""
+figures which can be drawn and saved without pyplot, and reused.
+
+pyplot keeps global state (the current figure, a window manager for every
+figure) which isn't safe to share between threads and needs a GUI backend to
+show anything. Batch analysis never shows anything, so when PYPLOT is False
+(like in worker processes, see protocols.worker_init) figures are plain
+Figure objects on an Agg canvas. Making a figure and its axes isn't free, so
+every layout (size and grid of subplots) gets one figure per thread which is
+cleared and reused every time that layout is asked for again:
+    fig,axes=figure((8,8),2,2) # axes is a flat list (row by row)
+    axes[0].plot(X,Y)
+    layout(fig) # like tight_layout(), but remembered
+    fig.savefig("plot.jpg")
+Because of this, save a figure before asking for another of the same layout.
+
+tight_layout() has to measure every label, which is most of the time it takes
+to render a simple plot. Figures of the same layout with the same labels and
+tick labels (like every ABF of a protocol) get the same layout, so it's only
+worked out once and remembered.
+
+Figures saved in a folder with a manifest (see swhlab.indexing.manifest) can
+be cached: the key of what they're made from (cacheKey) is recorded when
+they're saved, and figures whose key didn't change aren't drawn again. The
+key only depends on the ABF and parameters, so it's checked before drawing
+anything. Analysis does this for every protocol (see protocols.run):
+    db=cacheManifest(fname)
+    key=cacheKey(abf,"sweeps",params,db)
+    if not isCached(db,[fname],key):
+        fig,axes=figure()
+        ... # draw
+        fig.savefig(fname)
+        cached(db,[fname],abf.ID,key)
+    if db:
+        db.close()
+Parameters have to cover everything that's drawn. ABFplot.save only caches if
+asked to (ABFplot.renderCache), and then keys on its figure_ calls and what
+the finished figure looks like (figureState).
+"""
+
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import swhlab.indexing.manifest as manifest
+from swhlab.version import __version__
+
+PYPLOT=True # make figures with pyplot (so they can be shown)
+CACHE=True # don't render figures which would come out the same
+TEMPLATE_VERSION=1 # change when figures are drawn differently so they get remade
+
+LOCAL=threading.local() # reusable figures of each thread
+LAYOUTS={} # subplot parameters tight_layout() found, by layoutKey()
+MAX_LAYOUTS=1000 # forget them all if there are more than this
+
+def figure(figsize=(8,6),rows=1,cols=1,sharex=False,sharey=False):
+    """
+    return (figure,axes) where axes is a flat list of a grid of subplots.
+    sharex and sharey are like those of plt.subplots() ("row", "col", etc.)
+    """
+    if PYPLOT:
+        import matplotlib.pyplot as plt
+        fig=plt.figure(figsize=figsize)
+        axes=fig.subplots(rows,cols,sharex=sharex,sharey=sharey,squeeze=False)
+        return fig,list(axes.flatten())
+    if not hasattr(LOCAL,"figures"):
+        LOCAL.figures={}
+    key=(tuple(figsize),rows,cols,sharex,sharey)
+    if key in LOCAL.figures:
+        fig,axes=LOCAL.figures[key]
+        clear(fig)
+        return fig,axes
+    fig=Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    axes=fig.subplots(rows,cols,sharex=sharex,sharey=sharey,squeeze=False)
+    axes=list(axes.flatten())
+    LOCAL.figures[key]=(fig,axes)
+    return fig,axes
+
+def clear(fig):
+    """clear what was drawn on a figure, but keep its axes."""
+    for ax in fig.axes:
+        ax.cla()
+        ax.set_facecolor(matplotlib.rcParams["axes.facecolor"])
+        ax.get_xaxis().set_visible(True)
+        ax.get_yaxis().set_visible(True)
+    for artist in list(fig.texts)+list(fig.legends):
+        artist.remove()
+
+def isPyplot(fig):
+    """return True if a figure is an open pyplot figure."""
+    manager=fig.canvas.manager
+    if manager is None:
+        return False
+    import matplotlib.pyplot as plt
+    return plt.fignum_exists(manager.num)
+
+def isOpen(fig):
+    """return True if a figure can still be drawn on."""
+    return fig.canvas.manager is None or isPyplot(fig)
+
+def layoutKey(fig):
+    """return everything which tight_layout() depends on as a tuple."""
+    key=[tuple(fig.get_size_inches())]
+    for ax in fig.axes:
+        key.append(ax.get_subplotspec().get_geometry()
+                   if ax.get_subplotspec() else tuple(ax.get_position().bounds))
+        key.append((ax.get_title("left"),ax.get_title(),ax.get_title("right"),
+                    ax.get_xlabel(),ax.get_ylabel(),
+                    ax.get_xaxis().get_visible(),ax.get_yaxis().get_visible()))
+        for axis in [ax.get_xaxis(),ax.get_yaxis()]:
+            key.append(tuple([x.get_text() for x in axis.get_ticklabels()
+                              if x.get_visible()]))
+    return tuple(key)
+
+def layout(fig):
+    """tight_layout() a figure, reusing the result for figures like it."""
+    key=layoutKey(fig)
+    if not key in LAYOUTS:
+        if len(LAYOUTS)>=MAX_LAYOUTS:
+            LAYOUTS.clear()
+        fig.tight_layout()
+        pars=fig.subplotpars
+        LAYOUTS[key]=dict(left=pars.left,right=pars.right,bottom=pars.bottom,
+                          top=pars.top,wspace=pars.wspace,hspace=pars.hspace)
+    fig.subplots_adjust(**LAYOUTS[key])
+
+### render cache
+
+def cacheManifest(fname):
+    """
+    return the Manifest of the folder a file is in (None if it has none, or
+    if figures aren't cached). Close it when done.
+    """
+    folder=os.path.dirname(os.path.abspath(fname))
+    if not CACHE or \
+       not os.path.exists(os.path.join(folder,manifest.MANIFEST_FNAME)):
+        return None
+    return manifest.Manifest(folder)
+
+def abfHash(abf,db=None):
+    """return (and remember) the content hash of an ABF."""
+    if not "hash" in abf.cache:
+        if db:
+            abf.cache["hash"]=db.abfHash(abf.filename)
+        else:
+            abf.cache["hash"]=manifest.fileHash(abf.filename)
+    return abf.cache["hash"]
+
+def cacheKey(abf,name,params={},db=None):
+    """
+    return a key (hex digest) of everything the figures called name (a plot
+    or an analysis) of an ABF depend on: the ABF's contents, the swhlab
+    version, TEMPLATE_VERSION, and parameters (a dict). It doesn't need
+    anything to be drawn, so it can be checked first. db is the Manifest of
+    the output folder (see cacheManifest), and the key is None without one.
+    """
+    if not CACHE or db is None:
+        return None
+    things=[abfHash(abf,db),__version__,TEMPLATE_VERSION,name,params]
+    text=json.dumps(things,sort_keys=True,default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+def arrayHash(data):
+    """return a key (hex digest) of the shape, type and contents of an array."""
+    data=np.ascontiguousarray(data)
+    sha=hashlib.sha1(str((data.shape,data.dtype.str)).encode())
+    sha.update(data)
+    return sha.hexdigest()
+
+def figureState(fig):
+    """
+    return a list of what can be seen on a finished figure without rendering
+    it: its size, texts, and every axes' limits, labels, scales, and artists
+    (what kind, and the data of lines or the text and place of texts).
+    """
+    state=[tuple(fig.get_size_inches()),fig.dpi,
+           [(x.get_text(),x.get_position()) for x in fig.texts]]
+    for ax in fig.axes:
+        artists=[]
+        for artist in ax.get_children():
+            thing=[type(artist).__name__,artist.get_visible()]
+            if hasattr(artist,"get_xydata"):
+                thing.append(arrayHash(artist.get_xydata()))
+            elif hasattr(artist,"get_text"):
+                thing.extend([artist.get_text(),artist.get_position()])
+            artists.append(thing)
+        state.append([ax.axis(),ax.get_title("left"),ax.get_title(),
+                      ax.get_title("right"),ax.get_xlabel(),ax.get_ylabel(),
+                      ax.get_xscale(),ax.get_yscale(),
+                      ax.get_xaxis().get_visible(),
+                      ax.get_yaxis().get_visible(),artists])
+    return state
+
+def isCached(db,fnames,key):
+    """return True if files (a list) all exist and were made with this key."""
+    if key is None or not len(fnames):
+        return False
+    for fname in fnames:
+        if not os.path.exists(fname) or db.renderKey(fname)!=key:
+            return False
+    return True
+
+def cached(db,fnames,ID,key):
+    """note that files (a list) of an ABF ID were made with this key."""
+    if key is None:
+        return
+    for fname in fnames:
+        db.rendered(fname,ID,key)
@@ -0,0 +1,111 @@
+"""
+small trace images drawn straight into a numpy array (no figures).
+
+Making a matplotlib figure and saving it takes hundreds of milliseconds, which
+adds up to minutes for a folder of hundreds of ABFs when all anyone wants is
+a little picture of each recording. A thumbnail only has a few hundred pixel
+columns, so every column is just the range (min to max) each sweep covers
+there. Those ranges are painted into an RGB array (later sweeps composited
+over earlier ones with alpha, so overlapping sweeps look denser) and written
+with Pillow:
+    thumbnail(abf) # makes ./swhlab/ID_thumb.png
+    image=rasterize(abf.sweepMatrix(),width=400,height=100)
+"""
+
+import os
+import logging
+import numpy as np
+from PIL import Image
+
+import swhlab
+import swhlab.common as cm
+
+WIDTH=400
+HEIGHT=100
+SUFFIX="thumb.png" # thumbnails of the index are ID_thumb.png
+BACKGROUND=(255,255,255)
+FORMATS={".png":"PNG",".jpg":"JPEG",".jpeg":"JPEG",".gif":"GIF"}
+
+def colors(sweeps,colormap="Dark2"):
+    """return a list of RGB colors (0-1) of sweeps, like ABFplot's rainbow."""
+    import matplotlib
+    try:
+        cmap=matplotlib.colormaps[colormap]
+    except AttributeError: # matplotlib < 3.5
+        import matplotlib.cm
+        cmap=matplotlib.cm.get_cmap(colormap)
+    return [cmap(x/sweeps)[:3] for x in range(sweeps)]
+
+def envelope(data,width):
+    """
+    given sweeps (sweep,point) return (mins,maxs) arrays (sweep,column) of
+    the range each sweep covers in each of this many columns. The ranges are
+    stretched to meet the neighboring column, so steep lines stay connected.
+    """
+    data=np.atleast_2d(data)
+    edges=np.linspace(0,data.shape[1],width,endpoint=False).astype(int)
+    mins=np.minimum.reduceat(data,edges,axis=1)
+    maxs=np.maximum.reduceat(data,edges,axis=1)
+    mins[:,1:],maxs[:,1:]=(np.minimum(mins[:,1:],maxs[:,:-1]),
+                           np.maximum(maxs[:,1:],mins[:,:-1]))
+    return mins,maxs
+
+def rasterize(data,width=WIDTH,height=HEIGHT,color=None,colormap="Dark2",
+              alpha=.8,margin=.05,background=BACKGROUND):
+    """
+    return an RGB image (uint8 array of height,width,3) of sweeps (a 2d array
+    of sweep,point) overlayed. Sweeps are one color (RGB 0-1) if given, or
+    colored by a colormap. The Y axis fits the data with a fractional margin.
+    """
+    data=np.atleast_2d(data)
+    mins,maxs=envelope(data,width)
+    lo,hi=np.nanmin(mins),np.nanmax(maxs)
+    pad=(hi-lo)*margin if hi>lo else 1 # flat lines go in the middle
+    lo,hi=lo-pad,hi+pad
+    tops=np.round((hi-maxs)/(hi-lo)*(height-1))
+    bottoms=np.round((hi-mins)/(hi-lo)*(height-1))
+    if color is None:
+        sweepColors=colors(len(data),colormap)
+    else:
+        sweepColors=[color]*len(data)
+    image=np.empty((height,width,3))
+    image[:]=np.array(background)/255
+    rows=np.arange(height)[:,None]
+    for sweep in range(len(data)):
+        covered=(rows>=tops[sweep])&(rows<=bottoms[sweep])
+        image[covered]+=(np.array(sweepColors[sweep])-image[covered])*alpha
+    return (image*255).round().astype(np.uint8)
+
+def save(image,fname):
+    """save an RGB array as an image (format by file extension)."""
+    fmt=FORMATS.get(os.path.splitext(fname)[1].lower(),"PNG")
+    cm.save_atomic(fname,lambda f:Image.fromarray(image).save(f,format=fmt))
+    return fname
+
+def thumbnail(abf,fname=None,width=WIDTH,height=HEIGHT,chronological=False,
+              colormap="Dark2",alpha=.8):
+    """
+    save a thumbnail of every sweep of an ABF (overlayed, or end to end if
+    chronological) as ./swhlab/ID_thumb.png (or fname) and return its path.
+    """
+    log=logging.getLogger("swhlab thumbnail")
+    log.setLevel(swhlab.loglevel)
+    if type(abf) is str:
+        abf=swhlab.ABF(abf)
+    if fname is None:
+        fname=abf.outPre+SUFFIX
+    t1=cm.timeit()
+    data=abf.sweepMatrix(abf.channel)
+    if chronological:
+        image=rasterize(data.reshape(1,-1),width,height,(0,0,1),alpha=1)
+    else:
+        image=rasterize(data,width,height,colormap=colormap,alpha=alpha)
+    save(image,fname)
+    log.debug("thumbnail [%s] took %s",os.path.basename(fname),cm.timeit(t1))
+    return fname
+
+if __name__=="__main__":
+    import glob
+    for fname in glob.glob(r"X:\Data\SCOTT\2017-01-09 AT1 NTS\*.abf"):
+        print(thumbnail(fname))
+    print("DONE")
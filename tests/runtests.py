@@ -6,6 +6,7 @@ import numpy as np
 import unittest
 import os
 import shutil
+import time
 import webbrowser
 import matplotlib.pyplot as plt
 import sys
@@ -157,6 +158,57 @@ class TEST_01_plot(unittest.TestCase):
         
         plt.axis([0,1,None,None])
         plot.save('./output/kwargs.jpg',fullpath=True)
+
+    def test_0060_decimate(self):
+        import swhlab.plotting.decimate as decimate
+        data=np.random.randn(3,100000)
+        pyramid=decimate.Pyramid(decimate.levels(data),data.shape[1])
+        I,Y=pyramid.envelope(1,pixels=500)
+        assert len(Y)<data.shape[1]/5
+        assert np.max(Y)==np.max(data[1]) and np.min(Y)==np.min(data[1])
+        assert I[0]==0 and I[-1]==data.shape[1]-1
+        assert pyramid.envelope(1,pixels=50000) is None # needs raw data
+        assert swhlab.PLOT(testAbfPath).decimate is False # unless asked to
+
+    def test_0070_oneArtist(self):
+        plot=swhlab.PLOT(testAbfPath)
+        plot.figure_sweeps()
+        assert len(plt.gca().lines)==0 and len(plt.gca().collections)==1
+        assert len(plt.gca().collections[0].get_segments())==plot.abf.sweeps
+        plot.close()
+
+    def test_0075_subplots(self):
+        plot=swhlab.PLOT(testAbfPath)
+        plt.figure(figsize=(10,10))
+        ax1=plt.subplot(211)
+        plot.figure_sweeps()
+        ax2=plt.subplot(212)
+        plot.figure_protocols()
+        assert len(plt.get_fignums())==1 # drawn where pyplot was pointing
+        assert len(ax1.collections)==1 and len(ax2.collections)==1
+        plot.save('./output/subplots.jpg',fullpath=True)
+
+    def test_0080_thumbnail(self):
+        import swhlab.plotting.thumbnail as thumbnail
+        image=thumbnail.rasterize(np.random.randn(3,10000),width=200,height=50)
+        assert image.shape==(50,200,3) and image.dtype==np.uint8
+        assert image.min()<255 # something was drawn
+        thumbnail.thumbnail(swhlab.ABF(testAbfPath),'./output/thumb.png')
+
+    def test_0090_headless(self):
+        import swhlab.plotting.render as render
+        plt.close('all')
+        render.PYPLOT=False
+        try:
+            plot=swhlab.PLOT(testAbfPath)
+            plot.figure_sweeps()
+            fig=plot.ax.figure
+            plot.save('./output/headless.png',fullpath=True)
+            plot.figure_sweeps()
+            assert plot.ax.figure is fig # reused
+            assert len(plt.get_fignums())==0 # pyplot never used
+        finally:
+            render.PYPLOT=True
         
 class TEST_02_APs(unittest.TestCase):
     """action potential detection"""    
@@ -218,7 +270,330 @@ class TEST_02_APs(unittest.TestCase):
         plt.tight_layout()
         plt.savefig('./output/APsFreqs.jpg')
         plt.close('all')
-        
+
+    def test_0030_spikeTrain(self):
+        abf=swhlab.ABF(testAbfPath)
+        APs=swhlab.AP(abf)
+        APs.detect()
+        train=swhlab.analysis.spikes.SpikeTrain(APs)
+        assert len(train.count())==abf.sweeps
+        assert np.sum(train.count())==len(APs.APs)
+        edges,rates=train.psth()
+        assert rates.shape==(abf.sweeps,len(edges)-1)
+        plt.figure()
+        plt.plot(edges[:-1],np.average(rates,axis=0),'.-',alpha=.5)
+        plt.ylabel("rate (Hz)")
+        plt.xlabel("time (seconds)")
+        plt.savefig('./output/APsPSTH.jpg')
+        plt.close('all')
+
+    def test_0040_streaming(self):
+        abf=swhlab.ABF(testAbfPath)
+        APs=swhlab.AP(abf)
+        APs.detect()
+        streamed=swhlab.analysis.apstream.detectABF(abf,chunkSec=.1)
+        assert len(streamed)==len(APs.APs)
+
+    def test_0041_streamingSmallChunks(self):
+        abf=swhlab.ABF(testAbfPath)
+        detectABF=swhlab.analysis.apstream.detectABF
+        whole=detectABF(abf,chunkSec=abf.sweepLength)
+        small=detectABF(abf,chunkSec=50.0/abf.pointsPerSec) # 50 samples
+        assert len(whole)
+        assert [ap["I"] for ap in small]==[ap["I"] for ap in whole]
+
+class TEST_03_analysis(unittest.TestCase):
+    """vectorized analysis of whole sweep matrices"""
+
+    def tearDown(self):
+        global ALLGOOD,LOG
+        for method, error in self._outcome.errors:
+            LOG+='\n%s: '%method
+            if error:
+                LOG+="FAIL [%s]"%str(error)
+                ALLGOOD=False
+            else:
+                LOG+="PASS"
+
+    def test_0010_sweepMatrix(self):
+        abf=swhlab.ABF(testAbfPath)
+        data=abf.sweepMatrix()
+        assert data.shape==(abf.sweeps,abf.sweepSize)
+        abf.setsweep(2)
+        assert np.allclose(data[2],abf.sweepY.flatten())
+
+    def test_0015_denoise(self):
+        abf=swhlab.ABF(testAbfPath)
+        data=abf.sweepMatrixDenoised()
+        assert data.shape==abf.sweepMatrix().shape
+        abf.setsweep(1)
+        assert np.allclose(abf.sweepYdenoised(),data[1])
+
+    def test_0016_psd(self):
+        abf=swhlab.ABF(testAbfPath)
+        freqs,psd=swhlab.analysis.spectral.psd_abf(abf,bySweep=True)
+        assert psd.shape==(abf.sweeps,len(freqs))
+        plot=swhlab.PLOT(abf)
+        kwargs=dict(plot.kwargs)
+        plot.figure_psd(freqs,psd)
+        assert plot.kwargs==kwargs # colors don't leak into later figures
+        plot.save('./output/psd.jpg',fullpath=True)
+
+    def test_0016_spectrogramShort(self):
+        abf=swhlab.ABF(testAbfPath)
+        segmentSec=abf.sweepLength*abf.sweeps*2 # longer than the recording
+        times,freqs,power=swhlab.analysis.spectral.spectrogram_abf(abf,segmentSec)
+        assert len(times)==0 and power.shape==(0,len(freqs))
+        assert len(freqs)==int(segmentSec*abf.pointsPerSec)//2+1
+
+    def test_0017_epochTable(self):
+        abf=swhlab.ABF(testAbfPath)
+        table=abf.epochTable()
+        assert np.all(table["I2"]>=table["I1"])
+
+    def test_0018_memtest(self):
+        pointsPerMs=20
+        data=np.zeros((3,6000))
+        data[:,2000:4000]=-100 # 100 pA less during a -10 mV step
+        data[:,4000:]+=500*np.exp(-np.arange(2000)/pointsPerMs) # tau=1 ms
+        stats=swhlab.analysis.memtest.memtest_VC(data,2000,4000,6000,10,
+                                                 pointsPerMs)
+        assert np.allclose(stats["Ih"],0)
+        assert np.allclose(stats["Ra"],20) # 10 mV / 500 pA
+        assert np.allclose(stats["Rm"],100) # 10 mV / 100 pA
+        assert np.allclose(stats["tau"],1,rtol=1e-3)
+        assert np.allclose(stats["Cm"],50,rtol=1e-3)
+
+    def test_0019_fitting(self):
+        x=np.arange(500)
+        taus=np.array([10,50,200])
+        Y=5*np.exp(-x[None,:]/taus[:,None])-70
+        result=swhlab.fitting.fit_exp(Y,dx=.1)
+        assert np.all(result["ok"])
+        assert np.allclose(result["tau"],taus*.1,rtol=1e-3)
+        flat=np.vstack((np.full(500,-70.0),np.zeros(500)))
+        for offset in [True,False]:
+            assert not np.any(swhlab.fitting.fit_exp(flat,offset=offset)["ok"])
+        Y=10*np.exp(-x/5.0)+5*np.exp(-x/80.0)-60
+        result=swhlab.fitting.fit_biexp(Y)
+        assert np.allclose([result["tau1"][0],result["tau2"][0]],[5,80],rtol=1e-2)
+
+    def test_0020_events(self):
+        abf=swhlab.ABF(testAbfPath)
+        events=swhlab.analysis.events.Events(abf)
+        events.sign=1 # gain.abf is current clamp
+        events.detect()
+        assert len(events.get_bySweep("count"))==abf.sweeps
+        for field in ["sweep","amplitude","msRise","msDecay"]:
+            assert len(events.events[field])==len(events.events)
+
+    def test_0021_eventsDeconvolution(self):
+        abf=swhlab.ABF(testAbfPath)
+        events=swhlab.analysis.events.Events(abf)
+        events.method="deconvolution"
+        events.sign=1
+        events.detect()
+        assert len(events.get_bySweep("count"))==abf.sweeps
+
+    def test_0022_eventsAtStart(self):
+        import warnings
+        t=np.arange(300.0)
+        data=np.full((1,300),-70.0)
+        data[0]+=10*(np.exp(-t/20)-np.exp(-t/2))
+        with warnings.catch_warnings():
+            warnings.simplefilter("error") # no mean of an empty slice
+            stats=swhlab.analysis.events.measure(data,np.array([0,0]),
+                                                 np.array([0,3]),1,1,10,100)
+        assert np.all(stats["baseline"]==-70)
+        assert np.all(stats["amplitude"]>6)
+
+    def test_0030_stack(self):
+        abf=swhlab.ABF(testAbfPath)
+        stack=swhlab.analysis.stack.stack_sweepTime(abf,.5,.1,.2)
+        assert stack.chunks.shape==(abf.sweeps,len(stack.Xs))
+        assert len(stack.average)==len(stack.Xs)==len(stack.stdev)
+        data=abf.sweepMatrix(abf.channel)
+        I=int(round(.5*abf.pointsPerSec))
+        assert np.allclose(stack.chunks[:,np.argmin(np.abs(stack.Xs))],data[:,I])
+        stack=swhlab.analysis.stack.stack_times(abf,[abf.sweepLength],.1,.1)
+        assert len(stack)==1
+
+    def test_0031_evoked(self):
+        pointsPerMs=10
+        Xs=np.arange(-500,2000)/(pointsPerMs*1000.0)
+        ms=Xs*1000
+        response=np.where(ms<2,0,-2*(ms-2)) # 10 ms rise to -20 at 12 ms
+        response=np.where(ms>12,-20*np.exp(-(ms-12)/10),response) # tau=10 ms
+        chunks=5+np.vstack((response,2*response))
+        stack=swhlab.analysis.stack.Stack(chunks,Xs,np.arange(2),np.zeros(2))
+        stats=swhlab.analysis.evoked.measure_stack(stack,None,pointsPerMs)
+        assert np.allclose(stats["baseline"],5)
+        assert np.allclose(stats["amplitude"],[-20,-40])
+        assert np.allclose(stats["latency"],3)
+        assert np.allclose(stats["timeToPeak"],12)
+        assert np.allclose(stats["msRise"],8)
+        assert np.allclose(stats["msDecay"],10)
+        assert np.allclose(stats["area"],[-.3,-.6],rtol=1e-3)
+
+    def test_0032_pipeline(self):
+        abf=swhlab.ABF(testAbfPath)
+        pipe=swhlab.analysis.pipeline.Pipeline(abf)
+        aps=pipe.add(swhlab.analysis.pipeline.APs())
+        avg=pipe.add(swhlab.analysis.pipeline.Average())
+        window=pipe.add(swhlab.analysis.pipeline.WindowStats(.1,.2))
+        pipe.run()
+        APs=swhlab.AP(abf)
+        APs.detect()
+        assert len(aps.result.APs)==len(APs.APs)
+        assert len(avg.result["average"])==abf.sweepSize
+        assert len(window.result["mean"])==abf.sweeps
+
+    def test_0033_analyzeMany(self):
+        import swhlab.analysis.protocols
+        reports=swhlab.analysis.protocols.analyze_many([testAbfPath],workers=1)
+        assert len(reports)==1 and reports[0]["error"] is None
+        for fname in reports[0]["outputs"]:
+            assert os.path.exists(fname)
+
+class TEST_04_indexing(unittest.TestCase):
+    """folder scanning, manifests, and other indexing tools"""
+
+    def tearDown(self):
+        global ALLGOOD,LOG
+        for method, error in self._outcome.errors:
+            LOG+='\n%s: '%method
+            if error:
+                LOG+="FAIL [%s]"%str(error)
+                ALLGOOD=False
+            else:
+                LOG+="PASS"
+
+    def test_0010_manifest(self):
+        import swhlab.indexing.manifest
+        manifest=swhlab.indexing.manifest.Manifest('./output')
+        manifest.forget("gain")
+        assert manifest.stale([testAbfPath])==[testAbfPath]
+        manifest.record({"fname":testAbfPath,"protocol":"test","outputs":[]})
+        assert manifest.stale([testAbfPath])==[]
+        assert manifest.get("gain")["protocol"]=="test"
+        made=["gain_plot_test.jpg"]
+        manifest.record({"fname":testAbfPath,"outputs":made})
+        assert manifest.stale([testAbfPath],made)==[]
+        assert manifest.stale([testAbfPath],[])==[testAbfPath]
+        manifest.record({"fname":testAbfPath,"outputs":made,"error":"oops"})
+        assert manifest.stale([testAbfPath],[])==[] # failures aren't retried
+        sha=manifest.get("gain")["hash"]
+        manifest.record({"fname":testAbfPath,"hash":"given"}) # not read again
+        assert manifest.get("gain")["hash"]=="given"
+        manifest.record({"fname":testAbfPath,"hash":None})
+        assert manifest.stale([testAbfPath])==[] # until it's modified
+        manifest.forget("gain")
+        manifest.record({"fname":testAbfPath})
+        assert manifest.get("gain")["hash"]==sha
+        manifest.forget("gain")
+        manifest.close()
+
+    def test_0020_scanner(self):
+        import swhlab.indexing.scanner
+        scanner=swhlab.indexing.scanner.Scanner('./abfs')
+        diff=scanner.scan()
+        assert "gain.abf" in diff["added"]
+        diff=scanner.scan()
+        assert not len(swhlab.indexing.scanner.changed(diff))
+        assert not os.path.exists('./abfs/.scan.json') # raw data is untouched
+
+    def test_0030_groups(self):
+        import swhlab.common as cm
+        files=['16o14002.abf','16o14001.abf','16o14001.tif','16o14003.abf']
+        assert cm.abfSort(['16o14002','16o14001'])==['16o14001','16o14002']
+        groups=cm.abfGroups(files)
+        assert groups=={'16o14001':['16o14001','16o14002','16o14003']}
+        groupFiles=cm.abfGroupFiles(groups,files)
+        assert '16o14001.tif' in groupFiles['16o14001']
+
+    def test_0040_watch(self):
+        import swhlab.indexing.watch
+        watcher=swhlab.indexing.watch.Watcher('./output',settle=0,interval=0,
+                                              polling=True)
+        shutil.copy(testAbfPath,'./output/watched.abf')
+        assert watcher.poll()==[os.path.abspath('./output/watched.abf')]
+        assert watcher.poll()==[] # unchanged, so not queued again
+        assert watcher.work.get()==os.path.abspath('./output/watched.abf')
+        os.remove('./output/watched.abf')
+        watcher.close()
+
+    def test_0050_scheduler(self):
+        import swhlab.indexing.scheduler
+        sched=swhlab.indexing.scheduler.Scheduler()
+        sched.add("a",len,["abc"])
+        sched.add("b",max,[1,2],kind="cpu")
+        sched.add("c",lambda: sched.result("a")+sched.result("b"),deps=["a","b"])
+        sched.add("d",int,["not a number"])
+        sched.add("e",str,[1],deps=["d"]) # skipped since "d" fails
+        sched.add("f",str,[2],deps=["d"],anyway=True)
+        errors=sched.run()
+        assert sched.result("a")==3 and sched.result("b")==2
+        assert sched.result("c")==5
+        assert sched.result("e") is None
+        assert sched.result("f")=="2"
+        assert sorted(errors.keys())==["d","e"]
+
+    def test_0060_renderCache(self):
+        import swhlab.indexing.server
+        cache=swhlab.indexing.server.RenderCache('./output/cache',maxMB=1)
+        for fname in ["a.jpg","b.jpg","c.jpg"]:
+            with open(cache.path(fname),'wb') as f:
+                f.write(b"x"*400000)
+            cache.add([fname])
+            cache.get("a.jpg") # keep using a.jpg
+        assert cache.get("a.jpg") and cache.get("c.jpg")
+        assert not cache.get("b.jpg") # least recently used
+        shutil.rmtree('./output/cache')
+
+    def test_0070_figureCache(self):
+        import swhlab.indexing.manifest
+        folder='./output/figures'
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        swhlab.indexing.manifest.Manifest(folder).close()
+        fname=os.path.join(folder,'sweeps.jpg')
+        mtimes=[]
+        for colormap,zoom,cache in [("Dark2",None,True),("Dark2",None,True),
+                                    ("jet",None,True),("jet",None,True),
+                                    ("jet",1,True),("jet",1,False)]:
+            plot=swhlab.PLOT(testAbfPath)
+            plot.renderCache=cache
+            plot.colormap=colormap
+            plot.figure_sweeps()
+            plot.colormap="Dark2" # after drawing, so it changes nothing
+            if zoom:
+                plot.ax.axis([0,zoom,None,None])
+            plot.save(fname,fullpath=True)
+            mtimes.append(os.path.getmtime(fname))
+            time.sleep(.01)
+        assert mtimes[0]==mtimes[1] # unchanged, so not rendered again
+        assert mtimes[1]!=mtimes[2] # different colors
+        assert mtimes[2]==mtimes[3]
+        assert mtimes[3]!=mtimes[4] # zoomed in
+        assert mtimes[4]!=mtimes[5] # not cached unless asked
+        shutil.rmtree(folder)
+
+    def test_0075_analysisCache(self):
+        import swhlab.analysis.protocols as protocols
+        import swhlab.indexing.manifest
+        folder='./output/analysis'
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        swhlab.indexing.manifest.Manifest(folder).close()
+        report=protocols.analyze_file(testAbfPath,outFolder=folder)
+        mtimes=[os.path.getmtime(x) for x in report["outputs"]]
+        time.sleep(.01)
+        again=protocols.analyze_file(testAbfPath,outFolder=folder)
+        assert report["error"] is None and again["error"] is None
+        assert again["outputs"]==report["outputs"]
+        assert [os.path.getmtime(x) for x in again["outputs"]]==mtimes
+        shutil.rmtree(folder)
+
 class TEST_99_html(unittest.TestCase):
     """create an index page for ./output"""   
     